@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import UserProfile, Chat
+from .models import UserProfile, Conversation, Chat
+from . import search
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -19,9 +20,17 @@ class UserProfileAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'title', 'created_at', 'updated_at')
+    list_filter = ('updated_at',)
+    search_fields = ('user__username', 'title')
+    readonly_fields = ('created_at', 'updated_at')
+    ordering = ('-updated_at',)
+
 @admin.register(Chat)
 class ChatAdmin(admin.ModelAdmin):
-    list_display = ('user', 'message_preview', 'response_preview', 'timestamp')
+    list_display = ('user', 'conversation', 'message_preview', 'response_preview', 'timestamp')
     list_filter = ('timestamp', 'user')
     search_fields = ('user__username', 'message', 'response')
     readonly_fields = ('timestamp',)
@@ -30,7 +39,7 @@ class ChatAdmin(admin.ModelAdmin):
 
     fieldsets = (
         ('Chat Information', {
-            'fields': ('user', 'message', 'response')
+            'fields': ('user', 'conversation', 'message', 'response')
         }),
         ('Timestamps', {
             'fields': ('timestamp',),
@@ -38,6 +47,16 @@ class ChatAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Match message and response text through the full-text index instead
+        of LIKE scans; usernames are still matched directly.
+        """
+        if not search_term:
+            return queryset, False
+        matches = search.filter_matching(queryset, search_term)
+        return matches | queryset.filter(user__username__icontains=search_term), False
+
     def message_preview(self, obj):
         return obj.message[:50] + '...' if len(obj.message) > 50 else obj.message
     message_preview.short_description = 'Message'
@@ -1,9 +1,30 @@
+import functools
 import os
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+import threading
+import time
 import logging
-from typing import Optional, Dict, Any, List
+from typing import TYPE_CHECKING, Callable, Optional, Dict, Any, Iterator, List, Sequence, Tuple
 from pathlib import Path
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from . import metrics
+from .generation import (
+    GENERATION_KEYS, MAX_SENTENCES, TURN_MARKER, echoes_prompt, prompt_words, reply_is_final, truncate_at_stop
+)
+from .kv_cache import ConversationCache, PrefixCache
+from .profiling import inference_profiler
+from .response_cache import ResponseCache
+from .ipc import InferenceClient, InferenceServerError
+from .speculative import SpeculativeStats, track_speculation
+
+# torch, transformers and the modules built on them are imported where they
+# are first needed, so importing this module (and the views) stays cheap for
+# management commands, migrations and processes that never run inference.
+if TYPE_CHECKING:
+    import torch
+    from transformers import StoppingCriteriaList
 
 logger = logging.getLogger(__name__)
 
@@ -24,15 +45,159 @@ class AIModelService:
         # Model configuration - Upgraded to modern Small Language Model (SLM)
         self.model_name = "TinyLlama/TinyLlama-1.1B-Chat-v1.0" 
         self.max_length = 2048
+        self.max_new_tokens = 100
         self.temperature = 0.7
         self.top_p = 0.95
-        self.do_sample = True
+        self.do_sample = getattr(settings, 'AI_DO_SAMPLE', True)
+        # End decoding once post-processing would discard the rest of the reply
+        self.early_stop = getattr(settings, 'AI_EARLY_STOP', True)
+        # A fixed seed makes sampled responses reproducible and therefore cacheable
+        self.generation_seed = getattr(settings, 'AI_GENERATION_SEED', None)
+        self._seed_lock = threading.Lock()
+
+        # Continuous batching merges concurrent requests into one decode loop
+        self.continuous_batching = getattr(settings, 'AI_CONTINUOUS_BATCHING', False)
+        self.max_batch_size = getattr(settings, 'AI_MAX_BATCH_SIZE', 8)
+        self.batching_engine = None
+
+        # Reuse attention keys/values of the system prompt and other hot prefixes
+        prefix_cache_size = getattr(settings, 'AI_PREFIX_CACHE_SIZE', 8)
+        self.prefix_cache = PrefixCache(
+            capacity=prefix_cache_size,
+            max_bytes=getattr(settings, 'AI_PREFIX_CACHE_MAX_MB', 256) * 1024 * 1024
+        ) if prefix_cache_size > 0 else None
+        # Keep each conversation's KV state between turns
+        conversation_cache_size = getattr(settings, 'AI_CONVERSATION_CACHE_SIZE', 64)
+        self.conversation_cache = ConversationCache(
+            max_entries=conversation_cache_size,
+            ttl=getattr(settings, 'AI_CONVERSATION_CACHE_TTL', 1800),
+            max_bytes=getattr(settings, 'AI_CONVERSATION_CACHE_MAX_MB', 512) * 1024 * 1024
+        ) if conversation_cache_size > 0 else None
+        # Finished responses for repeated deterministic prompts
+        self.response_cache = self._build_response_cache() if getattr(settings, 'AI_RESPONSE_CACHE', False) else None
+        self.system_prompt = "You are NOVA, a friendly and highly intelligent AI assistant. You provide clear, helpful, and detailed responses to users."
+
+        # CPU inference precision: "float32", "bfloat16" or dynamically quantized "int8"
+        self.cpu_precision = getattr(settings, 'AI_MODEL_CPU_PRECISION', 'float32')
+
+        # "mmap" shares one read-only copy of the weights between worker processes
+        self.load_mode = getattr(settings, 'AI_MODEL_LOAD_MODE', 'default')
+        self.shared_weights_dir = Path(getattr(settings, 'AI_MODEL_SHARED_DIR', self.model_path.parent / "shared_weights"))
+        if self.load_mode == "mmap" and self.cpu_precision == "int8":
+            # Quantizing builds private int8 copies in every worker, defeating the shared mapping
+            logger.warning("int8 precision cannot share weights between workers; using float32 in mmap load mode")
+            self.cpu_precision = "float32"
+
+        # Speculative decoding: "" (off), "prompt_lookup" (n-gram drafts taken from the
+        # prompt, no second model) or "draft" (a small draft model proposes tokens)
+        self.speculative_mode = getattr(settings, 'AI_SPECULATIVE_MODE', '')
+        self.draft_model_name = getattr(settings, 'AI_DRAFT_MODEL', '')
+        self.speculative_tokens = getattr(settings, 'AI_SPECULATIVE_TOKENS', 5)
+        self.draft_model = None
+        self.draft_tokenizer = None
+        self.speculative_stats = SpeculativeStats()
+
+        # Forward generation to a standalone inference server instead of loading the model here
+        self.inference_socket = getattr(settings, 'AI_INFERENCE_SOCKET', '')
+        self.inference_client = InferenceClient(
+            self.inference_socket,
+            pool_size=getattr(settings, 'AI_INFERENCE_CLIENT_POOL_SIZE', 8),
+            timeout=getattr(settings, 'AI_INFERENCE_TIMEOUT', 120)
+        ) if self.inference_socket else None
+
+        # Load lifecycle reported by the readiness endpoint:
+        # not_loaded -> loading -> (warming ->) ready, or failed
+        self.load_state = "not_loaded"
+        self._load_lock = threading.Lock()
+        self._warmup_thread = None
+
+    def _build_response_cache(self) -> ResponseCache:
+        backend = None
+        backend_path = getattr(settings, 'AI_RESPONSE_CACHE_BACKEND', '')
+        if backend_path:
+            backend = import_string(backend_path)(**getattr(settings, 'AI_RESPONSE_CACHE_OPTIONS', {}))
+        return ResponseCache(
+            max_entries=getattr(settings, 'AI_RESPONSE_CACHE_SIZE', 1024),
+            backend=backend
+        )
 
     def load_model(self) -> bool:
         """
         Load the AI model from the models directory or Hugging Face Hub.
+        Safe to call from several threads; only the first caller loads.
         Returns True if successful, False otherwise.
         """
+        with self._load_lock:
+            if self.model_loaded:
+                return True
+            self.load_state = "loading"
+            loaded = self._timed_load()
+            self.load_state = "ready" if loaded else "failed"
+            return loaded
+
+    def warm_up(self) -> bool:
+        """
+        Load the model and run a short generation to prime kernels and
+        allocator pools before real traffic arrives.
+        Returns True if the model is ready to serve.
+        """
+        import torch
+
+        with self._load_lock:
+            if not self.model_loaded:
+                self.load_state = "loading"
+                if not self._timed_load():
+                    self.load_state = "failed"
+                    return False
+            if self.inference_client:
+                # The inference server warms up its own replicas
+                self.load_state = "ready"
+                return True
+            self.load_state = "warming"
+
+        try:
+            inputs = self.tokenizer(self._enhance_prompt("Hello"), return_tensors="pt").to(self.model.device)
+            with torch.no_grad():
+                self.model.generate(
+                    **inputs,
+                    max_new_tokens=8,
+                    do_sample=False,
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+            logger.info("AI model warm-up generation finished")
+        except Exception as e:
+            logger.warning(f"AI model warm-up generation failed: {e}")
+
+        self.load_state = "ready"
+        return True
+
+    def start_background_warmup(self):
+        """
+        Run warm_up() on a daemon thread so startup is not blocked.
+        """
+        if self._warmup_thread and self._warmup_thread.is_alive():
+            return
+        self._warmup_thread = threading.Thread(target=self.warm_up, name="nova-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    @property
+    def is_ready(self) -> bool:
+        return self.load_state == "ready"
+
+    def _timed_load(self) -> bool:
+        """
+        _load_model(), recording how long it took; callers hold _load_lock.
+        """
+        started = time.perf_counter()
+        loaded = self._load_model()
+        metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - started)
+        return loaded
+
+    def _load_model(self) -> bool:
+        from transformers import AutoTokenizer
+
+        if self.inference_client:
+            return self._connect_inference_server()
         try:
             logger.info("Loading AI model...")
 
@@ -45,28 +210,13 @@ class AIModelService:
                 if self.tokenizer.pad_token is None:
                     self.tokenizer.pad_token = self.tokenizer.eos_token
 
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                    device_map="auto" if torch.cuda.is_available() else None,
-                    low_cpu_mem_usage=True
-                )
+                self.model = self._load_weights(self.model_name)
 
                 # Create pipeline for high-quality instruction following
-                self.pipeline = pipeline(
-                    "text-generation",
-                    model=self.model,
-                    tokenizer=self.tokenizer,
-                    device=0 if torch.cuda.is_available() else -1,
-                    max_new_tokens=512,  # Allow longer, helpful responses
-                    temperature=0.7,
-                    top_p=self.top_p,
-                    do_sample=self.do_sample,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.1
-                )
+                self.pipeline = self._build_pipeline()
 
                 self.model_loaded = True
+                self._on_model_loaded()
                 logger.info("AI model loaded successfully from Hugging Face Hub")
                 return True
 
@@ -79,26 +229,12 @@ class AIModelService:
                     if model_files:
                         try:
                             self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_path))
-                            self.model = AutoModelForCausalLM.from_pretrained(
-                                str(self.model_path),
-                                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                                device_map="auto" if torch.cuda.is_available() else None,
-                                low_cpu_mem_usage=True
-                            )
-
-                            self.pipeline = pipeline(
-                                "text-generation",
-                                model=self.model,
-                                tokenizer=self.tokenizer,
-                                device=0 if torch.cuda.is_available() else -1,
-                                max_length=self.max_length,
-                                temperature=self.temperature,
-                                top_p=self.top_p,
-                                do_sample=self.do_sample,
-                                pad_token_id=self.tokenizer.eos_token_id
-                            )
+                            self.model = self._load_weights(str(self.model_path))
+
+                            self.pipeline = self._build_pipeline()
 
                             self.model_loaded = True
+                            self._on_model_loaded()
                             logger.info("AI model loaded successfully from local directory")
                             return True
 
@@ -116,119 +252,810 @@ class AIModelService:
             logger.error(f"Error loading AI model: {e}")
             return False
 
-    def generate_response(self, prompt: str, max_length: Optional[int] = None) -> str:
+    def _connect_inference_server(self) -> bool:
+        """
+        Client mode: check that the inference server answers instead of loading a model.
+        """
+        try:
+            status = self.inference_client.ping()
+        except (InferenceServerError, OSError) as e:
+            logger.error(f"Inference server at {self.inference_socket} is not reachable: {e}")
+            return False
+        logger.info(f"Connected to inference server at {self.inference_socket} ({status.get('load_state')})")
+        self.model_loaded = True
+        return True
+
+    def _load_weights(self, source: str):
+        """
+        Load model weights from a Hub id or local directory.
+
+        In "mmap" load mode on CPU the weights are exported once to a shared
+        directory and every worker maps that file instead of holding its own copy.
+        On CPU the configured precision (float32, bfloat16 or int8) is applied.
+        """
+        import torch
+        from transformers import AutoModelForCausalLM
+        from .shared_weights import export_shared_weights, load_shared_model, shared_weights_exist
+
+        dtype = torch.float16 if torch.cuda.is_available() else self._cpu_dtype()
+
+        if self.load_mode == "mmap" and not torch.cuda.is_available():
+            shared_dir = self.shared_weights_dir / f"{source.strip('/').replace('/', '--')}-{str(dtype).split('.')[-1]}"
+            if not shared_weights_exist(shared_dir):
+                model = AutoModelForCausalLM.from_pretrained(source, torch_dtype=dtype, low_cpu_mem_usage=True)
+                export_shared_weights(model, shared_dir)
+                del model
+            logger.info(f"Mapping shared model weights from {shared_dir}")
+            model = load_shared_model(shared_dir, dtype)
+        else:
+            model = AutoModelForCausalLM.from_pretrained(
+                source,
+                torch_dtype=dtype,
+                device_map="auto" if torch.cuda.is_available() else None,
+                low_cpu_mem_usage=True
+            )
+
+        if self.cpu_precision == "int8" and not torch.cuda.is_available():
+            model = self._quantize_int8(model)
+        return model
+
+    def _cpu_dtype(self) -> "torch.dtype":
+        """
+        Floating point dtype used for CPU weights and activations.
+        """
+        import torch
+
+        if self.cpu_precision == "bfloat16":
+            if self._cpu_supports_bfloat16():
+                return torch.bfloat16
+            logger.warning("CPU has no native bfloat16 support, falling back to float32")
+        return torch.float32
+
+    @staticmethod
+    def _cpu_supports_bfloat16() -> bool:
+        import torch
+
+        checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported", "_is_arm_neon_bf16_supported")
+        return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+    @staticmethod
+    def _quantize_int8(model):
+        """
+        Apply dynamic int8 quantization to the Linear layers, keeping the
+        output projection in float for accuracy.
+        """
+        import torch
+
+        qconfig_spec = {
+            name: torch.ao.quantization.default_dynamic_qconfig
+            for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear) and name != "lm_head"
+        }
+        logger.info(f"Quantizing {len(qconfig_spec)} Linear layers to int8")
+        return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8)
+
+    def _on_model_loaded(self):
+        """
+        Set up helpers that need the loaded model and tokenizer.
+        """
+        self._start_batching_engine()
+        self._prime_prefix_cache()
+        self._setup_speculative_decoding()
+
+    def _setup_speculative_decoding(self):
+        """
+        Load the draft model if one is configured and start counting
+        accepted draft tokens. Falls back to plain decoding on any problem.
+        """
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        if not self.speculative_mode:
+            return
+        if self.batching_engine:
+            logger.warning("Speculative decoding is not used together with continuous batching")
+            self.speculative_mode = ""
+            return
+
+        if self.speculative_mode == "draft":
+            if not self.draft_model_name:
+                logger.warning("Speculative mode 'draft' needs AI_DRAFT_MODEL; using plain decoding")
+                self.speculative_mode = ""
+                return
+            try:
+                self.draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_model_name)
+                self.draft_model = AutoModelForCausalLM.from_pretrained(
+                    self.draft_model_name, torch_dtype=self._cpu_dtype(), low_cpu_mem_usage=True
+                )
+                self.draft_model.eval()
+            except Exception as e:
+                logger.warning(f"Could not load draft model {self.draft_model_name}: {e}")
+                self.speculative_mode = ""
+                self.draft_model = self.draft_tokenizer = None
+                return
+        elif self.speculative_mode != "prompt_lookup":
+            logger.warning(f"Unknown speculative mode '{self.speculative_mode}'; using plain decoding")
+            self.speculative_mode = ""
+            return
+
+        track_speculation(self.model, self.speculative_stats)
+        logger.info(f"Speculative decoding enabled ({self.speculative_mode}, {self.speculative_tokens} tokens)")
+
+    def _prime_prefix_cache(self):
+        """
+        Precompute and pin the KV cache for the fixed system prompt.
+        """
+        import torch
+        from transformers import DynamicCache
+
+        if self.prefix_cache is None:
+            return
+        try:
+            prefix_ids = self.tokenizer(self._system_prefix()).input_ids
+            with torch.no_grad():
+                outputs = self.model(
+                    input_ids=torch.tensor([prefix_ids], device=self.model.device),
+                    past_key_values=DynamicCache(),
+                    use_cache=True
+                )
+            self.prefix_cache.put(prefix_ids, outputs.past_key_values, pinned=True)
+            logger.info(f"Cached system prompt prefix ({len(prefix_ids)} tokens)")
+        except Exception as e:
+            logger.warning(f"Failed to precompute system prompt cache: {e}")
+
+    def _start_batching_engine(self):
+        """
+        Start the continuous batching scheduler if it is enabled in settings.
+        """
+        from .batching import ContinuousBatchingEngine
+
+        if not self.continuous_batching or self.batching_engine:
+            return
+        self.batching_engine = ContinuousBatchingEngine(
+            self.model,
+            self.tokenizer,
+            max_batch_size=self.max_batch_size
+        )
+        self.batching_engine.start()
+
+    def generate_response(self, prompt: str, max_length: Optional[int] = None,
+                          conversation_id: Optional[int] = None,
+                          history: Optional[Sequence[Tuple[str, str]]] = None,
+                          seed: Optional[int] = None,
+                          cancel_event: Optional[threading.Event] = None,
+                          params: Optional[Dict[str, Any]] = None) -> str:
         """
         Generate a contextual response using the loaded AI model.
 
         Args:
             prompt: Input text prompt
-            max_length: Maximum length of generated response
+            max_length: Maximum number of new tokens; params['max_new_tokens'] takes precedence
+            conversation_id: Conversation this turn belongs to, if any
+            history: Earlier (message, response) turns of that conversation,
+                used to rebuild the context when it is not cached
+            seed: Random seed making sampled generation reproducible
+            cancel_event: Event the caller sets to stop generating, e.g. on timeout
+            params: Validated per-request overrides of max_new_tokens,
+                temperature, top_p and do_sample, plus `stop` sequences
 
         Returns:
             Generated response text
         """
+        params = dict(params or {})
+        if max_length is not None:
+            params.setdefault("max_new_tokens", max_length)
+
         if not self.model_loaded:
             if not self.load_model():
                 return "I'm sorry, but the AI model is not currently available. Please try again later."
 
+        if self.inference_client:
+            try:
+                return self.inference_client.generate(
+                    prompt=prompt, conversation_id=conversation_id, history=list(history) if history else None,
+                    seed=seed, params=params, cancel_event=cancel_event
+                )
+            except (InferenceServerError, OSError) as e:
+                if not (cancel_event and cancel_event.is_set()):
+                    logger.error(f"Error generating response on inference server: {e}")
+                return "I apologize, but I encountered an error while processing your request. Please try again."
+
+        metadata = {
+            "function": "generate_response",
+            "model_name": self.model_name,
+            "prompt_chars": len(prompt),
+            "history_turns": len(history) if history else 0,
+            "conversation_id": conversation_id,
+            "seed": seed,
+            "params": params,
+            "cpu_precision": self.cpu_precision,
+            "continuous_batching": self.batching_engine is not None,
+            "speculative_mode": self.speculative_mode,
+        }
+        # With continuous batching the model runs on the scheduler thread
+        threads = [self.batching_engine.thread] if self.batching_engine else []
+        with inference_profiler.capture(metadata, threads=threads):
+            return self._generate_locally(prompt, conversation_id, history, seed, cancel_event, params)
+
+    def _generate_locally(self, prompt: str, conversation_id: Optional[int],
+                          history: Optional[Sequence[Tuple[str, str]]],
+                          seed: Optional[int],
+                          cancel_event: Optional[threading.Event],
+                          params: Dict[str, Any]) -> str:
+        """
+        generate_response on the model loaded in this process.
+        """
+        import torch
+
         try:
             # Analyze the prompt to determine the type of response needed
             prompt_lower = prompt.lower()
 
             # Enhanced prompt engineering based on content type
-            enhanced_prompt = self._enhance_prompt(prompt)
+            with metrics.stage('enhance_prompt'):
+                enhanced_prompt = self._enhance_prompt(prompt)
+            if seed is None:
+                seed = self.generation_seed
+
+            # Deterministic standalone prompts can be answered from the response cache
+            cache_key = None
+            if conversation_id is None:
+                cache_key = self._response_cache_key(enhanced_prompt, seed, params)
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            # Generate response through the shared batch when the engine is running
+            if self.batching_engine:
+                with metrics.stage('tokenize'):
+                    if conversation_id is not None:
+                        prompt_ids = self._conversation_prompt_ids(prompt, history, params)
+                    else:
+                        prompt_ids = self.tokenizer(enhanced_prompt).input_ids
+                # Queueing, prefill and decode happen together inside the shared batch
+                with metrics.stage('batched_generate'):
+                    generated_ids = self.batching_engine.submit(
+                        prompt_ids, seed=seed, cancel_event=cancel_event, stop_sequences=params.get("stop"),
+                        is_final=self._final_reply_check(prompt), **self._generation_kwargs(params)
+                    ).result()
+                metrics.TOKENS_GENERATED.inc(len(generated_ids))
+
+                response = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+                response = self.finalize_response(response, prompt, stop=params.get("stop"))
+
+            # Conversation turns continue from the conversation's cached state
+            elif conversation_id is not None:
+                with metrics.stage('tokenize'):
+                    prompt_ids, cache = self._prepare_conversation_turn(conversation_id, prompt, history, params)
+                with self._seeded(seed):
+                    generated_ids = self._generate_ids(
+                        prompt_ids, cache=cache, conversation_id=conversation_id, cancel_event=cancel_event,
+                        params=params, prompt=prompt
+                    )
+
+                response = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+                response = self.finalize_response(response, prompt, stop=params.get("stop"))
+
+            # Generate directly from token ids so cached prefix state and
+            # speculative decoding can be used
+            elif self.prefix_cache is not None or self.speculative_mode:
+                with metrics.stage('tokenize'):
+                    prompt_ids = self.tokenizer(enhanced_prompt).input_ids
+                with self._seeded(seed):
+                    generated_ids = self._generate_ids(
+                        prompt_ids, cancel_event=cancel_event, params=params, prompt=prompt
+                    )
+
+                response = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+                response = self.finalize_response(response, prompt, stop=params.get("stop"))
 
             # Generate response using pipeline
-            if self.pipeline:
-                outputs = self.pipeline(
-                    enhanced_prompt,
-                    max_new_tokens=100,  # Allow longer responses
-                    num_return_sequences=1,
-                    truncation=True,
-                    return_full_text=True,
-                    repetition_penalty=1.2,
-                    temperature=0.7,  # More focused responses
-                    do_sample=True
-                )
+            elif self.pipeline:
+                # The pipeline tokenizes internally, so prefill includes tokenization here
+                timer = metrics.GenerationTimer()
+                with self._seeded(seed):
+                    outputs = self.pipeline(
+                        enhanced_prompt,
+                        num_return_sequences=1,
+                        truncation=True,
+                        return_full_text=True,
+                        stopping_criteria=self._stopping_criteria(cancel_event, timer, params.get("stop"),
+                                                                  prompt=prompt),
+                        **self._generation_kwargs(params)
+                    )
+                timer.finish()
 
-                if outputs and len(outputs) > 0:
-                    full_response = outputs[0].get('generated_text', '').strip()
+                if not outputs:
+                    return "I apologize, but I couldn't generate a meaningful response."
 
-                    # TinyLlama Chat uses specific prompt markers
-                    if "<|assistant|>" in full_response:
-                        response = full_response.split("<|assistant|>")[-1].strip()
-                    else:
-                        # Fallback cleanup
-                        response = full_response[len(enhanced_prompt):].strip() if full_response.startswith(enhanced_prompt) else full_response
+                full_response = outputs[0].get('generated_text', '').strip()
 
-                    # Post-process response for better quality
-                    response = self._post_process_response(response, prompt)
+                # TinyLlama Chat uses specific prompt markers
+                if "<|assistant|>" in full_response:
+                    response = full_response.split("<|assistant|>")[-1].strip()
+                else:
+                    # Fallback cleanup
+                    response = full_response[len(enhanced_prompt):].strip() if full_response.startswith(enhanced_prompt) else full_response
 
-                    return response if response else "I apologize, but I couldn't generate a meaningful response."
+                response = self.finalize_response(response, prompt, stop=params.get("stop"))
 
             # Fallback method using direct model inference
             elif self.model and self.tokenizer:
-                inputs = self.tokenizer(prompt, return_tensors="pt")
+                with metrics.stage('tokenize'):
+                    inputs = self.tokenizer(prompt, return_tensors="pt")
 
                 if torch.cuda.is_available():
                     inputs = {k: v.cuda() for k, v in inputs.items()}
                     self.model = self.model.cuda()
 
+                timer = metrics.GenerationTimer()
                 with torch.no_grad():
                     outputs = self.model.generate(
                         **inputs,
-                        max_length=max_length,
-                        temperature=self.temperature,
-                        top_p=self.top_p,
-                        do_sample=self.do_sample,
                         pad_token_id=self.tokenizer.eos_token_id,
-                        num_return_sequences=1
+                        num_return_sequences=1,
+                        stopping_criteria=self._stopping_criteria(cancel_event, timer, params.get("stop")),
+                        **self._generation_kwargs(params)
                     )
+                timer.finish()
 
                 response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
                 # Remove the original prompt from response
                 if response.startswith(prompt):
                     response = response[len(prompt):].strip()
+                response = truncate_at_stop(response, params.get("stop")).strip()
 
                 return response if response else "I apologize, but I couldn't generate a response."
 
             else:
                 return "AI model components are not properly initialized."
 
+            # A cancelled generation is cut short, never cache it
+            if cache_key and not (cancel_event and cancel_event.is_set()):
+                self.response_cache.set(cache_key, response)
+            return response
+
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             return "I apologize, but I encountered an error while processing your request. Please try again."
 
+    def stream_response(self, prompt: str, conversation_id: Optional[int] = None,
+                        history: Optional[Sequence[Tuple[str, str]]] = None,
+                        cancel_event: Optional[threading.Event] = None,
+                        params: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Generate a response incrementally, yielding text as tokens are decoded.
+
+        The yielded pieces are the raw model output; pass their concatenation
+        to finalize_response() to get the post-processed reply. Generation
+        stops at a stop sequence, but the pieces may run past it.
+
+        Args:
+            prompt: Input text prompt
+            conversation_id: Conversation this turn belongs to, if any
+            history: Earlier (message, response) turns of that conversation
+            cancel_event: Event the caller sets to stop generating
+            params: Validated per-request generation overrides, see generate_response()
+
+        Yields:
+            Decoded text fragments
+        """
+        from transformers import TextIteratorStreamer
+
+        if not self.model_loaded:
+            if not self.load_model():
+                yield "I'm sorry, but the AI model is not currently available. Please try again later."
+                return
+
+        if self.inference_client:
+            try:
+                yield from self.inference_client.stream(
+                    prompt=prompt, conversation_id=conversation_id,
+                    history=list(history) if history else None, params=params, cancel_event=cancel_event
+                )
+            except (InferenceServerError, OSError) as e:
+                logger.error(f"Error streaming from inference server: {e}")
+                yield "I apologize, but I encountered an error while processing your request. Please try again."
+            return
+
+        if not (self.model and self.tokenizer):
+            yield "AI model components are not properly initialized."
+            return
+
+        params = params or {}
+        # Also stop generating when the consumer abandons the stream
+        cancel_event = cancel_event or threading.Event()
+        finished = False
+        try:
+            cache, worker = None, None
+            with metrics.stage('tokenize'):
+                if conversation_id is None:
+                    prompt_ids = self.tokenizer(self._enhance_prompt(prompt)).input_ids
+                elif self.batching_engine:
+                    prompt_ids = self._conversation_prompt_ids(prompt, history, params)
+                else:
+                    prompt_ids, cache = self._prepare_conversation_turn(conversation_id, prompt, history, params)
+
+            timeout = getattr(settings, 'AI_INFERENCE_TIMEOUT', 120)
+            if self.batching_engine:
+                streamer = TextIteratorStreamer(self.tokenizer, skip_special_tokens=True, timeout=timeout)
+                self.batching_engine.submit(
+                    prompt_ids, streamer=streamer, cancel_event=cancel_event, stop_sequences=params.get("stop"),
+                    is_final=self._final_reply_check(prompt), **self._generation_kwargs(params)
+                )
+            else:
+                streamer = TextIteratorStreamer(
+                    self.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout
+                )
+                worker = threading.Thread(
+                    target=self._generate_into_streamer,
+                    args=(streamer, prompt_ids, cache, conversation_id, cancel_event, params, prompt),
+                    daemon=True
+                )
+                worker.start()
+
+            for text in streamer:
+                if text:
+                    yield text
+
+            # The worker stores the KV caches after the last token; wait for it
+            # so the next turn of the conversation can reuse them.
+            if worker is not None:
+                worker.join()
+            finished = True
+
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield "I apologize, but I encountered an error while processing your request. Please try again."
+        finally:
+            if not finished:
+                cancel_event.set()
+
+    def _generate_into_streamer(self, streamer, prompt_ids: List[int], cache=None,
+                                conversation_id: Optional[int] = None,
+                                cancel_event: Optional[threading.Event] = None,
+                                params: Optional[Dict[str, Any]] = None,
+                                prompt: Optional[str] = None):
+        """
+        Run generation for stream_response on a background thread.
+        """
+        try:
+            self._generate_ids(
+                prompt_ids, streamer=streamer, cache=cache,
+                conversation_id=conversation_id, cancel_event=cancel_event, params=params, prompt=prompt
+            )
+        except Exception as e:
+            logger.error(f"Error generating streamed response: {e}")
+            streamer.end()
+
+    def _generate_ids(self, prompt_ids: List[int], streamer=None, cache=None,
+                      conversation_id: Optional[int] = None,
+                      cancel_event: Optional[threading.Event] = None,
+                      params: Optional[Dict[str, Any]] = None,
+                      prompt: Optional[str] = None) -> List[int]:
+        """
+        Generate a continuation of prompt_ids, starting from the given cache
+        or else the longest cached prefix when one is available.
+
+        For conversation turns the full sequence and its KV state are stored
+        in the conversation cache for the next turn. Given the user's prompt,
+        decoding ends as soon as post-processing the reply against it would
+        discard any further tokens.
+
+        Returns:
+            Newly generated token ids, without the trailing EOS
+        """
+        import torch
+        from transformers import DynamicCache
+
+        params = params or {}
+        timer = metrics.GenerationTimer()
+        input_ids = torch.tensor([prompt_ids], device=self.model.device)
+        generate_kwargs = dict(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            pad_token_id=self.tokenizer.eos_token_id,
+            streamer=streamer,
+            return_dict_in_generate=True,
+            stopping_criteria=self._stopping_criteria(
+                cancel_event, timer, params.get("stop"), len(prompt_ids), prompt=prompt
+            ),
+            **self._generation_kwargs(params)
+        )
+
+        if cache is None and self.prefix_cache is not None:
+            _, cache = self.prefix_cache.lookup(prompt_ids)
+        if cache is not None:
+            generate_kwargs["past_key_values"] = cache
+
+        speculative_kwargs = self._speculative_kwargs()
+        generate_kwargs.update(speculative_kwargs)
+
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model.generate(**generate_kwargs)
+        timer.finish()
+        if speculative_kwargs:
+            self.speculative_stats.record_generation(
+                outputs.sequences.shape[-1] - len(prompt_ids), time.perf_counter() - started
+            )
+
+        generated_ids = outputs.sequences[0, len(prompt_ids):].tolist()
+        if generated_ids and generated_ids[-1] == self.tokenizer.eos_token_id:
+            generated_ids = generated_ids[:-1]
+
+        if conversation_id is not None:
+            if cancel_event is not None and cancel_event.is_set():
+                # A cancelled or timed-out turn is never saved, so must not stay in the context
+                if self.conversation_cache is not None:
+                    self.conversation_cache.discard(conversation_id)
+            elif self.conversation_cache is not None and outputs.past_key_values is not None:
+                # The next turn appends the reply as it is saved and shown, not
+                # the raw decode, so keep only the prompt's keys/values
+                reply = self._finalize(
+                    self.tokenizer.decode(generated_ids, skip_special_tokens=True), prompt, params.get("stop")
+                )
+                outputs.past_key_values.crop(len(prompt_ids))
+                self.conversation_cache.put(conversation_id, prompt_ids, outputs.past_key_values, (prompt, reply))
+
+        # Keep the prompt's own keys/values once it has been seen before
+        elif (self.prefix_cache is not None and outputs.past_key_values is not None
+              and self.prefix_cache.offer(prompt_ids)):
+            length = len(prompt_ids)
+            self.prefix_cache.put(prompt_ids, DynamicCache.from_legacy_cache(tuple(
+                (keys[:, :, :length].clone(), values[:, :, :length].clone())
+                for keys, values in outputs.past_key_values.to_legacy_cache()
+            )))
+
+        return generated_ids
+
+    def _prepare_conversation_turn(self, conversation_id: int, prompt: str,
+                                   history: Optional[Sequence[Tuple[str, str]]],
+                                   params: Optional[Dict[str, Any]] = None):
+        """
+        Build the token ids for a new conversation turn.
+
+        When the conversation's KV state is cached up to the last turn of
+        history, that turn's reply and the new turn are appended to it;
+        otherwise the context is rebuilt from history.
+
+        Returns:
+            (prompt token ids, cache covering a prefix of them or None)
+        """
+        last_turn = history[-1] if history else None
+        entry = None
+        if self.conversation_cache is not None:
+            entry = self.conversation_cache.take(conversation_id, last_turn)
+        if entry is not None:
+            token_ids, cache = entry
+            prompt_ids = list(token_ids) + self._encode_turn(prompt, lead=f"{last_turn[1]}</s>\n")
+            if len(prompt_ids) <= self._context_budget(params):
+                return prompt_ids, cache
+
+        return self._conversation_prompt_ids(prompt, history, params), None
+
+    def _conversation_prompt_ids(self, prompt: str, history: Optional[Sequence[Tuple[str, str]]],
+                                 params: Optional[Dict[str, Any]] = None) -> List[int]:
+        """
+        Token ids for the system prompt, as many of the most recent history
+        turns as fit in the context window, and the new message.
+        """
+        prefix_ids = self.tokenizer(self._system_prefix()).input_ids
+        turn_ids = self._encode_turn(prompt)
+        budget = self._context_budget(params) - len(prefix_ids) - len(turn_ids)
+
+        history_ids = []
+        for message, response in reversed(list(history or [])):
+            ids = self._encode_turn(message, response)
+            if len(ids) > budget:
+                break
+            history_ids = ids + history_ids
+            budget -= len(ids)
+
+        return prefix_ids + history_ids + turn_ids
+
+    def _encode_turn(self, message: str, response: Optional[str] = None, lead: str = "") -> List[int]:
+        """
+        Token ids of one user turn, plus the assistant reply when it is known.
+        """
+        text = f"{lead}<|user|>\n{message}</s>\n<|assistant|>\n"
+        if response is not None:
+            text += f"{response}</s>\n"
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def _context_budget(self, params: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Number of prompt tokens that leave room for a full response.
+        """
+        max_positions = getattr(self.model.config, 'max_position_embeddings', self.max_length)
+        return max_positions - self._generation_kwargs(params)["max_new_tokens"]
+
+    def prompt_token_budget(self, params: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Tokens left for the user's message in a standalone prompt, after the
+        system block and chat markers, given the response length requested
+        in params. Estimated when no model is loaded here.
+        """
+        if self.model is not None:
+            budget = self._context_budget(params)
+        else:
+            budget = self.max_length - self._generation_kwargs(params)["max_new_tokens"]
+        if self.tokenizer is not None:
+            return budget - len(self.tokenizer(self._enhance_prompt("")).input_ids)
+        return budget - len(self._enhance_prompt("")) // 4
+
+    def end_conversation(self, conversation_id: int):
+        """
+        Drop the cached state of a conversation.
+        """
+        if self.inference_client:
+            try:
+                self.inference_client.end_conversation(conversation_id)
+            except (InferenceServerError, OSError) as e:
+                logger.warning(f"Could not end conversation on inference server: {e}")
+            return
+        if self.conversation_cache is not None:
+            self.conversation_cache.discard(conversation_id)
+
+    def _response_cache_key(self, enhanced_prompt: str, seed: Optional[int],
+                            params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Cache key for a generation, or None if its output is not reproducible.
+        """
+        kwargs = self._generation_kwargs(params)
+        if self.response_cache is None or (kwargs["do_sample"] and seed is None):
+            return None
+        stop = list((params or {}).get("stop") or [])
+        return self.response_cache.make_key(enhanced_prompt, dict(kwargs, stop=stop, seed=seed, model=self.model_name))
+
+    @contextmanager
+    def _seeded(self, seed: Optional[int]):
+        """
+        Make sampling inside the block reproducible for a given seed without
+        disturbing the global RNG seen by other requests.
+        """
+        import torch
+
+        if seed is None:
+            yield
+            return
+        with self._seed_lock, torch.random.fork_rng(devices=[]):
+            torch.manual_seed(seed)
+            yield
+
+    def _stopping_criteria(self, cancel_event: Optional[threading.Event] = None,
+                           timer: Optional[metrics.GenerationTimer] = None,
+                           stop: Optional[Sequence[str]] = None,
+                           prompt_length: Optional[int] = None,
+                           prompt: Optional[str] = None) -> "StoppingCriteriaList":
+        """
+        Stopping criteria for a generate() call, on top of EOS and max_new_tokens.
+        A timer, if given, is fed every decoding step to split prefill from decode.
+        Stop sequences, and with early stopping the post-processing rules for a
+        reply to prompt, are only applied after prompt_length tokens, which
+        defaults to the length of the sequence at the first decoding step.
+        """
+        from transformers import StoppingCriteriaList
+        from .stopping import CancelledCriteria, FinalReplyCriteria, StopSequenceCriteria, TimingCriteria
+
+        criteria = StoppingCriteriaList()
+        if cancel_event is not None:
+            criteria.append(CancelledCriteria(cancel_event))
+        if timer is not None:
+            criteria.append(TimingCriteria(timer))
+        if stop:
+            criteria.append(StopSequenceCriteria(self.tokenizer, stop, prompt_length))
+        if self.early_stop and prompt is not None:
+            criteria.append(FinalReplyCriteria(self.tokenizer, prompt, prompt_length))
+        return criteria
+
+    def _final_reply_check(self, prompt: str) -> Optional[Callable[[str], bool]]:
+        """
+        For the batching engine: whether a reply to prompt is final, or None
+        without early stopping.
+        """
+        if not self.early_stop:
+            return None
+        return functools.partial(reply_is_final, prompt_word_set=prompt_words(prompt))
+
+    def _speculative_kwargs(self) -> Dict[str, Any]:
+        """
+        Extra generate() arguments for the configured speculative decoding mode.
+        """
+        if self.speculative_mode == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": self.speculative_tokens}
+        if self.speculative_mode == "draft" and self.draft_model is not None:
+            kwargs = {"assistant_model": self.draft_model, "num_assistant_tokens": self.speculative_tokens}
+            # A draft model with another vocabulary needs both tokenizers to translate drafts
+            if self.draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                kwargs.update(tokenizer=self.tokenizer, assistant_tokenizer=self.draft_tokenizer)
+            return kwargs
+        return {}
+
+    def _generation_kwargs(self, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Sampling parameters used for chat responses: the service defaults
+        with the request's validated overrides applied. Greedy decoding
+        drops the sampling-only parameters.
+        """
+        kwargs = {
+            "max_new_tokens": self.max_new_tokens,  # Allow longer responses
+            "temperature": self.temperature,  # More focused responses
+            "top_p": self.top_p,
+            "repetition_penalty": 1.2,
+            "do_sample": self.do_sample,
+        }
+        kwargs.update((key, value) for key, value in (params or {}).items()
+                      if key in GENERATION_KEYS and value is not None)
+        if not kwargs["do_sample"]:
+            del kwargs["temperature"], kwargs["top_p"]
+        return kwargs
+
+    def _build_pipeline(self):
+        """
+        Text generation pipeline over the loaded model. Generation parameters
+        are passed with every call, so none are fixed here.
+        """
+        import torch
+        from transformers import pipeline
+
+        return pipeline(
+            "text-generation",
+            model=self.model,
+            tokenizer=self.tokenizer,
+            device=0 if torch.cuda.is_available() else -1,
+            pad_token_id=self.tokenizer.eos_token_id
+        )
+
+    def finalize_response(self, response: str, original_prompt: str,
+                          stop: Optional[Sequence[str]] = None) -> str:
+        """
+        Turn raw decoded model output into the reply returned to the user,
+        cut before the first of the request's stop sequences.
+        """
+        with metrics.stage('post_process'):
+            return self._finalize(response, original_prompt, stop)
+
+    def _finalize(self, response: str, original_prompt: str, stop: Optional[Sequence[str]] = None) -> str:
+        # Post-process response for better quality
+        response = truncate_at_stop(response, stop)
+        response = self._post_process_response(response.strip(), original_prompt)
+
+        return response if response else "I apologize, but I couldn't generate a meaningful response."
+
     def _enhance_prompt(self, prompt: str) -> str:
         """
         Enhance the prompt using ChatML / TinyLlama format.
         """
-        system_msg = "You are NOVA, a friendly and highly intelligent AI assistant. You provide clear, helpful, and detailed responses to users."
-        
         # TinyLlama pattern: <|system|>\n{system}\n<|user|>\n{user}\n<|assistant|>\n
-        return f"<|system|>\n{system_msg}</s>\n<|user|>\n{prompt}</s>\n<|assistant|>\n"
+        return f"{self._system_prefix()}<|user|>\n{prompt}</s>\n<|assistant|>\n"
+
+    def _system_prefix(self) -> str:
+        """
+        Leading system block shared by every prompt.
+        """
+        return f"<|system|>\n{self.system_prompt}</s>\n"
 
     def _post_process_response(self, response: str, original_prompt: str) -> str:
         """
         Post-process the response to improve quality and relevance.
         """
+        # Drop a next user turn the model went on to write
+        response = response.split(TURN_MARKER)[0].strip()
         if not response:
             return response
 
         # Remove excessive repetition
         sentences = response.split('.')
-        if len(sentences) > 3:
-            response = '.'.join(sentences[:3]) + '.'
+        if len(sentences) > MAX_SENTENCES:
+            response = '.'.join(sentences[:MAX_SENTENCES]) + '.'
 
         # Ensure response is not just repeating the prompt
-        prompt_words = set(original_prompt.lower().split())
-        response_words = set(response.lower().split())
-
-        if len(prompt_words.intersection(response_words)) / len(prompt_words) > 0.8:
+        if echoes_prompt(set(response.lower().split()), prompt_words(original_prompt)):
             return "I understand your request. Let me provide a more detailed response."
 
         # Clean up common artifacts from DialoGPT
-        response = response.replace('User:', '').replace('Assistant:', '').strip()
+        response = response.replace('Assistant:', '').strip()
 
         # Ensure response ends properly
         if not response.endswith(('.', '!', '?')):
@@ -243,13 +1070,40 @@ class AIModelService:
         Returns:
             Dictionary containing model information
         """
+        import torch
+
         info = {
             "model_loaded": self.model_loaded,
             "model_path": str(self.model_path),
             "cuda_available": torch.cuda.is_available(),
-            "device": "cuda" if torch.cuda.is_available() else "cpu"
+            "device": "cuda" if torch.cuda.is_available() else "cpu",
+            "load_state": self.load_state,
+            "load_mode": self.load_mode,
+            "cpu_precision": self.cpu_precision,
+            "continuous_batching": self.batching_engine is not None,
+            "inference_socket": self.inference_socket or None,
         }
 
+        if self.speculative_mode:
+            info["speculative_decoding"] = dict(
+                mode=self.speculative_mode,
+                draft_model=self.draft_model_name if self.draft_model is not None else None,
+                num_tokens=self.speculative_tokens,
+                **self.speculative_stats.stats()
+            )
+
+        if self.batching_engine:
+            info["batch_queue_depth"] = self.batching_engine.queue_depth
+
+        if self.prefix_cache is not None:
+            info["prefix_cache"] = self.prefix_cache.stats()
+
+        if self.conversation_cache is not None:
+            info["conversation_cache"] = self.conversation_cache.stats()
+
+        if self.response_cache is not None:
+            info["response_cache"] = self.response_cache.stats()
+
         if self.model_loaded and self.model:
             info.update({
                 "model_type": type(self.model).__name__,
@@ -260,6 +1114,7 @@ class AIModelService:
 
         return info
 
+    @metrics.stage('parse_artifacts')
     def parse_artifacts(self, response: str) -> List[Dict[str, Any]]:
         """
         Parse response text for artifacts like code blocks, etc.
@@ -308,6 +1163,25 @@ class AIModelService:
         """
         Unload the model from memory to free up resources.
         """
+        import torch
+
+        if self.batching_engine:
+            self.batching_engine.stop()
+            self.batching_engine = None
+
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+
+        if self.conversation_cache is not None:
+            self.conversation_cache.clear()
+
+        if self.inference_client:
+            self.inference_client.close()
+
+        if self.draft_model is not None:
+            self.draft_model = None
+            self.draft_tokenizer = None
+
         if self.model:
             del self.model
             self.model = None
@@ -321,6 +1195,7 @@ class AIModelService:
             self.pipeline = None
 
         self.model_loaded = False
+        self.load_state = "not_loaded"
 
         # Force garbage collection
         import gc
@@ -331,5 +1206,5 @@ class AIModelService:
 
         logger.info("AI model unloaded from memory")
 
-# Global instance
-ai_service = AIModelService()
\ No newline at end of file
+# Global instance, created on first use
+ai_service = SimpleLazyObject(AIModelService)
\ No newline at end of file
@@ -1,6 +1,33 @@
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from llm_project.database import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='sqlite-pragmas')
+
+        if not getattr(settings, 'SERVES_REQUESTS', False):
+            return
+        if getattr(settings, 'AI_MODEL_WARMUP', False):
+            from .ai_service import ai_service
+            ai_service.start_background_warmup()
+            if getattr(settings, 'RETRIEVAL_ENABLED', True):
+                from .retrieval import retriever
+                threading.Thread(target=retriever.warm_up, name='retrieval-warmup', daemon=True).start()
+
+        profiling_signal = getattr(settings, 'PROFILING_SIGNAL', '')
+        if profiling_signal and threading.current_thread() is threading.main_thread():
+            from .profiling import inference_profiler
+            inference_profiler.install_signal_handler(profiling_signal)
+
+        # Connect and create indexes off the startup path; a failure is retried on first use
+        from . import mongo
+        threading.Thread(target=mongo.ensure_indexes, name='mongo-indexes', daemon=True).start()
+
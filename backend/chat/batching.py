@@ -0,0 +1,345 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional, List, Sequence
+
+import torch
+from transformers import DynamicCache
+
+from .stopping import stop_window
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest:
+    """
+    A single prompt waiting for (or taking part in) batched decoding.
+    """
+
+    def __init__(self, prompt_ids: List[int], max_new_tokens: int = 100, temperature: float = 0.7,
+                 top_p: float = 0.95, repetition_penalty: float = 1.0, do_sample: bool = True,
+                 streamer=None, seed: Optional[int] = None, cancel_event: Optional[threading.Event] = None,
+                 stop_sequences: Optional[Sequence[str]] = None,
+                 is_final: Optional[Callable[[str], bool]] = None):
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.do_sample = do_sample
+        # Optional transformers streamer fed one token at a time
+        self.streamer = streamer
+        # Private RNG so a seeded request samples the same tokens whatever it is batched with
+        self.generator = torch.Generator().manual_seed(seed) if seed is not None else None
+        # Set by the caller to stop decoding early; the tokens so far are returned
+        self.cancel_event = cancel_event
+        # Decoding ends once the generated text contains one of these
+        self.stop_sequences = [sequence for sequence in stop_sequences or [] if sequence]
+        # Called with the text generated so far; decoding ends once it returns True
+        self.is_final = is_final
+        self.generated: List[int] = []
+        self.finished = False
+        self.future: Future = Future()
+
+
+class ContinuousBatchingEngine:
+    """
+    Request queue plus scheduler thread that decodes all in-flight prompts
+    as one dynamic batch.
+
+    New requests are prefilled and merged into the running batch between
+    decode steps, and finished sequences are dropped as soon as they emit
+    EOS or hit their token limit, so the batch composition changes at token
+    granularity. Sequences are left-padded and kept aligned through the
+    attention mask; each caller gets its own Future back from submit().
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.device = next(model.parameters()).device
+        self.eos_token_id = tokenizer.eos_token_id
+
+        self._queue: "queue.Queue[Optional[GenerationRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        # Running batch state
+        self._active: List[GenerationRequest] = []
+        self._cache = None              # legacy tuple of (key, value) per layer
+        self._attention_mask = None     # [batch, cached_len]
+        self._next_tokens = None        # [batch] sampled but not yet fed
+        self._positions = None          # [batch] position id of next_tokens
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="nova-batching", daemon=True)
+        self._thread.start()
+        logger.info(f"Continuous batching engine started (max_batch_size={self.max_batch_size})")
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        if self._thread:
+            self._thread.join(timeout=30)
+        self._thread = None
+
+    def submit(self, prompt_ids: List[int], **params) -> Future:
+        """
+        Queue a tokenized prompt for generation.
+
+        Returns:
+            Future resolving to the list of generated token ids
+        """
+        request = GenerationRequest(prompt_ids, **params)
+        if not self._running:
+            self._fail(request, RuntimeError("Batching engine is not running"))
+            return request.future
+        self._queue.put(request)
+        return request.future
+
+    @property
+    def thread(self) -> Optional[threading.Thread]:
+        """
+        The scheduler thread that runs the model, while the engine is running.
+        """
+        return self._thread
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while self._running:
+            try:
+                admitted = self._admit()
+                if admitted:
+                    self._prefill(admitted)
+                if self._active:
+                    self._decode_step()
+            except Exception as e:
+                logger.error(f"Batching engine step failed: {e}")
+                self._fail_active(e)
+
+        self._fail_active(RuntimeError("Batching engine stopped"))
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                self._fail(request, RuntimeError("Batching engine stopped"))
+
+    def _admit(self) -> List[GenerationRequest]:
+        """
+        Pull waiting requests into free batch slots, blocking only when idle.
+        """
+        admitted = []
+        while len(self._active) + len(admitted) < self.max_batch_size:
+            try:
+                block = not self._active and not admitted
+                request = self._queue.get(block=block, timeout=1.0 if block else None)
+            except queue.Empty:
+                break
+            if request is None:
+                break
+            if request.future.set_running_or_notify_cancel():
+                admitted.append(request)
+        return admitted
+
+    @torch.no_grad()
+    def _prefill(self, requests: List[GenerationRequest]):
+        """
+        Run the prompts of newly admitted requests as one left-padded batch
+        and merge the resulting cache into the running batch.
+        """
+        pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.eos_token_id
+        length = max(len(r.prompt_ids) for r in requests)
+
+        input_ids = torch.full((len(requests), length), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), length), dtype=torch.long)
+        for i, r in enumerate(requests):
+            input_ids[i, length - len(r.prompt_ids):] = torch.tensor(r.prompt_ids, dtype=torch.long)
+            attention_mask[i, length - len(r.prompt_ids):] = 1
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache(),
+            use_cache=True,
+        )
+        cache = outputs.past_key_values.to_legacy_cache()
+        next_tokens = self._sample(outputs.logits[:, -1, :], requests)
+        positions = attention_mask.sum(-1)
+        self._append(requests, next_tokens)
+
+        if not self._active:
+            self._cache = cache
+            self._attention_mask = attention_mask
+            self._next_tokens = next_tokens
+            self._positions = positions
+        else:
+            old_len = self._attention_mask.shape[1]
+            new_len = attention_mask.shape[1]
+            target = max(old_len, new_len)
+            self._cache = tuple(
+                (torch.cat([self._left_pad(k_old, target), self._left_pad(k_new, target)], dim=0),
+                 torch.cat([self._left_pad(v_old, target), self._left_pad(v_new, target)], dim=0))
+                for (k_old, v_old), (k_new, v_new) in zip(self._cache, cache)
+            )
+            self._attention_mask = torch.cat(
+                [self._left_pad(self._attention_mask, target), self._left_pad(attention_mask, target)], dim=0
+            )
+            self._next_tokens = torch.cat([self._next_tokens, next_tokens], dim=0)
+            self._positions = torch.cat([self._positions, positions], dim=0)
+
+        self._active.extend(requests)
+        self._retire()
+
+    @torch.no_grad()
+    def _decode_step(self):
+        """
+        Feed the last sampled token of every active sequence through the model.
+        """
+        attention_mask = torch.cat(
+            [self._attention_mask, torch.ones((len(self._active), 1), dtype=torch.long, device=self.device)], dim=1
+        )
+        outputs = self.model(
+            input_ids=self._next_tokens.unsqueeze(-1),
+            attention_mask=attention_mask,
+            position_ids=self._positions.unsqueeze(-1),
+            past_key_values=DynamicCache.from_legacy_cache(self._cache),
+            use_cache=True,
+        )
+        self._cache = outputs.past_key_values.to_legacy_cache()
+        self._attention_mask = attention_mask
+        self._positions = self._positions + 1
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        self._append(self._active, self._next_tokens)
+        self._retire()
+
+    def _append(self, requests: List[GenerationRequest], tokens: torch.Tensor):
+        """
+        Record freshly sampled tokens and resolve requests that are done.
+        """
+        for request, token in zip(requests, tokens.tolist()):
+            if token != self.eos_token_id:
+                request.generated.append(token)
+                if request.streamer:
+                    request.streamer.put(torch.tensor([token]))
+            cancelled = request.cancel_event is not None and request.cancel_event.is_set()
+            if (token == self.eos_token_id or len(request.generated) >= request.max_new_tokens or cancelled
+                    or self._reached_stop(request)):
+                request.finished = True
+                if request.streamer:
+                    request.streamer.end()
+                request.future.set_result(request.generated)
+
+    def _reached_stop(self, request: GenerationRequest) -> bool:
+        """
+        Whether the last tokens of the request complete one of its stop
+        sequences, or its text so far is final.
+        """
+        if request.stop_sequences:
+            window = stop_window(request.stop_sequences)
+            text = self.tokenizer.decode(request.generated[-window:], skip_special_tokens=True)
+            if any(sequence in text for sequence in request.stop_sequences):
+                return True
+        if request.is_final is not None:
+            return request.is_final(self.tokenizer.decode(request.generated, skip_special_tokens=True))
+        return False
+
+    def _retire(self):
+        """
+        Drop finished sequences from the running batch.
+        """
+        keep = [i for i, request in enumerate(self._active) if not request.finished]
+
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._reset()
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=self.device)
+        self._active = [self._active[i] for i in keep]
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._positions = self._positions.index_select(0, index)
+
+        # Drop leading columns that are now padding for every remaining row
+        start = int((self._attention_mask.sum(0) == 0).long().cumprod(0).sum())
+        self._attention_mask = self._attention_mask[:, start:]
+        self._cache = tuple(
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in self._cache
+        )
+
+    def _sample(self, logits: torch.Tensor, requests: List[GenerationRequest]) -> torch.Tensor:
+        """
+        Pick the next token for each row using that request's own sampling parameters.
+        """
+        logits = logits.float()
+        tokens = []
+        for row, request in zip(logits, requests):
+            if request.repetition_penalty != 1.0:
+                seen = torch.tensor(request.prompt_ids + request.generated, dtype=torch.long, device=row.device)
+                scores = row.gather(0, seen)
+                scores = torch.where(scores < 0, scores * request.repetition_penalty,
+                                     scores / request.repetition_penalty)
+                row = row.scatter(0, seen, scores)
+
+            if not request.do_sample or request.temperature <= 0:
+                tokens.append(int(row.argmax()))
+                continue
+
+            probs = torch.softmax(row / request.temperature, dim=-1)
+            if request.top_p < 1.0:
+                sorted_probs, sorted_idx = probs.sort(descending=True)
+                cumulative = sorted_probs.cumsum(-1)
+                sorted_probs[cumulative - sorted_probs > request.top_p] = 0
+                probs = torch.zeros_like(probs).scatter(0, sorted_idx, sorted_probs)
+            tokens.append(int(torch.multinomial(probs.cpu(), 1, generator=request.generator)))
+        return torch.tensor(tokens, dtype=torch.long, device=self.device)
+
+    @staticmethod
+    def _left_pad(tensor: torch.Tensor, length: int) -> torch.Tensor:
+        """
+        Left-pad a mask ([batch, seq]) or cache tensor ([batch, heads, seq, dim]) with zeros.
+        """
+        seq_dim = 1 if tensor.dim() == 2 else 2
+        missing = length - tensor.shape[seq_dim]
+        if missing <= 0:
+            return tensor
+        shape = list(tensor.shape)
+        shape[seq_dim] = missing
+        return torch.cat([tensor.new_zeros(shape), tensor], dim=seq_dim)
+
+    def _fail(self, request: GenerationRequest, error: Exception):
+        if request.streamer:
+            request.streamer.end()
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def _fail_active(self, error: Exception):
+        for request in self._active:
+            if not request.finished:
+                self._fail(request, error)
+        self._reset()
+
+    def _reset(self):
+        self._active = []
+        self._cache = None
+        self._attention_mask = None
+        self._next_tokens = None
+        self._positions = None
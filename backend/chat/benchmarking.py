@@ -0,0 +1,245 @@
+"""
+Offline benchmark harness for AIModelService.
+
+Builds a tiny randomly initialized Llama model with a word-level vocabulary,
+so benchmarks run without downloads and every generated token decodes to
+exactly one whitespace-separated word. Synthetic prompt lengths are
+therefore exact token counts.
+"""
+import json
+import random
+import resource
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from . import metrics
+from .ai_service import AIModelService
+
+SPECIAL_TOKENS = ["<unk>", "<s>", "</s>", "<|system|>", "<|user|>", "<|assistant|>"]
+# Ordinary words the reply post-processing reacts to
+PUNCTUATION_TOKENS = [".", ",", "!", "?", "User:", "Assistant:"]
+
+# Chat prompts for measuring early stopping; with a real model their
+# replies run into the sentence limit
+EARLY_STOP_PROMPTS = [
+    "Explain how a hash map handles collisions.",
+    "What is the difference between a process and a thread?",
+    "Give me some tips for writing clear commit messages.",
+    "Why is the sky blue?",
+    "Describe how HTTPS keeps a connection private.",
+    "What should I check when a Python program runs out of memory?",
+    "Summarize the rules of chess for a beginner.",
+    "How do vaccines train the immune system?",
+]
+
+
+def build_tiny_model(vocab_words: int = 1000, hidden_size: int = 64, num_layers: int = 2, seed: int = 0):
+    """
+    Randomly initialized Llama model and matching word-level tokenizer.
+    """
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS)}
+    for i in range(vocab_words):
+        vocab[f"w{i}"] = len(vocab)
+    for token in PUNCTUATION_TOKENS:
+        vocab[token] = len(vocab)
+
+    backend = Tokenizer(models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    # Prepend BOS like the Llama tokenizer does
+    backend.post_processor = processors.TemplateProcessing(
+        single="<s> $A", special_tokens=[("<s>", vocab["<s>"])]
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        unk_token="<unk>",
+        bos_token="<s>",
+        eos_token="</s>",
+        pad_token="</s>",
+        additional_special_tokens=SPECIAL_TOKENS[3:],
+        model_input_names=["input_ids", "attention_mask"],
+    )
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(vocab),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=2048,
+        bos_token_id=vocab["<s>"],
+        eos_token_id=vocab["</s>"],
+        pad_token_id=vocab["</s>"],
+    )
+    model = LlamaForCausalLM(config).eval()
+    return model, tokenizer
+
+
+def build_tiny_service(vocab_words: int = 1000, **overrides) -> AIModelService:
+    """
+    AIModelService wired to a tiny offline model instead of TinyLlama.
+    Attributes in overrides are set before the model is attached.
+    """
+    service = AIModelService()
+    for name, value in overrides.items():
+        setattr(service, name, value)
+
+    service.model, service.tokenizer = build_tiny_model(vocab_words=vocab_words)
+    service.pipeline = service._build_pipeline()
+    service.model_loaded = True
+    service.load_state = "ready"
+    service._on_model_loaded()
+    return service
+
+
+def synthetic_prompt(num_tokens: int, rng: random.Random, vocab_words: int = 1000) -> str:
+    return " ".join(f"w{rng.randrange(vocab_words)}" for _ in range(num_tokens))
+
+
+def process_peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process so far. ru_maxrss never goes
+    down, so this is one number for a whole benchmark run, not per scenario.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(pct) - 1]
+
+
+def run_benchmark(service: AIModelService, concurrency: int, prompt_tokens: int,
+                  max_new_tokens: int, num_requests: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    Send num_requests prompts through service.stream_response from
+    `concurrency` threads and summarize latency and throughput.
+
+    Time to first token is measured to the first streamed text fragment.
+    """
+    rng = random.Random(seed)
+    prompts = [synthetic_prompt(prompt_tokens, rng) for _ in range(num_requests)]
+    service.max_new_tokens = max_new_tokens
+    lock = threading.Lock()
+    latencies, ttfts, generated = [], [], []
+
+    def one_request(prompt):
+        started = time.perf_counter()
+        first = None
+        chunks = []
+        for text in service.stream_response(prompt):
+            if first is None:
+                first = time.perf_counter() - started
+            chunks.append(text)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            ttfts.append(first if first is not None else elapsed)
+            generated.append(len(service.tokenizer("".join(chunks), add_special_tokens=False).input_ids))
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one_request, prompts))
+    wall = time.perf_counter() - wall_started
+
+    return {
+        "concurrency": concurrency,
+        "prompt_tokens": prompt_tokens,
+        "max_new_tokens": max_new_tokens,
+        "requests": num_requests,
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "latency_p99": _percentile(latencies, 99),
+        "ttft_p50": _percentile(ttfts, 50),
+        "ttft_p95": _percentile(ttfts, 95),
+        "generated_tokens": sum(generated),
+        "tokens_per_sec": sum(generated) / wall if wall else 0.0,
+        "requests_per_sec": num_requests / wall if wall else 0.0,
+    }
+
+
+def early_stop_savings(service: AIModelService, prompts: List[str], max_new_tokens: int,
+                       seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate a reply to each prompt with and without early stopping and
+    count the tokens decoded. Both runs use the same seed, so sampled
+    replies agree up to the point where early stopping ends decoding and
+    the post-processed responses should be identical.
+    """
+    service.max_new_tokens = max_new_tokens
+    early_stop = service.early_stop
+    per_prompt = []
+    try:
+        for i, prompt in enumerate(prompts):
+            steps, responses = {}, {}
+            for enabled in (False, True):
+                service.early_stop = enabled
+                before = metrics.TOKENS_GENERATED.value()
+                responses[enabled] = service.generate_response(prompt, seed=seed + i)
+                steps[enabled] = metrics.TOKENS_GENERATED.value() - before
+            per_prompt.append({
+                "prompt": prompt,
+                "steps_full": steps[False],
+                "steps_early": steps[True],
+                "same_response": responses[False] == responses[True],
+            })
+    finally:
+        service.early_stop = early_stop
+
+    full = sum(row["steps_full"] for row in per_prompt)
+    early = sum(row["steps_early"] for row in per_prompt)
+    return {
+        "max_new_tokens": max_new_tokens,
+        "prompts": len(per_prompt),
+        "decode_steps_full": full,
+        "decode_steps_early": early,
+        "decode_steps_saved": full - early,
+        "saved_share": (full - early) / full if full else 0.0,
+        "same_responses": sum(row["same_response"] for row in per_prompt),
+        "per_prompt": per_prompt,
+    }
+
+
+def benchmark_metadata(service: AIModelService) -> Dict[str, Any]:
+    """
+    Context recorded with every report so results can be compared across commits.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "model_type": type(service.model).__name__,
+        "parameters": sum(p.numel() for p in service.model.parameters()),
+        "continuous_batching": service.batching_engine is not None,
+        "prefix_cache": service.prefix_cache is not None,
+        "do_sample": service.do_sample,
+        "early_stop": service.early_stop,
+        "speculative_mode": service.speculative_mode or None,
+    }
+
+
+def write_report(path: Optional[str], report: Dict[str, Any]) -> str:
+    text = json.dumps(report, indent=2)
+    if path:
+        Path(path).write_text(text)
+    return text
@@ -0,0 +1,108 @@
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Any
+
+from django.conf import settings
+
+
+class ExecutorSaturated(Exception):
+    """
+    Raised by InferenceExecutor.submit when every worker and queue slot is taken.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference executor is saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for model inference, kept apart from the threads
+    that serve ordinary requests.
+
+    At most max_workers generations run at once and at most max_queue more
+    wait for a worker; anything beyond that is rejected straight away so
+    callers can shed load instead of piling up behind the model.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # Moving average of how long one task takes, for Retry-After
+        self._avg_seconds = 0.0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedule fn(*args, **kwargs) on an inference worker.
+
+        Raises:
+            ExecutorSaturated: if no worker or queue slot is free
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorSaturated(self.retry_after())
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            # Run in the caller's context so per-request state (e.g. stage timings) follows the task
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, self._timed, fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def retry_after(self) -> int:
+        """
+        Seconds until a slot is likely to free up, at least one.
+        """
+        with self._lock:
+            waves = max(1, math.ceil(self._in_flight / self.max_workers))
+            return max(1, math.ceil(self._avg_seconds * waves))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_seconds": round(self._avg_seconds, 3),
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _timed(self, fn: Callable, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._avg_seconds = elapsed if not self.completed else 0.8 * self._avg_seconds + 0.2 * elapsed
+                self.completed += 1
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+
+inference_executor = InferenceExecutor(
+    max_workers=getattr(settings, 'AI_INFERENCE_WORKERS', 2),
+    max_queue=getattr(settings, 'AI_INFERENCE_QUEUE_SIZE', 8),
+)
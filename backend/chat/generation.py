@@ -0,0 +1,82 @@
+"""
+Per-request generation parameters and the limits of each user tier.
+"""
+from typing import AbstractSet, Any, Dict, Optional, Sequence
+
+from django.conf import settings
+
+# Keys a request may set; anything else keeps the service defaults
+GENERATION_KEYS = ('max_new_tokens', 'temperature', 'top_p', 'do_sample')
+
+# Post-processing rules for replies, shared with the stopping criterion that
+# ends decoding as soon as they make the reply final
+MAX_SENTENCES = 3
+# Share of the prompt's words a reply may repeat before it is replaced
+PROMPT_ECHO_LIMIT = 0.8
+# The model has started writing the user's next turn
+TURN_MARKER = 'User:'
+
+
+def generation_tier(user) -> str:
+    """
+    The user's tier: the first of their groups named in AI_GENERATION_TIERS,
+    else 'staff' for staff users, else 'default'.
+    """
+    tiers = settings.AI_GENERATION_TIERS
+    if user is not None and user.is_authenticated:
+        for name in user.groups.order_by('name').values_list('name', flat=True):
+            if name in tiers:
+                return name
+        if user.is_staff and 'staff' in tiers:
+            return 'staff'
+    return 'default'
+
+
+def generation_caps(user) -> Dict[str, Any]:
+    """
+    Limits applied to the generation parameters of the user's requests:
+    the 'default' tier's, overridden by those of the user's own tier.
+    """
+    tiers = settings.AI_GENERATION_TIERS
+    caps = dict(tiers['default'])
+    caps.update(tiers.get(generation_tier(user), {}))
+    return caps
+
+
+def truncate_at_stop(text: str, stop: Optional[Sequence[str]]) -> str:
+    """
+    Cut text before the earliest stop sequence it contains.
+    """
+    if not stop:
+        return text
+    positions = [index for index in (text.find(sequence) for sequence in stop) if index >= 0]
+    return text[:min(positions)] if positions else text
+
+
+def prompt_words(prompt: str) -> AbstractSet[str]:
+    return frozenset(prompt.lower().split())
+
+
+def echoes_prompt(words: AbstractSet[str], prompt_word_set: AbstractSet[str]) -> bool:
+    """
+    Whether the reply's words repeat too much of the prompt to be useful.
+    """
+    if not prompt_word_set:
+        return False
+    return len(prompt_word_set & words) / len(prompt_word_set) > PROMPT_ECHO_LIMIT
+
+
+def reply_is_final(text: str, prompt_word_set: AbstractSet[str]) -> bool:
+    """
+    Whether tokens generated after text can no longer change the
+    post-processed reply: it already holds MAX_SENTENCES sentence ends or
+    a turn marker, past which everything is cut, or its complete words
+    already echo the prompt, which replaces the whole reply.
+    """
+    if text.count('.') >= MAX_SENTENCES or TURN_MARKER in text:
+        return True
+    words = text.lower().split()
+    if words and not text[-1].isspace():
+        # The last word may still grow
+        words.pop()
+    return echoes_prompt(set(words), prompt_word_set)
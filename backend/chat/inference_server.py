@@ -0,0 +1,268 @@
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+
+from .ipc import END, ERROR, REQUEST, RESULT, TOKEN, decode_json, recv_frame, send_frame
+
+logger = logging.getLogger(__name__)
+
+
+def core_sets(workers: int, cores_per_worker: int = 0) -> List[List[int]]:
+    """
+    Split the CPUs this process may run on into one set per worker.
+    With cores_per_worker unset the CPUs are divided evenly; sets wrap
+    around when more cores are requested than exist.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+    per_worker = cores_per_worker or max(1, len(available) // workers)
+    return [
+        [available[(index * per_worker + offset) % len(available)] for offset in range(per_worker)]
+        for index in range(workers)
+    ]
+
+
+class InferenceServer:
+    """
+    Pre-forked pool of model replicas serving the ipc protocol on a Unix socket.
+
+    The parent binds the socket and forks one process per replica; every
+    replica pins itself to its own core set, loads its own AIModelService
+    and accepts connections from the shared listening socket, so the kernel
+    spreads connections across replicas. Each connection is served on its
+    own thread. The parent restarts replicas that exit unexpectedly.
+
+    Turns of one conversation may reach different replicas; each request
+    carries the conversation's history, and a replica only resumes from its
+    cached state while that matches it (see ConversationCache.take).
+    """
+
+    def __init__(self, socket_path: str, workers: int = 2, cores_per_worker: int = 0):
+        self.socket_path = Path(socket_path)
+        self.workers = workers
+        self.core_sets = core_sets(workers, cores_per_worker)
+        self._context = multiprocessing.get_context("fork")
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._listener: Optional[socket.socket] = None
+        self._stopping = False
+
+    def serve_forever(self):
+        self._listener = self._bind()
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        profiling_signal = getattr(signal, getattr(settings, 'PROFILING_SIGNAL', '') or '', None)
+        if profiling_signal is not None:
+            # Profile every replica when the server is signalled
+            signal.signal(profiling_signal, self._forward_signal)
+        logger.info(f"Inference server listening on {self.socket_path} with {self.workers} replica(s)")
+
+        try:
+            restarts = [0.0] * self.workers
+            while not self._stopping:
+                for index, process in enumerate(self._processes):
+                    if process is not None and process.is_alive():
+                        continue
+                    # Back off when a replica keeps crashing right after start
+                    if time.monotonic() - restarts[index] < 5:
+                        continue
+                    if process is not None:
+                        logger.warning(f"Inference replica {index} exited with code {process.exitcode}; restarting")
+                    restarts[index] = time.monotonic()
+                    self._processes[index] = self._spawn(index)
+                time.sleep(0.5)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.kill()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            self.socket_path.unlink(missing_ok=True)
+
+    def _bind(self) -> socket.socket:
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            # Refuse to steal the socket of a server that is still running
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(self.socket_path))
+                raise RuntimeError(f"Another inference server is listening on {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                self.socket_path.unlink(missing_ok=True)
+            finally:
+                probe.close()
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(self.socket_path))
+        os.chmod(self.socket_path, 0o660)
+        listener.listen(128)
+        return listener
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=run_replica, args=(self._listener, self.core_sets[index], index),
+            name=f"inference-replica-{index}", daemon=True
+        )
+        process.start()
+        return process
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _forward_signal(self, signum, frame):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signum)
+
+
+def run_replica(listener: socket.socket, cores: Sequence[int], index: int):
+    """
+    Entry point of one replica process.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import torch
+    from .ai_service import AIModelService
+    from .profiling import inference_profiler
+
+    if getattr(settings, 'PROFILING_SIGNAL', ''):
+        inference_profiler.install_signal_handler(settings.PROFILING_SIGNAL)
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+
+    service = AIModelService()
+    # This process is the server; never forward to another one
+    service.inference_client = None
+    if not service.warm_up():
+        logger.error(f"Inference replica {index} could not load the model")
+        os._exit(1)
+    logger.info(f"Inference replica {index} (pid {os.getpid()}) ready on cores {list(cores)}")
+
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except InterruptedError:
+            continue
+        threading.Thread(target=serve_connection, args=(service, conn), daemon=True).start()
+
+
+def serve_connection(service, conn: socket.socket):
+    """
+    Answer requests on one client connection until the client closes it.
+    """
+    with conn:
+        while True:
+            try:
+                frame = recv_frame(conn)
+            except (ConnectionError, OSError):
+                return
+            if frame is None:
+                return
+            kind, payload = frame
+            try:
+                if kind != REQUEST:
+                    raise ValueError(f"Expected a request frame, got type {kind}")
+                if not _handle_request(service, conn, decode_json(payload)):
+                    return
+            except (BrokenPipeError, ConnectionError):
+                return
+            except Exception as e:
+                logger.error(f"Inference request failed: {e}")
+                try:
+                    send_frame(conn, ERROR, {"detail": str(e)})
+                except OSError:
+                    return
+
+
+def _handle_request(service, conn: socket.socket, request) -> bool:
+    """
+    Serve one request.
+
+    Returns:
+        False if the client went away and the connection should be closed
+    """
+    op = request.get("op")
+    if op == "ping":
+        send_frame(conn, RESULT, {"load_state": service.load_state, "pid": os.getpid()})
+    elif op == "generate":
+        response = _generate_until_disconnect(service, conn, request)
+        if response is None:
+            return False
+        send_frame(conn, RESULT, {"response": response})
+    elif op == "stream":
+        cancel_event = threading.Event()
+        try:
+            for text in service.stream_response(
+                request.get("prompt", ""),
+                conversation_id=request.get("conversation_id"),
+                history=request.get("history"),
+                cancel_event=cancel_event,
+                params=request.get("params")
+            ):
+                send_frame(conn, TOKEN, text)
+        except OSError:
+            cancel_event.set()
+            raise
+        send_frame(conn, END, b"")
+    elif op == "end_conversation":
+        service.end_conversation(request.get("conversation_id"))
+        send_frame(conn, RESULT, {})
+    else:
+        raise ValueError(f"Unknown operation {op!r}")
+    return True
+
+
+def _generate_until_disconnect(service, conn: socket.socket, request) -> Optional[str]:
+    """
+    Run generate_response on a helper thread while watching the connection;
+    if the client disconnects (or cancels by closing) generation is stopped.
+
+    Returns:
+        The response, or None if the client went away
+    """
+    cancel_event = threading.Event()
+    result = {}
+
+    def generate():
+        result["response"] = service.generate_response(
+            request.get("prompt", ""),
+            max_length=request.get("max_length"),
+            conversation_id=request.get("conversation_id"),
+            history=request.get("history"),
+            seed=request.get("seed"),
+            cancel_event=cancel_event,
+            params=request.get("params")
+        )
+
+    worker = threading.Thread(target=generate, daemon=True)
+    worker.start()
+    while worker.is_alive():
+        readable, _, _ = select.select([conn], [], [], 0.2)
+        if readable:
+            # The protocol is strictly request/response, so input now means EOF
+            cancel_event.set()
+            break
+    worker.join()
+    return None if cancel_event.is_set() else result.get("response")
@@ -0,0 +1,226 @@
+"""
+Wire protocol between web workers and the inference server.
+
+Every message is one frame: a 5-byte header (1-byte frame type, 4-byte
+big-endian payload length) followed by the payload. Requests, results and
+errors carry a UTF-8 JSON object; streamed tokens carry raw UTF-8 text so
+the hot path needs no JSON encoding.
+"""
+import json
+import queue
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Optional, Dict, Any, Iterator, Tuple
+
+HEADER = struct.Struct("!BI")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+# Frame types
+REQUEST = 1
+RESULT = 2
+TOKEN = 3
+END = 4
+ERROR = 5
+
+
+class InferenceServerError(Exception):
+    """
+    The inference server could not be reached or reported a failure.
+    """
+
+
+def send_frame(sock: socket.socket, kind: int, payload: Any):
+    if isinstance(payload, bytes):
+        body = payload
+    elif isinstance(payload, str):
+        body = payload.encode("utf-8")
+    else:
+        body = json.dumps(payload, default=str).encode("utf-8")
+    sock.sendall(HEADER.pack(kind, len(body)) + body)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Tuple[int, bytes]]:
+    """
+    Read one frame.
+
+    Returns:
+        (frame type, raw payload), or None if the peer closed the connection
+        cleanly between frames
+    """
+    header = _recv_exactly(sock, HEADER.size, allow_eof=True)
+    if header is None:
+        return None
+    kind, length = HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise InferenceServerError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    return kind, _recv_exactly(sock, length) if length else b""
+
+
+def decode_json(payload: bytes) -> Dict[str, Any]:
+    return json.loads(payload.decode("utf-8")) if payload else {}
+
+
+def _recv_exactly(sock: socket.socket, size: int, allow_eof: bool = False) -> Optional[bytes]:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if allow_eof and received == 0:
+                return None
+            raise ConnectionError("Connection closed in the middle of a frame")
+        received += count
+    return bytes(buffer)
+
+
+class InferenceClient:
+    """
+    Client side of the inference server protocol.
+
+    Keeps a pool of open Unix socket connections so requests skip the
+    connect step; a connection is only returned to the pool after a
+    complete exchange, so an interrupted one is never reused. A request
+    that fails on a pooled connection before any reply arrived (the server
+    restarted meanwhile) is retried once on a fresh connection.
+    """
+
+    def __init__(self, socket_path: str, pool_size: int = 8, timeout: float = 120, connect_timeout: float = 5):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._idle: "queue.LifoQueue[socket.socket]" = queue.LifoQueue()
+
+    def ping(self) -> Dict[str, Any]:
+        return self._call({"op": "ping"})
+
+    def generate(self, cancel_event: Optional[threading.Event] = None, **fields) -> str:
+        """
+        Generate a full response. Setting cancel_event drops the connection,
+        which makes the server stop generating.
+        """
+        return self._call(dict(fields, op="generate"), cancel_event=cancel_event).get("response", "")
+
+    def stream(self, cancel_event: Optional[threading.Event] = None, **fields) -> Iterator[str]:
+        """
+        Yield text fragments as the server decodes them.
+        """
+        sock, reused = self._acquire()
+        complete = False
+        try:
+            try:
+                send_frame(sock, REQUEST, dict(fields, op="stream"))
+                frame = self._read_reply(sock, cancel_event)
+            except ConnectionError:
+                if not reused or (cancel_event is not None and cancel_event.is_set()):
+                    raise
+                # Stale pooled connection; nothing was generated yet, so retry once
+                self._discard(sock)
+                sock, reused = self._acquire(fresh=True)
+                send_frame(sock, REQUEST, dict(fields, op="stream"))
+                frame = self._read_reply(sock, cancel_event)
+
+            while True:
+                kind, payload = frame
+                if kind == TOKEN:
+                    yield payload.decode("utf-8")
+                elif kind == END:
+                    complete = True
+                    return
+                elif kind == ERROR:
+                    complete = True
+                    raise InferenceServerError(decode_json(payload).get("detail", "Inference failed"))
+                else:
+                    raise InferenceServerError(f"Unexpected frame type {kind}")
+                frame = self._read_reply(sock, cancel_event)
+        finally:
+            if complete:
+                self._release(sock)
+            else:
+                self._discard(sock)
+
+    def end_conversation(self, conversation_id: int):
+        self._call({"op": "end_conversation", "conversation_id": conversation_id})
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _call(self, request: Dict[str, Any], cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+        sock, reused = self._acquire()
+        try:
+            try:
+                send_frame(sock, REQUEST, request)
+                kind, payload = self._read_reply(sock, cancel_event)
+            except ConnectionError:
+                if not reused or (cancel_event is not None and cancel_event.is_set()):
+                    raise
+                # Stale pooled connection, e.g. the server restarted: retry once
+                self._discard(sock)
+                sock, reused = self._acquire(fresh=True)
+                send_frame(sock, REQUEST, request)
+                kind, payload = self._read_reply(sock, cancel_event)
+        except Exception:
+            self._discard(sock)
+            raise
+
+        self._release(sock)
+        if kind == ERROR:
+            raise InferenceServerError(decode_json(payload).get("detail", "Inference failed"))
+        if kind != RESULT:
+            raise InferenceServerError(f"Unexpected frame type {kind}")
+        return decode_json(payload)
+
+    def _read_reply(self, sock: socket.socket, cancel_event: Optional[threading.Event]) -> Tuple[int, bytes]:
+        """
+        Wait for the next frame, giving up on timeout or cancellation.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ConnectionAbortedError("Request cancelled")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("Timed out waiting for the inference server")
+            readable, _, _ = select.select([sock], [], [], min(remaining, 0.25))
+            if readable:
+                frame = recv_frame(sock)
+                if frame is None:
+                    raise ConnectionError("Inference server closed the connection")
+                return frame
+
+    def _acquire(self, fresh: bool = False) -> Tuple[socket.socket, bool]:
+        if not fresh:
+            try:
+                return self._idle.get_nowait(), True
+            except queue.Empty:
+                pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise InferenceServerError(f"Cannot connect to inference server at {self.socket_path}: {e}")
+        sock.settimeout(self.timeout)
+        return sock, False
+
+    def _release(self, sock: socket.socket):
+        if self._idle.qsize() < self.pool_size:
+            self._idle.put(sock)
+        else:
+            sock.close()
+
+    @staticmethod
+    def _discard(sock: socket.socket):
+        try:
+            sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,296 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from transformers import DynamicCache
+
+
+def cache_bytes(cache: "DynamicCache") -> int:
+    """
+    Memory held by the key and value tensors of a cache.
+    """
+    return sum(keys.nbytes + values.nbytes for keys, values in cache.to_legacy_cache())
+
+
+class _Node:
+    __slots__ = ("children", "entry", "terminal")
+
+    def __init__(self):
+        self.children = {}
+        # Key of a cached entry whose token path runs through this node
+        self.entry: Optional[Tuple[int, ...]] = None
+        # Key of the cached entry ending exactly at this node, if any
+        self.terminal: Optional[Tuple[int, ...]] = None
+
+
+class PrefixCache:
+    """
+    LRU prefix tree of past_key_values for hot prompt prefixes.
+
+    Entries are stored along their token-id path, so a lookup walks the
+    prompt once and can reuse any cached entry sharing a leading run of
+    tokens with it, cropped to the shared length. Pinned entries (the NOVA
+    system preamble) are never evicted; the others are evicted least
+    recently used first when there are more than capacity or their tensors
+    exceed max_bytes in total.
+
+    A prompt is only worth caching once it recurs, so offer() admits an
+    entry on the second sighting of the same token ids.
+    """
+
+    def __init__(self, capacity: int = 8, max_bytes: int = 256 * 1024 * 1024, seen_capacity: int = 1024):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.seen_capacity = seen_capacity
+        self._root = _Node()
+        self._entries: "OrderedDict[Tuple[int, ...], DynamicCache]" = OrderedDict()
+        self._sizes: Dict[Tuple[int, ...], int] = {}
+        self._total_bytes = 0
+        self._pinned = set()
+        # Hashes of prompts offered once, oldest first
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def offer(self, token_ids: Sequence[int]) -> bool:
+        """
+        Record a sighting of token_ids and tell whether their cache should
+        now be put(): true when they were seen recently and are not cached yet.
+        """
+        key = tuple(token_ids)
+        digest = hash(key)
+        with self._lock:
+            if key in self._entries:
+                return False
+            if digest in self._seen:
+                del self._seen[digest]
+                return True
+            self._seen[digest] = None
+            if len(self._seen) > self.seen_capacity:
+                self._seen.popitem(last=False)
+            return False
+
+    def put(self, token_ids: Sequence[int], cache: "DynamicCache", pinned: bool = False):
+        """
+        Store a cache covering exactly token_ids. The cache is kept as given,
+        callers must not mutate it afterwards.
+        """
+        key = tuple(token_ids)
+        if not key:
+            return
+        size = cache_bytes(cache)
+        if size > self.max_bytes and not pinned:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                self._entries[key] = cache
+                self._sizes[key] = size
+                self._total_bytes += size
+                node = self._root
+                for token in key:
+                    node = node.children.setdefault(token, _Node())
+                    node.entry = key
+                node.terminal = key
+            if pinned:
+                self._pinned.add(key)
+            self._evict()
+
+    def lookup(self, token_ids: Sequence[int]) -> Tuple[int, Optional["DynamicCache"]]:
+        """
+        Find the longest cached prefix of token_ids.
+
+        At least one token is always left uncached so the model produces
+        logits for the next position.
+
+        Returns:
+            (number of cached tokens, private copy of the cache) or (0, None)
+        """
+        from transformers import DynamicCache
+
+        limit = len(token_ids) - 1
+        with self._lock:
+            node, depth, entry = self._root, 0, None
+            for token in token_ids[:limit]:
+                child = node.children.get(token)
+                if child is None or child.entry not in self._entries:
+                    break
+                node, depth, entry = child, depth + 1, child.entry
+
+            if not entry:
+                self.misses += 1
+                return 0, None
+
+            self._entries.move_to_end(entry)
+            stored = self._entries[entry]
+            self.hits += 1
+            self.reused_tokens += depth
+
+        # Entries are never mutated, so copy just the shared part outside the lock
+        return depth, DynamicCache.from_legacy_cache(tuple(
+            (keys[:, :, :depth].clone(), values[:, :, :depth].clone())
+            for keys, values in stored.to_legacy_cache()
+        ))
+
+    def clear(self):
+        with self._lock:
+            self._root = _Node()
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+            self._pinned.clear()
+            self._seen.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+        }
+
+    def _evict(self):
+        while len(self._entries) > self.capacity or self._total_bytes > self.max_bytes:
+            victim = next((key for key in self._entries if key not in self._pinned), None)
+            if victim is None:
+                return
+            del self._entries[victim]
+            self._total_bytes -= self._sizes.pop(victim)
+            self._unlink(victim)
+
+    def _unlink(self, key: Tuple[int, ...]):
+        """
+        Remove an evicted entry's path, re-pointing shared nodes at a surviving entry.
+        """
+        path = [self._root]
+        for token in key:
+            node = path[-1].children.get(token)
+            if node is None:
+                break
+            path.append(node)
+
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.terminal == key:
+                node.terminal = None
+            if node.entry == key:
+                node.entry = node.terminal or next(
+                    (child.entry for child in node.children.values() if child.entry in self._entries), None
+                )
+            if node.entry is None and not node.children:
+                del path[depth - 1].children[key[depth - 1]]
+
+
+class ConversationCache:
+    """
+    Per-conversation KV cache so follow-up turns only prefill their new tokens.
+
+    Each entry holds the token ids of the conversation so far together with
+    the past_key_values computed for them, and the (message, reply) turn
+    that followed them. Entries expire after ttl seconds and are evicted
+    least-recently-used first when there are more than max_entries or their
+    tensors exceed max_bytes in total.
+
+    Another process may have served later turns of the same conversation,
+    so take() only hands out an entry whose last turn is still the last
+    persisted one.
+    """
+
+    def __init__(self, max_entries: int = 64, ttl: float = 1800, max_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, Tuple[Tuple[int, ...], DynamicCache, int, float, Tuple[str, str]]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def take(self, conversation_id: int,
+             last_turn: Optional[Sequence[str]]) -> Optional[Tuple[Tuple[int, ...], "DynamicCache"]]:
+        """
+        Remove and return the cached (token_ids, cache) for a conversation.
+        The caller owns the cache and should put() it back after the turn.
+
+        Args:
+            conversation_id: Conversation to resume
+            last_turn: The conversation's last persisted (message, reply),
+                None if it has none; an entry stored after any other turn is stale
+        """
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            token_ids, cache, size, stored_at, entry_turn = entry
+            self._total_bytes -= size
+            if time.monotonic() - stored_at > self.ttl:
+                self.misses += 1
+                self.evictions += 1
+                return None
+            if last_turn is None or tuple(last_turn) != entry_turn:
+                self.misses += 1
+                self.stale += 1
+                return None
+            self.hits += 1
+            return token_ids, cache
+
+    def put(self, conversation_id: int, token_ids: Sequence[int], cache: "DynamicCache", turn: Sequence[str]):
+        """
+        Store the state covering token_ids, which end just before the reply
+        of turn, the (message, reply) exchange that was persisted.
+        """
+        size = cache_bytes(cache)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(conversation_id, None)
+            if previous is not None:
+                self._total_bytes -= previous[2]
+            self._entries[conversation_id] = (tuple(token_ids), cache, size, time.monotonic(), tuple(turn))
+            self._total_bytes += size
+            self._evict()
+
+    def discard(self, conversation_id: int):
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale": self.stale,
+        }
+
+    def _evict(self):
+        now = time.monotonic()
+        for conversation_id in [cid for cid, entry in self._entries.items() if now - entry[3] > self.ttl]:
+            self._drop(conversation_id)
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, conversation_id: int):
+        entry = self._entries.pop(conversation_id)
+        self._total_bytes -= entry[2]
+        self.evictions += 1
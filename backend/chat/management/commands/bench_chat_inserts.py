@@ -0,0 +1,156 @@
+import json
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from llm_project.database import DEFAULT_SQLITE_PRAGMAS
+
+# SQLite variants compared against each other and the configured database
+SQLITE_CONFIGS = {
+    'sqlite-rollback': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+    'sqlite-wal': DEFAULT_SQLITE_PRAGMAS,
+}
+
+
+def _int_list(value):
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise CommandError(f"Expected a comma separated list of integers, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = ("Load-test chat inserts: concurrent writer threads each saving chats through the ORM, "
+            "comparing SQLite journal modes with the configured database. Every configuration "
+            "writes to its own throwaway database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--configs', default=','.join(list(SQLITE_CONFIGS) + ['default']),
+                            help=f"Comma separated configurations: {', '.join(SQLITE_CONFIGS)} and/or "
+                                 "'default' (a test database of the DATABASES['default'] backend).")
+        parser.add_argument('--writers', default='1,4,8', help='Comma separated concurrent writer counts.')
+        parser.add_argument('--inserts', type=int, default=200, help='Chats saved by each writer.')
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='Chats per bulk_create; 1 saves each chat with its own create().')
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        configs = [name.strip() for name in options['configs'].split(',') if name.strip()]
+        unknown = [name for name in configs if name not in SQLITE_CONFIGS and name != 'default']
+        if unknown:
+            raise CommandError(f"Unknown configurations: {', '.join(unknown)}")
+
+        report = {'inserts_per_writer': options['inserts'], 'batch_size': options['batch_size'], 'results': []}
+        with tempfile.TemporaryDirectory(prefix='bench-inserts-') as directory:
+            for name in configs:
+                alias = f"bench_{name.replace('-', '_')}"
+                self._add_database(alias, name, Path(directory))
+                try:
+                    for writers in _int_list(options['writers']):
+                        result = self._run(alias, writers, options['inserts'], options['batch_size'])
+                        result['config'] = name
+                        report['results'].append(result)
+                        self.stdout.write(
+                            f"{name:16} writers={writers:<3} {result['inserts_per_sec']:9.1f} inserts/s  "
+                            f"p50={result['latency_ms']['p50']:.2f}ms p95={result['latency_ms']['p95']:.2f}ms  "
+                            f"errors={result['errors']}"
+                        )
+                finally:
+                    self._remove_database(alias)
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(text)
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(text)
+
+    def _add_database(self, alias, name, directory):
+        config = dict(connections['default'].settings_dict)
+        if name in SQLITE_CONFIGS:
+            config.update({'ENGINE': 'django.db.backends.sqlite3', 'PRAGMAS': SQLITE_CONFIGS[name]})
+        if config['ENGINE'] == 'django.db.backends.sqlite3':
+            config['NAME'] = str(directory / f'{alias}.sqlite3')
+        connections.settings[alias] = config
+        settings.DATABASES[alias] = config
+        if connections[alias].vendor == 'sqlite':
+            call_command('migrate', database=alias, verbosity=0)
+        else:
+            # Same server and credentials as the real database, but a separate test database
+            connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    def _remove_database(self, alias):
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            connection.creation.destroy_test_db(connection.settings_dict['NAME'], verbosity=0)
+        connection.close()
+        del connections[alias]
+        del connections.settings[alias]
+        settings.DATABASES.pop(alias, None)
+
+    def _run(self, alias, writers, inserts, batch_size):
+        from django.contrib.auth.models import User
+        from chat.models import Chat
+
+        user, _ = User.objects.db_manager(alias).get_or_create(username=f'bench-{writers}')
+        latencies, errors = [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(writers + 1)
+        message, response = 'benchmark message ' * 20, 'benchmark response ' * 60
+
+        def write():
+            own, failed = [], 0
+            barrier.wait()
+            try:
+                for start in range(0, inserts, batch_size):
+                    count = min(batch_size, inserts - start)
+                    began = time.perf_counter()
+                    try:
+                        if batch_size == 1:
+                            Chat.objects.using(alias).create(user=user, message=message, response=response)
+                        else:
+                            Chat.objects.using(alias).bulk_create([
+                                Chat(user=user, message=message, response=response) for _ in range(count)
+                            ])
+                    except Exception:
+                        failed += count
+                        continue
+                    own.append((time.perf_counter() - began) * 1000)
+            finally:
+                # Each thread has its own connection
+                connections[alias].close()
+                with lock:
+                    latencies.extend(own)
+                    errors.append(failed)
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        written = writers * inserts - sum(errors)
+        ordered = sorted(latencies) or [0.0]
+        return {
+            'writers': writers,
+            'written': written,
+            'errors': sum(errors),
+            'seconds': elapsed,
+            'inserts_per_sec': written / elapsed if elapsed else 0.0,
+            'latency_ms': {
+                'mean': statistics.fmean(ordered),
+                'p50': ordered[int(0.50 * (len(ordered) - 1))],
+                'p95': ordered[int(0.95 * (len(ordered) - 1))],
+                'p99': ordered[int(0.99 * (len(ordered) - 1))],
+            },
+        }
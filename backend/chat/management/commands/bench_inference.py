@@ -0,0 +1,108 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _int_list(value):
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise CommandError(f"Expected a comma separated list of integers, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = ("Measure AIModelService latency percentiles, time to first token and tokens/sec across "
+            "concurrency levels, prompt lengths and generation lengths, and the process peak RSS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,4', help='Comma separated client thread counts.')
+        parser.add_argument('--prompt-tokens', default='32,256', help='Comma separated prompt lengths in tokens.')
+        parser.add_argument('--max-new-tokens', default='32', help='Comma separated generation lengths.')
+        parser.add_argument('--requests', type=int, default=8, help='Requests sent per scenario.')
+        parser.add_argument('--batching', action='store_true', help='Serve through the continuous batching engine.')
+        parser.add_argument('--sample', action='store_true',
+                            help='Sample instead of greedy decoding (greedy keeps runs comparable).')
+        parser.add_argument('--speculative', choices=('prompt_lookup', 'draft'), default=None,
+                            help='Decode speculatively; compare against a run without it for the speedup.')
+        parser.add_argument('--draft-model', default=None, help='Draft model for --speculative draft.')
+        parser.add_argument('--early-stop', action='store_true',
+                            help='Also generate replies to a fixed prompt set with and without early stopping '
+                                 'and report the decode steps it saves.')
+        parser.add_argument('--model', default=None,
+                            help='Benchmark a real Hub id or local directory instead of the offline tiny model.')
+        parser.add_argument('--tiny-vocab', type=int, default=1000,
+                            help='Words in the tiny model\'s vocabulary; with a small one sampled replies '
+                                 'contain sentence ends, so --early-stop has something to cut.')
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        from chat.benchmarking import (
+            EARLY_STOP_PROMPTS, build_tiny_service, benchmark_metadata, early_stop_savings, process_peak_rss_mb,
+            run_benchmark, write_report
+        )
+
+        overrides = {
+            'continuous_batching': options['batching'],
+            'do_sample': options['sample'],
+            'response_cache': None,
+            'speculative_mode': options['speculative'] or '',
+            'draft_model_name': options['draft_model'] or '',
+        }
+        started = time.perf_counter()
+        if options['model']:
+            from chat.ai_service import AIModelService
+            service = AIModelService()
+            for name, value in dict(overrides, model_name=options['model']).items():
+                setattr(service, name, value)
+            if not service.load_model():
+                raise CommandError(f"Could not load {options['model']}")
+        else:
+            service = build_tiny_service(vocab_words=options['tiny_vocab'], **overrides)
+        metadata = benchmark_metadata(service)
+        metadata['load_seconds'] = time.perf_counter() - started
+
+        scenarios = []
+        early_stop = None
+        try:
+            for concurrency in _int_list(options['concurrency']):
+                for prompt_tokens in _int_list(options['prompt_tokens']):
+                    for max_new_tokens in _int_list(options['max_new_tokens']):
+                        self.stderr.write(f"concurrency={concurrency} prompt_tokens={prompt_tokens} "
+                                          f"max_new_tokens={max_new_tokens}")
+                        scenarios.append(run_benchmark(
+                            service, concurrency, prompt_tokens, max_new_tokens, options['requests']
+                        ))
+            if options['early_stop']:
+                max_new_tokens = max(_int_list(options['max_new_tokens']))
+                self.stderr.write(f"early stopping on {len(EARLY_STOP_PROMPTS)} prompts, "
+                                  f"max_new_tokens={max_new_tokens}")
+                early_stop = early_stop_savings(service, EARLY_STOP_PROMPTS, max_new_tokens)
+            # Peak over every scenario run in this process; see bench_precision for per-mode peaks
+            metadata['process_peak_rss_mb'] = process_peak_rss_mb()
+            speculative = service.get_model_info().get('speculative_decoding')
+            if speculative:
+                metadata['speculative_decoding'] = speculative
+        finally:
+            service.unload_model()
+
+        self.stdout.write(f"{'conc':>4} {'prompt':>6} {'new':>4} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} "
+                          f"{'ttft p50':>9} {'tok/s':>8}")
+        for r in scenarios:
+            self.stdout.write(f"{r['concurrency']:>4} {r['prompt_tokens']:>6} {r['max_new_tokens']:>4} "
+                              f"{r['latency_p50']:>8.3f} {r['latency_p95']:>8.3f} {r['latency_p99']:>8.3f} "
+                              f"{r['ttft_p50']:>9.3f} {r['tokens_per_sec']:>8.1f}")
+        self.stdout.write(f"\npeak RSS of the whole run: {metadata['process_peak_rss_mb']:.0f} MB")
+
+        if early_stop:
+            self.stdout.write(
+                f"\nearly stopping: {early_stop['decode_steps_early']} of {early_stop['decode_steps_full']} decode "
+                f"steps ({early_stop['saved_share']:.1%} saved), {early_stop['same_responses']}/"
+                f"{early_stop['prompts']} responses unchanged"
+            )
+
+        report = {'metadata': metadata, 'scenarios': scenarios}
+        if early_stop:
+            report['early_stop'] = early_stop
+        report = write_report(options['output'], report)
+        if not options['output']:
+            self.stdout.write(report)
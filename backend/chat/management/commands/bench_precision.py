@@ -0,0 +1,134 @@
+import argparse
+import json
+import math
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PRECISIONS = ("float32", "bfloat16", "int8")
+
+BENCH_PROMPT = "Explain in a few sentences why the sky appears blue during the day."
+
+# Fixed held-out text used for the perplexity comparison
+EVAL_TEXT = (
+    "The Industrial Revolution began in Britain in the late eighteenth century and spread to Europe "
+    "and North America over the following decades. Mechanized spinning and weaving transformed the "
+    "textile trade, while improvements to the steam engine made it possible to power factories far "
+    "from rivers. Railways reduced the cost of moving coal, iron and finished goods, and cities grew "
+    "rapidly as workers left the countryside in search of steady wages. Historians still debate how "
+    "quickly living standards rose for ordinary families during this period."
+)
+
+
+class Command(BaseCommand):
+    help = "Compare CPU precision modes by tokens/sec, peak RSS and perplexity delta against float32."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(PRECISIONS),
+                            help='Comma separated precisions to measure (float32 is always included).')
+        parser.add_argument('--model', default=None,
+                            help='Hub id or local directory; defaults to the chat service model.')
+        parser.add_argument('--max-new-tokens', type=int, default=64)
+        parser.add_argument('--runs', type=int, default=3)
+        parser.add_argument('--output', default=None, help='Write the results as JSON to this file.')
+        # Internal: measure one precision in this process and print JSON
+        parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self.measure(options['child'], options)))
+            return
+
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(PRECISIONS)
+        if unknown:
+            raise CommandError(f"Unknown precision(s): {', '.join(sorted(unknown))}")
+        if 'float32' not in modes:
+            modes.insert(0, 'float32')
+
+        results = []
+        for mode in modes:
+            self.stderr.write(f"Measuring {mode}...")
+            results.append(self.run_child(mode, options))
+
+        baseline = next(r for r in results if r['precision'] == 'float32')
+        for result in results:
+            result['perplexity_delta'] = result['perplexity'] - baseline['perplexity']
+            result['speedup'] = result['tokens_per_sec'] / baseline['tokens_per_sec']
+
+        self.stdout.write(f"{'precision':<10} {'dtype':<14} {'tok/s':>8} {'speedup':>8} {'peak RSS MB':>12} "
+                          f"{'perplexity':>11} {'delta':>8}")
+        for r in results:
+            self.stdout.write(f"{r['precision']:<10} {r['dtype']:<14} {r['tokens_per_sec']:>8.2f} {r['speedup']:>7.2f}x "
+                              f"{r['peak_rss_mb']:>12.0f} {r['perplexity']:>11.3f} {r['perplexity_delta']:>+8.3f}")
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+
+    def run_child(self, mode, options):
+        """
+        Measure each precision in a fresh process so peak RSS is not shared between modes.
+        """
+        command = [
+            sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'bench_precision',
+            '--child', mode,
+            '--max-new-tokens', str(options['max_new_tokens']),
+            '--runs', str(options['runs']),
+        ]
+        if options['model']:
+            command += ['--model', options['model']]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f"Measuring {mode} failed:\n{completed.stderr}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def measure(self, mode, options):
+        import torch
+        from transformers import AutoTokenizer
+        from chat.ai_service import AIModelService
+
+        service = AIModelService()
+        service.cpu_precision = mode
+        service.load_mode = 'default'
+        source = options['model'] or service.model_name
+
+        started = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(source)
+        model = service._load_weights(source)
+        model.eval()
+        load_seconds = time.perf_counter() - started
+
+        with torch.no_grad():
+            eval_ids = tokenizer(EVAL_TEXT, return_tensors='pt').input_ids
+            loss = model(input_ids=eval_ids, labels=eval_ids).loss
+            perplexity = math.exp(float(loss))
+
+            inputs = tokenizer(service._enhance_prompt(BENCH_PROMPT), return_tensors='pt')
+            generate_kwargs = dict(
+                do_sample=False,
+                max_new_tokens=options['max_new_tokens'],
+                min_new_tokens=options['max_new_tokens'],
+                pad_token_id=tokenizer.eos_token_id,
+            )
+            model.generate(**inputs, **dict(generate_kwargs, max_new_tokens=4, min_new_tokens=4))
+
+            elapsed = 0.0
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                model.generate(**inputs, **generate_kwargs)
+                elapsed += time.perf_counter() - started
+
+        dtype = str(next(model.parameters()).dtype).replace('torch.', '')
+        return {
+            'precision': mode,
+            'dtype': f"qint8/{dtype}" if mode == 'int8' else dtype,
+            'load_seconds': load_seconds,
+            'tokens_per_sec': options['runs'] * options['max_new_tokens'] / elapsed,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'perplexity': perplexity,
+        }
@@ -0,0 +1,149 @@
+import json
+import re
+import statistics
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+# "function (file.py:123)" -> "function (file.py)", so all lines of a function add up
+LINE_NUMBER = re.compile(r':\d+\)$')
+
+SORT_KEYS = {'self_cpu': 'self_cpu_us', 'cpu': 'cpu_us', 'device': 'self_device_us', 'count': 'count'}
+
+
+class Command(BaseCommand):
+    help = ("Summarize inference profiles written by chat.profiling: the torch operators taking "
+            "the most time across all captures and, with --stacks, the hottest Python frames.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=getattr(settings, 'PROFILING_DIR', None),
+                            help='Directory of captures (defaults to PROFILING_DIR).')
+        parser.add_argument('--limit', type=int, default=20, help='Rows to show.')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='self_cpu',
+                            help='Operator column to rank by.')
+        parser.add_argument('--since', default=None,
+                            help='Only captures taken at or after this ISO 8601 time.')
+        parser.add_argument('--stacks', action='store_true',
+                            help='Also rank Python frames by samples in stacks.folded.')
+        parser.add_argument('--json', action='store_true', help='Print the summary as JSON.')
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or '')
+        if not directory.is_dir():
+            raise CommandError(f"No profile directory at {directory}")
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since time {options['since']!r}")
+
+        captures = []
+        for path in sorted(p for p in directory.iterdir() if (p / 'meta.json').exists()):
+            meta = json.loads((path / 'meta.json').read_text())
+            captured_at = parse_datetime(meta.get('captured_at', ''))
+            if since and captured_at and captured_at < since:
+                continue
+            captures.append((path, meta))
+        if not captures:
+            raise CommandError(f"No captures in {directory}")
+
+        summary = {
+            'captures': len(captures),
+            'duration_seconds': self._durations([meta for _, meta in captures]),
+            'operators': self._operators([path for path, _ in captures], SORT_KEYS[options['sort']],
+                                         options['limit']),
+        }
+        if options['stacks']:
+            summary['frames'] = self._frames([path for path, _ in captures], options['limit'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+        else:
+            self._print(summary)
+
+    @staticmethod
+    def _durations(metas):
+        durations = sorted(meta['duration_seconds'] for meta in metas if 'duration_seconds' in meta)
+        if not durations:
+            return {}
+        return {
+            'mean': statistics.fmean(durations),
+            'p50': durations[int(0.50 * (len(durations) - 1))],
+            'max': durations[-1],
+        }
+
+    @staticmethod
+    def _operators(paths, sort_key, limit):
+        totals = {}
+        for path in paths:
+            ops_file = path / 'torch_ops.json'
+            if not ops_file.exists():
+                continue
+            for op in json.loads(ops_file.read_text()):
+                total = totals.setdefault(op['name'], {
+                    'name': op['name'], 'count': 0, 'self_cpu_us': 0.0, 'cpu_us': 0.0,
+                    'self_device_us': 0.0, 'captures': 0,
+                })
+                total['count'] += op['count']
+                total['self_cpu_us'] += op['self_cpu_us']
+                total['cpu_us'] += op['cpu_us']
+                total['self_device_us'] += op.get('self_device_us', 0)
+                total['captures'] += 1
+
+        # Self times add up to the profiled time, so they give a meaningful share
+        all_self = sum(total['self_cpu_us'] for total in totals.values()) or 1.0
+        ranked = sorted(totals.values(), key=lambda total: total[sort_key], reverse=True)[:limit]
+        for total in ranked:
+            total['self_cpu_share'] = total['self_cpu_us'] / all_self
+        return ranked
+
+    @staticmethod
+    def _frames(paths, limit):
+        """
+        Functions by samples spent in the function itself (leaf) and anywhere below it.
+        """
+        own, inclusive, samples = {}, {}, 0
+        for path in paths:
+            folded = path / 'stacks.folded'
+            if not folded.exists():
+                continue
+            for line in folded.read_text().splitlines():
+                stack, _, count = line.rpartition(' ')
+                if not stack:
+                    continue
+                count = int(count)
+                frames = [LINE_NUMBER.sub(')', frame) for frame in stack.split(';')]
+                samples += count
+                own[frames[-1]] = own.get(frames[-1], 0) + count
+                for frame in set(frames[1:]):
+                    inclusive[frame] = inclusive.get(frame, 0) + count
+
+        ranked = sorted(own.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{
+            'frame': frame,
+            'own_share': count / samples,
+            'inclusive_share': inclusive.get(frame, count) / samples,
+        } for frame, count in ranked]
+
+    def _print(self, summary):
+        durations = summary['duration_seconds']
+        self.stdout.write(f"{summary['captures']} capture(s)" + (
+            f", duration mean {durations['mean']:.3f}s p50 {durations['p50']:.3f}s max {durations['max']:.3f}s"
+            if durations else ''))
+
+        if summary['operators']:
+            self.stdout.write(f"\n{'self CPU ms':>12} {'share':>6} {'total CPU ms':>13} {'calls':>9}  operator")
+            for op in summary['operators']:
+                self.stdout.write(
+                    f"{op['self_cpu_us'] / 1000:12.1f} {op['self_cpu_share']:6.1%} "
+                    f"{op['cpu_us'] / 1000:13.1f} {op['count']:9d}  {op['name']}"
+                )
+        else:
+            self.stdout.write("No torch operator totals in these captures.")
+
+        if 'frames' in summary:
+            self.stdout.write(f"\n{'own':>6} {'incl.':>6}  Python function")
+            for frame in summary['frames']:
+                self.stdout.write(f"{frame['own_share']:6.1%} {frame['inclusive_share']:6.1%}  {frame['frame']}")
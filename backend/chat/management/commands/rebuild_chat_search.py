@@ -0,0 +1,22 @@
+from importlib import import_module
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = ("Recreate the chat full-text index and its triggers and reindex every chat. "
+            "Run it after a migration that rebuilds the chat_chat table on SQLite, which drops the triggers.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The full-text index is only used with SQLite.")
+
+        migration = import_module('chat.migrations.0005_chat_search_index')
+        with connection.schema_editor() as schema_editor:
+            migration.create_search_index(None, schema_editor)
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM chat_chat")
+            count = cursor.fetchone()[0]
+        self.stdout.write(f"Reindexed {count} chats")
@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Retry chat records the background writer could not persist."
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*',
+                            help='Dead-letter files to replay; defaults to every file in CHAT_PERSISTENCE_DEAD_LETTER_DIR.')
+
+    def handle(self, *args, **options):
+        from chat.persistence import chat_writer
+
+        files = [Path(f) for f in options['files']]
+        if not files:
+            directory = Path(getattr(settings, 'CHAT_PERSISTENCE_DEAD_LETTER_DIR', ''))
+            files = sorted(directory.glob('chats-*.jsonl')) if directory.is_dir() else []
+
+        for path in files:
+            written, failed = chat_writer.replay_dead_letters(path)
+            self.stdout.write(f"{path}: {written} written, {failed} still failing")
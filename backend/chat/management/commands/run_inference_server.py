@@ -0,0 +1,36 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Serve model inference to web workers over a Unix socket from a pool of "
+            "CPU-pinned model replicas. Point AI_INFERENCE_SOCKET at the same path.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=getattr(settings, 'AI_INFERENCE_SOCKET', '') or None,
+                            help='Unix socket path (defaults to AI_INFERENCE_SOCKET).')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'AI_INFERENCE_SERVER_WORKERS', 2),
+                            help='Number of model replicas.')
+        parser.add_argument('--cores-per-worker', type=int,
+                            default=getattr(settings, 'AI_INFERENCE_CORES_PER_WORKER', 0),
+                            help='CPU cores pinned to each replica; 0 splits the available cores evenly.')
+
+    def handle(self, *args, **options):
+        from chat.inference_server import InferenceServer
+
+        if not options['socket']:
+            raise CommandError("No socket path given; pass --socket or set AI_INFERENCE_SOCKET.")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s %(message)s')
+        server = InferenceServer(options['socket'], workers=options['workers'],
+                                 cores_per_worker=options['cores_per_worker'])
+        for index, cores in enumerate(server.core_sets):
+            self.stdout.write(f"Replica {index}: cores {cores}")
+        try:
+            server.serve_forever()
+        except RuntimeError as e:
+            raise CommandError(str(e))
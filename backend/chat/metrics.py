@@ -0,0 +1,350 @@
+"""
+Prometheus metrics and per-stage timing for the chat pipeline.
+
+Metrics are kept in a process-local registry and rendered in the Prometheus
+text exposition format by the /metrics endpoint. With several worker
+processes each one reports its own values, so scrape every worker (or sum
+across them in PromQL).
+
+stage() times a block into the chat_stage_seconds histogram and, inside a
+request handled by ServerTimingMiddleware, into that request's timings,
+which are sent back in a Server-Timing header.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; chat stages range from sub-millisecond parsing to minute-long decodes
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A named metric with one value (or histogram) per combination of label values.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        """
+        (sample name, label names, label values, value) for every series.
+        """
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            yield self.name, self.labelnames, key, value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, labelnames, labelvalues, value in self.samples():
+            lines.append(f'{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """
+        Report a running total kept elsewhere, e.g. a component's hit count.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        labelnames = self.labelnames + ('le',)
+        for key, (counts, total) in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labelnames, key + (_format_value(bound),), cumulative
+            yield f'{self.name}_sum', self.labelnames, key, total
+            yield f'{self.name}_count', self.labelnames, key, cumulative
+
+
+class Registry:
+    """
+    The metrics of this process, plus collectors that report the state of
+    other components (queues, caches) at scrape time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        """
+        Register a callable returning freshly filled metrics on every scrape.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[Metric]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            metrics.extend(collector())
+        return metrics
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.collect():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'chat_stage_seconds', 'Time spent in each stage of handling a chat message.', ['stage']
+))
+TOKENS_GENERATED = registry.register(Counter(
+    'chat_generated_tokens_total', 'Tokens generated by the model in this process.'
+))
+MODEL_LOAD_SECONDS = registry.register(Gauge(
+    'chat_model_load_seconds', 'Time the last model load took.'
+))
+
+
+class RequestTimings:
+    """
+    Stage durations of one request, in the order they finished.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.stages.append((name, seconds))
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing header value, with durations in milliseconds. A stage
+        that ran several times (e.g. tokenizing each history turn) is summed.
+        """
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, seconds in self.stages:
+                totals[name] = totals.get(name, 0.0) + seconds
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items()]
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar('chat_request_timings', default=None)
+
+
+@contextmanager
+def request_timings() -> Iterator[RequestTimings]:
+    """
+    Collect the stages timed while handling the current request, including
+    those run on inference executor threads on its behalf.
+    """
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def record_stage(name: str, seconds: float):
+    """
+    Record a stage measured by the caller.
+    """
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time the block (or, used as a decorator, each call) as the given stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+class GenerationTimer:
+    """
+    Split one generate() call into prefill and decode time.
+
+    Fed by TimingCriteria, which generate() calls after every decoding step:
+    the time up to the first call is the prompt's forward pass, the rest is
+    spent decoding the remaining tokens.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_step: Optional[float] = None
+        self.last_step: Optional[float] = None
+        self.prompt_length = 0
+        self.length = 0
+
+    def step(self, sequence_length: int):
+        now = time.perf_counter()
+        if self.first_step is None:
+            self.first_step = now
+            # The first call already includes the first generated token
+            self.prompt_length = sequence_length - 1
+        self.last_step = now
+        self.length = sequence_length
+
+    @property
+    def tokens(self) -> int:
+        return max(0, self.length - self.prompt_length) if self.first_step is not None else 0
+
+    def finish(self):
+        """
+        Record prefill, decode and token count once generation has returned.
+        """
+        if self.first_step is None:
+            return
+        record_stage('prefill', self.first_step - self.started)
+        record_stage('decode', self.last_step - self.first_step)
+        TOKENS_GENERATED.inc(self.tokens)
+
+
+def _collect_components() -> List[Metric]:
+    """
+    Queue depths and cache counters of the components serving chats.
+    """
+    from .ai_service import ai_service
+    from .executor import inference_executor
+    from .persistence import chat_writer
+
+    executor = inference_executor.stats()
+    in_flight = Gauge('chat_inference_in_flight', 'Generations running or waiting on the inference executor.')
+    in_flight.set(executor['in_flight'])
+    rejected = Counter('chat_inference_rejected_total', 'Chat requests rejected because the executor was full.')
+    rejected.set_total(executor['rejected'])
+
+    batch_queue = Gauge('chat_batching_queue_depth', 'Requests waiting to join the continuous batch.')
+    engine = ai_service.batching_engine
+    batch_queue.set(engine.queue_depth if engine else 0)
+
+    writer_queue = Gauge('chat_persistence_queue_depth', 'Chat turns waiting for the write-behind writer.')
+    writer = chat_writer.stats()
+    writer_queue.set(writer['queued'])
+    dead_lettered = Counter('chat_persistence_dead_lettered_total', 'Chat turns that could not be written.')
+    dead_lettered.set_total(writer['dead_lettered'])
+
+    hits = Counter('chat_cache_hits_total', 'Cache lookups that found an entry.', ['cache'])
+    misses = Counter('chat_cache_misses_total', 'Cache lookups that found nothing.', ['cache'])
+    caches = {
+        'prefix': ai_service.prefix_cache,
+        'conversation': ai_service.conversation_cache,
+        'response': ai_service.response_cache,
+    }
+    for name, cache in caches.items():
+        if cache is not None:
+            stats = cache.stats()
+            hits.set_total(stats['hits'], cache=name)
+            misses.set_total(stats['misses'], cache=name)
+
+    loaded = Gauge('chat_model_loaded', 'Whether the model is loaded and serving in this process.')
+    loaded.set(1 if ai_service.is_ready else 0)
+    return [in_flight, rejected, batch_queue, writer_queue, dead_lettered, hits, misses, loaded]
+
+
+registry.add_collector(_collect_components)
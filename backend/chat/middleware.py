@@ -0,0 +1,42 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import request_timings
+
+
+class ServerTimingMiddleware:
+    """
+    Report the chat stages timed during a request in a Server-Timing header,
+    e.g. `parse_files;dur=4.1, prefill;dur=220.5, decode;dur=1830.2, total;dur=2071.0`.
+
+    Enabled with CHAT_SERVER_TIMING. Streaming responses only carry the
+    stages finished before the first byte is sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CHAT_SERVER_TIMING', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with request_timings() as timings:
+            response = self.get_response(request)
+        return self.add_header(response, timings)
+
+    async def __acall__(self, request):
+        with request_timings() as timings:
+            response = await self.get_response(request)
+        return self.add_header(response, timings)
+
+    @staticmethod
+    def add_header(response, timings):
+        if timings.stages:
+            response['Server-Timing'] = timings.server_timing()
+        return response
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='chat_user_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['conversation', '-timestamp', '-id'], name='chat_conv_time_id_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# External-content FTS5 index over chat_chat: the index stores only the
+# inverted lists and reads texts from chat_chat. The triggers keep it in
+# step with every write, including bulk_create, queryset update()/delete()
+# and cascades from deleted users and conversations, which bypass signals.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_chat_fts USING fts5(
+        message, response,
+        content='chat_chat', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_chat_fts_insert AFTER INSERT ON chat_chat BEGIN
+        INSERT INTO chat_chat_fts(rowid, message, response) VALUES (new.id, new.message, new.response);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_chat_fts_delete AFTER DELETE ON chat_chat BEGIN
+        INSERT INTO chat_chat_fts(chat_chat_fts, rowid, message, response)
+        VALUES ('delete', old.id, old.message, old.response);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_chat_fts_update AFTER UPDATE OF message, response ON chat_chat BEGIN
+        INSERT INTO chat_chat_fts(chat_chat_fts, rowid, message, response)
+        VALUES ('delete', old.id, old.message, old.response);
+        INSERT INTO chat_chat_fts(rowid, message, response) VALUES (new.id, new.message, new.response);
+    END
+    """,
+    # Index the rows written before this migration
+    "INSERT INTO chat_chat_fts(chat_chat_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS chat_chat_fts_update",
+    "DROP TRIGGER IF EXISTS chat_chat_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_chat_fts_insert",
+    "DROP TABLE IF EXISTS chat_chat_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Other databases fall back to LIKE queries in chat.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chat_history_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
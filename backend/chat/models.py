@@ -12,8 +12,23 @@ class UserProfile(models.Model):
     def __str__(self):
         return self.user.username
 
+class Conversation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+    title = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-updated_at']
+
+    def __str__(self):
+        return f"{self.user.username}: {self.title or 'Untitled'}"
+
 class Chat(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='chats', null=True, blank=True
+    )
     message = models.TextField()
     response = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
@@ -22,6 +37,11 @@ class Chat(models.Model):
         ordering = ['-timestamp']
         verbose_name = 'Chat Message'
         verbose_name_plural = 'Chat Messages'
+        indexes = [
+            # Newest-first keyset pages of a user's history, and of one conversation
+            models.Index(fields=['user', '-timestamp', '-id'], name='chat_user_time_id_idx'),
+            models.Index(fields=['conversation', '-timestamp', '-id'], name='chat_conv_time_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.message[:50]}..."
@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+from typing import Optional
+
+import pymongo
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CHATS_COLLECTION = 'chats'
+
+_client: Optional[MongoClient] = None
+_client_pid: Optional[int] = None
+_indexes_ready = False
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """
+    Forget the parent's client in a forked child. MongoClient is not fork-safe:
+    its sockets and monitor threads belong to the parent, so the child must
+    build its own pool instead of closing or reusing the inherited one.
+    """
+    global _client, _client_pid, _indexes_ready, _lock
+    _client = None
+    _client_pid = None
+    _indexes_ready = False
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client() -> MongoClient:
+    """
+    Process-wide MongoClient, created on first use.
+
+    The client owns a connection pool and is thread-safe, so every request
+    in this process shares it instead of opening its own connections.
+    """
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(
+                getattr(settings, 'MONGODB_URI', 'mongodb://localhost:27017/'),
+                maxPoolSize=getattr(settings, 'MONGODB_MAX_POOL_SIZE', 50),
+                minPoolSize=getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+                maxIdleTimeMS=getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', 300000),
+                connectTimeoutMS=getattr(settings, 'MONGODB_CONNECT_TIMEOUT_MS', 5000),
+                serverSelectionTimeoutMS=getattr(settings, 'MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000),
+                socketTimeoutMS=getattr(settings, 'MONGODB_SOCKET_TIMEOUT_MS', 10000),
+                waitQueueTimeoutMS=getattr(settings, 'MONGODB_WAIT_QUEUE_TIMEOUT_MS', 5000),
+                retryWrites=True,
+                appname='llm-chat-backend',
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_database():
+    return get_client()[getattr(settings, 'MONGODB_DATABASE', 'llm_chat_db')]
+
+
+def get_chats_collection() -> Collection:
+    """
+    Handle to the chats collection, creating its indexes the first time it is used.
+    """
+    collection = get_database()[CHATS_COLLECTION]
+    if not _indexes_ready:
+        ensure_indexes()
+    return collection
+
+
+def ensure_indexes() -> bool:
+    """
+    Create the indexes the chat history queries rely on, once per process.
+    create_index is a no-op for indexes that already exist.
+
+    Returns:
+        True if the indexes are in place, False if MongoDB was unreachable
+    """
+    global _indexes_ready
+    if _indexes_ready:
+        return True
+    try:
+        collection = get_database()[CHATS_COLLECTION]
+        collection.create_index([('user_id', ASCENDING)], name='user_id')
+        collection.create_index([('timestamp', DESCENDING)], name='timestamp')
+        collection.create_index([('user_id', ASCENDING), ('timestamp', DESCENDING)], name='user_id_timestamp')
+    except PyMongoError as e:
+        logger.warning(f"Could not create MongoDB indexes: {e}")
+        return False
+    _indexes_ready = True
+    return True
+
+
+def ping(timeout: float = 2.0) -> bool:
+    """
+    Health check: whether the deployment answers a ping within timeout seconds.
+    """
+    try:
+        with pymongo.timeout(timeout):
+            get_client().admin.command('ping')
+        return True
+    except PyMongoError as e:
+        logger.warning(f"MongoDB health check failed: {e}")
+        return False
+
+
+def close_client():
+    """
+    Close the pooled client, e.g. on shutdown. A new one is created on next use.
+    """
+    global _client, _client_pid, _indexes_ready
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+        _indexes_ready = False
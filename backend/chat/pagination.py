@@ -0,0 +1,91 @@
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first pagination on (timestamp, id).
+
+    The cursor is the key of the last row served, and the next page is the
+    rows strictly older than it, so each page is one range scan of the
+    (…, timestamp, id) index however deep the client scrolls, and rows
+    written meanwhile never shift or repeat entries. The id breaks ties
+    between rows saved within the same clock tick.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    time_field = 'timestamp'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        queryset = queryset.order_by(f'-{self.time_field}', '-id')
+        if position is not None:
+            timestamp, pk = position
+            queryset = queryset.filter(
+                Q(**{f'{self.time_field}__lt': timestamp}) | Q(**{self.time_field: timestamp, 'id__lt': pk})
+            )
+
+        # One extra row tells whether another page follows
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(last))
+
+    def encode_cursor(self, row):
+        key = f"{getattr(row, self.time_field).isoformat()}|{row.pk}"
+        return base64.urlsafe_b64encode(key.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').rsplit('|', 1)
+            position = parse_datetime(timestamp), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound('Invalid cursor.')
+        if position[0] is None:
+            raise NotFound('Invalid cursor.')
+        return position
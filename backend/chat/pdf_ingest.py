@@ -0,0 +1,266 @@
+import atexit
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PDFExtractionError(Exception):
+    """
+    The PDF could not be parsed, or extraction did not finish in time.
+    """
+
+
+def _extract_ranges(path: str, first: int, stride: int, pages_per_task: int,
+                    max_pages: int) -> Tuple[int, Dict[int, str]]:
+    """
+    Parse the PDF at path once and extract every stride-th range of
+    pages_per_task pages, starting with range number first, within the
+    first max_pages. Runs in a pool process.
+
+    Returns:
+        (number of pages in the document, {page index: text})
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    count = len(reader.pages)
+    texts = {}
+    for start in range(first * pages_per_task, min(count, max_pages), stride * pages_per_task):
+        for number in range(start, min(start + pages_per_task, count, max_pages)):
+            try:
+                texts[number] = reader.pages[number].extract_text() or ""
+            except Exception as e:
+                # One malformed page should not cost the rest of the document
+                texts[number] = f"[text of this page could not be extracted: {e}]"
+    return count, texts
+
+
+class PDFIngestor:
+    """
+    Extracts PDF text page by page in a pool of worker processes.
+
+    Parsing is CPU-bound pure Python, so it runs outside the web process
+    where it would hold the GIL against request threads. A document is
+    split into page ranges dealt out round-robin to one task per worker, so
+    each worker opens and parses the file once; only its path crosses the
+    process boundary, never its bytes. Results are cached by
+    the SHA-256 of the file: in memory, and as JSON files in cache_dir so
+    every worker process on the host shares them. Files unused for
+    cache_max_age seconds are removed, and the least recently used ones
+    whenever the directory grows past cache_max_bytes.
+
+    A timed-out extraction may leave workers stuck on the document, so the
+    pool is then terminated and replaced; extractions sharing it at that
+    moment fail too.
+    """
+
+    def __init__(self, workers: int = 2, pages_per_task: int = 8, max_pages: int = 200,
+                 timeout: float = 30, cache_dir: Optional[str] = None, cache_size: int = 64,
+                 cache_max_bytes: int = 256 * 1024 * 1024, cache_max_age: float = 7 * 24 * 3600):
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.cache_size = cache_size
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_age = cache_max_age
+        self._cache: "OrderedDict[str, Tuple[List[str], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def extract(self, path: str) -> Tuple[List[str], int]:
+        """
+        Text of each page (up to max_pages) of the PDF file at path.
+
+        Returns:
+            (page texts, number of pages in the whole document)
+
+        Raises:
+            PDFExtractionError: if the PDF cannot be parsed or extraction times out
+        """
+        digest = self._digest(path)
+        cached = self._cached(digest)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            self.misses += 1
+        pool = self._get_pool()
+        ranges = -(-self.max_pages // self.pages_per_task)
+        tasks = max(1, min(self.workers, ranges))
+        deadline = time.monotonic() + self.timeout
+        try:
+            futures = [
+                pool.submit(_extract_ranges, str(path), first, tasks, self.pages_per_task, self.max_pages)
+                for first in range(tasks)
+            ]
+            count, texts = 0, {}
+            for future in futures:
+                count, part = future.result(timeout=max(0, deadline - time.monotonic()))
+                texts.update(part)
+        except FutureTimeout:
+            self._recycle(pool)
+            raise PDFExtractionError(f"PDF extraction took longer than {self.timeout}s")
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory); start a fresh pool next time
+            self._recycle(pool)
+            raise PDFExtractionError(str(e)) from e
+        except Exception as e:
+            raise PDFExtractionError(str(e)) from e
+
+        result = ([texts[number] for number in sorted(texts)], count)
+        self._store(digest, result)
+        return result
+
+    def stats(self):
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "workers": self.workers,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pool_pid == os.getpid():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as source:
+            for chunk in iter(lambda: source.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _recycle(self, pool: ProcessPoolExecutor):
+        """
+        Replace the pool and kill its workers, which may be stuck on a document.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        # Snapshot first: shutdown() forgets the processes
+        processes = list((getattr(pool, '_processes', None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            # A forked worker must not use its parent's pool
+            if self._pool is None or self._pool_pid != os.getpid():
+                # Spawned, not forked: the web process may hold model weights and threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _cached(self, digest: str) -> Optional[Tuple[List[str], int]]:
+        with self._lock:
+            result = self._cache.get(digest)
+            if result is not None:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return result
+
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / f"{digest}.json"
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+            result = (entry['pages'], entry['page_count'])
+            # The modification time records the last use for pruning
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Includes entries written before the page count was stored
+            logger.warning(f"Ignoring unreadable PDF cache entry {digest}: {e}")
+            return None
+        self._remember(digest, result)
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def _store(self, digest: str, result: Tuple[List[str], int]):
+        self._remember(digest, result)
+        if self.cache_dir is None:
+            return
+        pages, page_count = result
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write then rename so concurrent readers never see a partial file
+            partial = self.cache_dir / f"{digest}.{os.getpid()}.tmp"
+            partial.write_text(json.dumps({'pages': pages, 'page_count': page_count}), encoding="utf-8")
+            os.replace(partial, self.cache_dir / f"{digest}.json")
+        except OSError as e:
+            logger.warning(f"Could not write PDF cache entry {digest}: {e}")
+        self._prune()
+
+    def _prune(self):
+        """
+        Remove cache files that are too old, then the least recently used
+        ones until the directory fits in cache_max_bytes.
+        """
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                info = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        entries.sort()
+
+        cutoff = time.time() - self.cache_max_age
+        total = sum(size for _, size, _ in entries)
+        for modified, size, path in entries:
+            if modified >= cutoff and total <= self.cache_max_bytes:
+                break
+            # Another process may have removed it already
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _remember(self, digest: str, result: Tuple[List[str], int]):
+        with self._lock:
+            self._cache[digest] = result
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def _build_ingestor() -> PDFIngestor:
+    return PDFIngestor(
+        workers=getattr(settings, 'PDF_INGEST_WORKERS', 2),
+        pages_per_task=getattr(settings, 'PDF_INGEST_PAGES_PER_TASK', 8),
+        max_pages=getattr(settings, 'PDF_INGEST_MAX_PAGES', 200),
+        timeout=getattr(settings, 'PDF_INGEST_TIMEOUT', 30),
+        cache_dir=getattr(settings, 'PDF_INGEST_CACHE_DIR', None),
+        cache_size=getattr(settings, 'PDF_INGEST_CACHE_SIZE', 64),
+        cache_max_bytes=getattr(settings, 'PDF_INGEST_CACHE_MAX_MB', 256) * 1024 * 1024,
+        cache_max_age=getattr(settings, 'PDF_INGEST_CACHE_MAX_AGE', 7 * 24 * 3600)
+    )
+
+
+pdf_ingestor = _build_ingestor()
+atexit.register(pdf_ingestor.shutdown)
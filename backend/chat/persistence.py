@@ -0,0 +1,412 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+import pymongo
+from bson import ObjectId
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from . import metrics, mongo
+from .models import Chat, Conversation
+
+logger = logging.getLogger(__name__)
+
+# Queue item telling the worker to exit after draining what came before it
+_STOP = object()
+
+DUPLICATE_KEY = 11000
+
+
+class ChatRecord:
+    """
+    One finished exchange waiting to be written to the Django database and MongoDB.
+
+    Each store is tracked separately so a retry or a dead-letter replay only
+    repeats the write that has not happened yet. The MongoDB _id is assigned
+    up front, which makes re-inserting a document that already landed a
+    harmless duplicate-key error.
+    """
+
+    def __init__(self, user_id: int, message: str, response: str, artifacts=None, attachments=None,
+                 conversation_id: Optional[int] = None):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.message = message
+        self.response = response
+        self.artifacts = artifacts or []
+        self.attachments = attachments or []
+        self.timestamp = timezone.now()
+        self.mongo_id = ObjectId()
+        self.django_id: Optional[int] = None
+        self.saved_to_db = False
+        self.saved_to_mongo = False
+
+    def mongo_document(self) -> Dict[str, Any]:
+        return {
+            '_id': self.mongo_id,
+            'user_id': self.user_id,
+            'message': self.message,
+            'response': self.response,
+            'artifacts': self.artifacts,
+            'attachments': self.attachments,
+            'timestamp': self.timestamp,
+            'django_id': self.django_id,
+            'conversation_id': self.conversation_id,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.mongo_document()
+        data.update({
+            '_id': str(self.mongo_id),
+            'timestamp': self.timestamp.isoformat(),
+            'saved_to_db': self.saved_to_db,
+            'saved_to_mongo': self.saved_to_mongo,
+        })
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ChatRecord':
+        record = cls(
+            data['user_id'], data['message'], data['response'],
+            artifacts=data.get('artifacts'), attachments=data.get('attachments'),
+            conversation_id=data.get('conversation_id'),
+        )
+        record.timestamp = parse_datetime(data['timestamp'])
+        record.mongo_id = ObjectId(data['_id'])
+        record.django_id = data.get('django_id')
+        record.saved_to_db = data.get('saved_to_db', False)
+        record.saved_to_mongo = data.get('saved_to_mongo', False)
+        return record
+
+
+class ChatWriter:
+    """
+    Write-behind persistence for chat records.
+
+    Requests enqueue a ChatRecord and return immediately; a background
+    thread drains the bounded queue in batches, writing each batch with one
+    bulk_create and one insert_many. Failed batches are retried with
+    exponential backoff, then written record by record, and records that
+    still fail are appended to a JSON-lines dead-letter file for replay.
+
+    When the queue is full the record is written on the caller's thread
+    instead, so a slow database applies backpressure rather than losing data.
+    That write gets a single attempt bounded by inline_timeout; if it fails
+    the record goes straight to the dead-letter file rather than holding the
+    request through retries.
+    """
+
+    def __init__(self, mode: str = 'async', max_queue: int = 1000, batch_size: int = 100,
+                 flush_interval: float = 0.5, max_retries: int = 3, retry_backoff: float = 0.5,
+                 dead_letter_dir: Optional[str] = None, shutdown_timeout: float = 10.0,
+                 inline_timeout: float = 1.0):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dead_letter_dir = Path(dead_letter_dir) if dead_letter_dir else None
+        self.shutdown_timeout = shutdown_timeout
+        self.inline_timeout = inline_timeout
+        self._max_queue = max_queue
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        # Records not yet committed to the Django database, by conversation
+        self._pending: Dict[int, List[ChatRecord]] = {}
+        self._atexit_registered = False
+        self.written = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.inline_writes = 0
+
+    def submit(self, record: ChatRecord):
+        """
+        Persist a record, in the background unless running in sync mode.
+        """
+        if self.mode == 'sync':
+            self.write([record])
+            self._count('written')
+            return
+
+        self._ensure_started()
+        self._track(record)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            logger.warning("Chat persistence queue is full; writing on the request thread")
+            self._count('inline_writes')
+            self._write_batch([record], attempts=1, timeout=self.inline_timeout)
+
+    def pending_turns(self, conversation_id: int) -> List[ChatRecord]:
+        """
+        Records of a conversation that are queued but not yet committed, oldest first.
+        Lets history reads see turns the worker has not written yet.
+        """
+        with self._lock:
+            return list(self._pending.get(conversation_id, ()))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until everything submitted before this call has been written.
+
+        Returns:
+            False if the timeout expired first
+        """
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stop(self):
+        """
+        Drain the queue and stop the worker; anything left after shutdown_timeout is dead-lettered.
+        """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(_STOP, timeout=self.shutdown_timeout)
+        except queue.Full:
+            pass
+        thread.join(self.shutdown_timeout)
+        self._thread = None
+        if thread.is_alive():
+            logger.error("Chat persistence worker did not finish in time; dead-lettering queued records")
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, ChatRecord):
+                leftovers.append(item)
+        for record in leftovers:
+            self._dead_letter(record, 'shutdown before the record was written')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'queued': self._queue.qsize(),
+                'written': self.written,
+                'retries': self.retries,
+                'dead_lettered': self.dead_lettered,
+                'inline_writes': self.inline_writes,
+            }
+
+    def write(self, records: List[ChatRecord], timeout: Optional[float] = None):
+        """
+        Write records to both stores, skipping any store a record already reached.
+        A timeout in seconds bounds the MongoDB insert, server selection included.
+        """
+        new = [record for record in records if not record.saved_to_db]
+        if new:
+            with metrics.stage('db_insert'), transaction.atomic():
+                chats = Chat.objects.bulk_create([
+                    Chat(
+                        user_id=record.user_id,
+                        conversation_id=record.conversation_id,
+                        message=record.message,
+                        response=record.response,
+                    )
+                    for record in new
+                ])
+                self._touch_conversations(new)
+            for record, chat in zip(new, chats):
+                record.django_id = chat.pk
+                record.timestamp = chat.timestamp
+                record.saved_to_db = True
+            self._untrack(new)
+
+        unsent = [record for record in records if not record.saved_to_mongo]
+        if unsent:
+            try:
+                with metrics.stage('mongo_insert'), (pymongo.timeout(timeout) if timeout else nullcontext()):
+                    mongo.get_chats_collection().insert_many(
+                        [record.mongo_document() for record in unsent], ordered=False
+                    )
+            except BulkWriteError as e:
+                # Documents left over from an earlier partial insert are already stored
+                if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', ())):
+                    raise
+            for record in unsent:
+                record.saved_to_mongo = True
+
+    def replay_dead_letters(self, path: Path) -> Tuple[int, int]:
+        """
+        Retry every record in a dead-letter file, keeping only those that fail again.
+
+        Returns:
+            (records written, records still failing)
+        """
+        path = Path(path)
+        failed = []
+        written = 0
+        for line in path.read_text().splitlines():
+            if not line.strip():
+                continue
+            record = ChatRecord.from_dict(json.loads(line)['record'])
+            try:
+                self.write([record])
+                written += 1
+            except Exception as e:
+                failed.append(json.dumps({'error': str(e), 'record': record.to_dict()}))
+        if failed:
+            path.write_text('\n'.join(failed) + '\n')
+        else:
+            path.unlink()
+        return written, len(failed)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Forked child: the parent's queue and worker thread are not ours
+                self._queue = queue.Queue(maxsize=self._max_queue)
+                self._pending = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def _run(self):
+        try:
+            while True:
+                batch, markers, stopping = [], [], False
+                item = self._queue.get()
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    if isinstance(item, threading.Event):
+                        markers.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    close_old_connections()
+                    self._write_batch(batch)
+                for marker in markers:
+                    marker.set()
+                if stopping:
+                    return
+        finally:
+            connection.close()
+
+    def _write_batch(self, batch: List[ChatRecord], attempts: Optional[int] = None,
+                     timeout: Optional[float] = None):
+        attempts = attempts or self.max_retries
+        error = None
+        for attempt in range(1, attempts + 1):
+            try:
+                self.write(batch, timeout=timeout)
+                self._count('written', len(batch))
+                return
+            except Exception as e:
+                error = e
+                logger.warning(f"Writing {len(batch)} chat record(s) failed "
+                               f"(attempt {attempt}/{attempts}): {e}")
+                if attempt < attempts:
+                    self._count('retries')
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+        # MongoDB being unreachable fails every record alike, so only a database
+        # error is worth isolating to the record that caused it.
+        if len(batch) > 1 and not isinstance(error, PyMongoError):
+            for record in batch:
+                try:
+                    self.write([record], timeout=timeout)
+                    self._count('written')
+                except Exception as e:
+                    self._dead_letter(record, e)
+            return
+
+        for record in batch:
+            self._dead_letter(record, error)
+
+    def _dead_letter(self, record: ChatRecord, error):
+        self._untrack([record])
+        self._count('dead_lettered')
+        if self.dead_letter_dir is None:
+            logger.error(f"Dropping chat record for user {record.user_id}: {error}")
+            return
+        try:
+            self.dead_letter_dir.mkdir(parents=True, exist_ok=True)
+            path = self.dead_letter_dir / f"chats-{os.getpid()}.jsonl"
+            with self._lock, open(path, 'a') as f:
+                f.write(json.dumps({'error': str(error), 'record': record.to_dict()}, default=str) + '\n')
+            logger.error(f"Chat record for user {record.user_id} written to {path}: {error}")
+        except OSError as e:
+            logger.error(f"Could not dead-letter chat record for user {record.user_id}: {e}")
+
+    def _count(self, name: str, amount: int = 1):
+        # Counters are bumped from request threads as well as the worker
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _track(self, record: ChatRecord):
+        if record.conversation_id is None:
+            return
+        with self._lock:
+            self._pending.setdefault(record.conversation_id, []).append(record)
+
+    def _untrack(self, records: List[ChatRecord]):
+        with self._lock:
+            for record in records:
+                pending = self._pending.get(record.conversation_id)
+                if pending and record in pending:
+                    pending.remove(record)
+                    if not pending:
+                        del self._pending[record.conversation_id]
+
+    @staticmethod
+    def _touch_conversations(records: List[ChatRecord]):
+        titles = {}
+        for record in records:
+            if record.conversation_id is not None:
+                titles.setdefault(record.conversation_id, record.message[:200])
+        if not titles:
+            return
+        Conversation.objects.filter(pk__in=titles).update(updated_at=timezone.now())
+        for conversation_id, title in titles.items():
+            Conversation.objects.filter(pk=conversation_id, title='').update(title=title)
+
+
+chat_writer = ChatWriter(
+    mode=getattr(settings, 'CHAT_PERSISTENCE_MODE', 'async'),
+    max_queue=getattr(settings, 'CHAT_PERSISTENCE_QUEUE_SIZE', 1000),
+    batch_size=getattr(settings, 'CHAT_PERSISTENCE_BATCH_SIZE', 100),
+    flush_interval=getattr(settings, 'CHAT_PERSISTENCE_FLUSH_INTERVAL', 0.5),
+    max_retries=getattr(settings, 'CHAT_PERSISTENCE_MAX_RETRIES', 3),
+    dead_letter_dir=getattr(settings, 'CHAT_PERSISTENCE_DEAD_LETTER_DIR', None),
+    inline_timeout=getattr(settings, 'CHAT_PERSISTENCE_INLINE_TIMEOUT', 1.0),
+)
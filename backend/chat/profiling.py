@@ -0,0 +1,321 @@
+"""
+On-demand profiling of the inference path.
+
+Profiling is off by default and then costs one attribute check per
+generation. It is switched on for a window of time (or a number of
+requests) by sending a worker PROFILING_SIGNAL, from the admin-only
+/api/profiling/ endpoint, or for a random fraction of all requests with
+PROFILING_SAMPLE_RATE. One generation is profiled at a time; requests
+arriving meanwhile run normally.
+
+Each profiled generation is written to its own directory under PROFILING_DIR:
+
+    meta.json          request metadata and timing
+    torch_trace.json   torch.profiler Chrome trace (chrome://tracing, Perfetto)
+    torch_ops.json     per-operator totals, summarized by `manage.py profile_summary`
+    cprofile.prof      cProfile stats (python -m pstats, snakeviz)
+    stacks.folded      sampled Python stacks in the collapsed format py-spy
+                       writes with --format raw (flamegraph.pl, speedscope)
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MODES = ('torch', 'cprofile', 'stacks')
+
+
+class StackSampler:
+    """
+    Sample the Python stacks of a few threads at a fixed interval and count
+    identical stacks, like py-spy does from outside the process.
+    """
+
+    def __init__(self, threads: Sequence[threading.Thread], interval: float = 0.005):
+        self.idents = {thread.ident: thread.name for thread in threads if thread is not None and thread.ident}
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, name in self.idents.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = self._fold(frame, name)
+                    self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    @staticmethod
+    def _fold(frame, thread_name: str) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        names.append(f"thread {thread_name}")
+        return ';'.join(reversed(names))
+
+    def write(self, path: Path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+
+class InferenceProfiler:
+    """
+    Decides which generations to profile and writes their captures.
+    """
+
+    def __init__(self, directory: Path, sample_rate: float = 0.0, window_seconds: float = 60,
+                 modes: Sequence[str] = MODES, stack_interval: float = 0.005, max_captures: int = 200):
+        self.directory = Path(directory)
+        self.sample_rate = sample_rate
+        self.window_seconds = window_seconds
+        self.modes = tuple(mode for mode in modes if mode in MODES)
+        self.stack_interval = stack_interval
+        self.max_captures = max_captures
+
+        # Reentrant: the signal handler may run while the main thread holds it
+        self._lock = threading.RLock()
+        self._busy = threading.Lock()
+        self._window_until: Optional[float] = None
+        self._window_rate = 1.0
+        self._window_requests: Optional[int] = None
+        # Checked before anything else, so disabled profiling stays a single attribute read
+        self._armed = sample_rate > 0
+        self.captured = 0
+        self.skipped = 0
+
+    def enable(self, seconds: Optional[float] = None, requests: Optional[int] = None,
+               sample_rate: float = 1.0):
+        """
+        Profile sample_rate of the generations in the next seconds (default
+        PROFILING_WINDOW_SECONDS), stopping early after `requests` captures.
+        """
+        with self._lock:
+            self._window_until = time.monotonic() + (seconds or self.window_seconds)
+            self._window_requests = requests
+            self._window_rate = sample_rate
+            self._armed = True
+        logger.info(f"Profiling enabled for {seconds or self.window_seconds}s"
+                    + (f" or {requests} request(s)" if requests else "") + f" at rate {sample_rate}")
+
+    def disable(self):
+        """
+        Close the current window; sampling at PROFILING_SAMPLE_RATE continues.
+        """
+        with self._lock:
+            self._window_until = None
+            self._window_requests = None
+            self._armed = self.sample_rate > 0
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            remaining = max(0.0, self._window_until - time.monotonic()) if self._window_until else 0.0
+            return {
+                'enabled': self._armed,
+                'window_seconds_left': round(remaining, 1),
+                'window_requests_left': self._window_requests,
+                'window_sample_rate': self._window_rate if self._window_until else None,
+                'sample_rate': self.sample_rate,
+                'modes': list(self.modes),
+                'directory': str(self.directory),
+                'captured': self.captured,
+                'skipped': self.skipped,
+            }
+
+    def install_signal_handler(self, signame: str):
+        """
+        Open a profiling window whenever this process receives signame.
+        Must be called from the main thread.
+        """
+        signum = getattr(signal, signame, None)
+        if signum is None:
+            logger.warning(f"Unknown profiling signal {signame!r}; signal-triggered profiling is off")
+            return
+        signal.signal(signum, lambda received, frame: self.enable())
+
+    def capture(self, metadata: Dict[str, Any], threads: Sequence[threading.Thread] = ()):
+        """
+        Context manager profiling the block if this call is selected, else
+        doing nothing. threads are sampled for stacks along with the caller's,
+        e.g. a scheduler thread that runs the generation on its behalf.
+        """
+        if not self._armed:
+            return nullcontext()
+        in_window = self._select()
+        if in_window is None:
+            return nullcontext()
+        if not self._busy.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            return nullcontext()
+        if in_window:
+            with self._lock:
+                if self._window_requests is not None:
+                    self._window_requests -= 1
+        return self._profiled(metadata, threads)
+
+    def _select(self) -> Optional[bool]:
+        """
+        Whether to profile this call: True when picked by the open window,
+        False when picked by PROFILING_SAMPLE_RATE, None when not picked.
+        """
+        with self._lock:
+            if self._window_until is not None:
+                if time.monotonic() > self._window_until or self._window_requests == 0:
+                    self._window_until = None
+                    self._window_requests = None
+                    self._armed = self.sample_rate > 0
+                elif random.random() < self._window_rate:
+                    return True
+            if self.sample_rate > 0 and random.random() < self.sample_rate:
+                return False
+            return None
+
+    @contextmanager
+    def _profiled(self, metadata: Dict[str, Any], threads: Sequence[threading.Thread]) -> Iterator[None]:
+        started_at = datetime.now(timezone.utc)
+        name = f"{started_at.strftime('%Y%m%dT%H%M%S.%f')}-{os.getpid()}-{threading.get_ident()}"
+        stack = ExitStack()
+        try:
+            profilers = self._start(stack, threads)
+        except Exception as e:
+            # A profiler that cannot start must never fail the request itself
+            logger.warning(f"Could not start profiling: {e}")
+            stack.close()
+            self._busy.release()
+            yield
+            return
+
+        error = None
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            try:
+                stack.close()
+                self._write(name, dict(
+                    metadata,
+                    captured_at=started_at.isoformat(),
+                    duration_seconds=round(duration, 6),
+                    pid=os.getpid(),
+                    thread=threading.current_thread().name,
+                    modes=list(self.modes),
+                    error=error,
+                ), *profilers)
+            except Exception as e:
+                logger.warning(f"Could not write profile {name}: {e}")
+            finally:
+                self._busy.release()
+
+    def _start(self, stack: ExitStack, threads: Sequence[threading.Thread]):
+        """
+        Start the configured profilers, registering their shutdown on stack.
+
+        Returns:
+            (torch profiler, cProfile profiler, stack sampler), None for modes that are off
+        """
+        torch_profiler = cpu_profiler = sampler = None
+        if 'torch' in self.modes:
+            torch_profiler = stack.enter_context(self._torch_profiler())
+        if 'cprofile' in self.modes:
+            cpu_profiler = cProfile.Profile()
+            cpu_profiler.enable()
+            stack.callback(cpu_profiler.disable)
+        if 'stacks' in self.modes:
+            sampler = StackSampler([threading.current_thread(), *threads], self.stack_interval)
+            sampler.start()
+            stack.callback(sampler.stop)
+        return torch_profiler, cpu_profiler, sampler
+
+    @staticmethod
+    def _torch_profiler():
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        return profile(activities=activities)
+
+    def _write(self, name: str, metadata: Dict[str, Any], torch_profiler, cpu_profiler, sampler):
+        directory = self.directory / name
+        directory.mkdir(parents=True, exist_ok=True)
+        if torch_profiler is not None:
+            torch_profiler.export_chrome_trace(str(directory / 'torch_trace.json'))
+            (directory / 'torch_ops.json').write_text(json.dumps(operator_totals(torch_profiler)))
+        if cpu_profiler is not None:
+            cpu_profiler.dump_stats(str(directory / 'cprofile.prof'))
+        if sampler is not None:
+            sampler.write(directory / 'stacks.folded')
+            metadata['stack_samples'] = sum(sampler.counts.values())
+        (directory / 'meta.json').write_text(json.dumps(metadata, indent=2, default=str))
+
+        with self._lock:
+            self.captured += 1
+        self._prune()
+        logger.info(f"Wrote inference profile {directory}")
+
+    def _prune(self):
+        """
+        Delete the oldest captures beyond max_captures.
+        """
+        if self.max_captures <= 0:
+            return
+        captures = sorted(path for path in self.directory.iterdir() if path.is_dir())
+        for path in captures[:-self.max_captures]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def operator_totals(torch_profiler) -> List[Dict[str, Any]]:
+    """
+    Per-operator call counts and times (microseconds) of a finished torch profile.
+    """
+    totals = []
+    for event in torch_profiler.key_averages():
+        totals.append({
+            'name': event.key,
+            'count': event.count,
+            'self_cpu_us': event.self_cpu_time_total,
+            'cpu_us': event.cpu_time_total,
+            'self_device_us': getattr(event, 'self_device_time_total', 0),
+        })
+    return totals
+
+
+inference_profiler = InferenceProfiler(
+    directory=getattr(settings, 'PROFILING_DIR', Path(settings.BASE_DIR) / 'profiles'),
+    sample_rate=getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0),
+    window_seconds=getattr(settings, 'PROFILING_WINDOW_SECONDS', 60),
+    modes=getattr(settings, 'PROFILING_MODES', MODES),
+    stack_interval=getattr(settings, 'PROFILING_STACK_INTERVAL_MS', 5) / 1000,
+    max_captures=getattr(settings, 'PROFILING_MAX_CAPTURES', 200),
+)
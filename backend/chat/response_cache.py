@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCacheBackend:
+    """
+    Interface for persistent response cache storage behind the in-process LRU.
+    """
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, response: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class SQLiteResponseCacheBackend(ResponseCacheBackend):
+    """
+    File-backed response cache for local and single-host deployments.
+    Shared by all worker processes on the host.
+    """
+
+    def __init__(self, path: str, ttl: int = 0):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT response, created_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created_at = row
+        if self.ttl and time.time() - created_at > self.ttl:
+            return None
+        return response
+
+    def set(self, key: str, response: str):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, time.time())
+            )
+            if self.ttl:
+                conn.execute("DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.ttl,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    """
+    Two-tier cache of finished responses: an in-process LRU in front of an
+    optional persistent backend. Only deterministic generations belong here.
+    """
+
+    def __init__(self, max_entries: int = 1024, backend: Optional[ResponseCacheBackend] = None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(prompt: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps({"prompt": prompt, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+
+        if self.backend is not None:
+            try:
+                response = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"Response cache backend lookup failed: {e}")
+                response = None
+            if response is not None:
+                self._remember(key, response)
+                with self._lock:
+                    self.hits += 1
+                return response
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, response: str):
+        self._remember(key, response)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, response)
+            except Exception as e:
+                logger.warning(f"Response cache backend write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "backend": type(self.backend).__name__ if self.backend else None,
+        }
+
+    def _remember(self, key: str, response: str):
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
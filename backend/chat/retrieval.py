@@ -0,0 +1,268 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\S+")
+
+
+@dataclass
+class Chunk:
+    source: str
+    text: str
+
+
+def chunk_text(text: str, chunk_words: int = 120, overlap_words: int = 20) -> List[str]:
+    """
+    Split text into windows of chunk_words words, each sharing overlap_words
+    with the previous one so a passage cut at a boundary survives whole in
+    one of them. Chunks are slices of the original, so layout is kept.
+    """
+    words = [match.span() for match in WORD_PATTERN.finditer(text)]
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for start in range(0, len(words), step):
+        window = words[start:start + chunk_words]
+        chunks.append(text[window[0][0]:window[-1][1]])
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+class HashingEmbedder:
+    """
+    Bag of hashed words and word pairs. Needs no model, so it is the fallback
+    when no encoder is configured or it cannot be loaded; it matches shared
+    vocabulary rather than meaning.
+    """
+
+    # One shared word between a query and a chunk already scores a few hundredths
+    min_score = 0.03
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [word.strip(".,;:!?()[]{}\"'").lower() for word in text.split()]
+            words = [word for word in words if word]
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        return _normalize(vectors)
+
+
+class TransformerEmbedder:
+    """
+    Mean-pooled sentence embeddings from a small local encoder such as
+    sentence-transformers/all-MiniLM-L6-v2, computed in batches.
+    """
+
+    # Unrelated passages typically score around 0.1 with these encoders
+    min_score = 0.2
+
+    def __init__(self, model_name: str, batch_size: int = 32, max_length: int = 256):
+        from transformers import AutoModel, AutoTokenizer
+
+        self.name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.dim = self.model.config.hidden_size
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        import torch
+
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(
+                list(texts[start:start + self.batch_size]), padding=True, truncation=True,
+                max_length=self.max_length, return_tensors="pt"
+            )
+            with torch.inference_mode():
+                hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            batches.append(pooled.float().numpy())
+        if not batches:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize(np.concatenate(batches))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """
+    Brute-force cosine index. One conversation holds at most a few thousand
+    chunks, where a matrix-vector product beats building an ANN structure.
+    """
+
+    def __init__(self, dim: int, max_chunks: int = 2000):
+        self.max_chunks = max_chunks
+        self.chunks: List[Chunk] = []
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+
+    def add(self, chunks: Sequence[Chunk], vectors: np.ndarray):
+        self.chunks.extend(chunks)
+        self.vectors = np.concatenate([self.vectors, vectors.astype(np.float32)])
+        # Forget the oldest uploads first
+        overflow = len(self.chunks) - self.max_chunks
+        if overflow > 0:
+            del self.chunks[:overflow]
+            self.vectors = self.vectors[overflow:]
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[Chunk, float]]:
+        if not self.chunks or k <= 0:
+            return []
+        scores = self.vectors @ query
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunks[i], float(scores[i])) for i in top]
+
+    def __len__(self):
+        return len(self.chunks)
+
+
+class Retriever:
+    """
+    Chunks attachment text, embeds it in batches and keeps one in-memory
+    index per (user, conversation), so later turns of a conversation can
+    draw on files uploaded earlier. Indexes are evicted least recently used.
+    """
+
+    def __init__(self, embedding_model: str = "", chunk_words: int = 120, overlap_words: int = 20,
+                 top_k: int = 4, max_indexes: int = 256, max_chunks: int = 2000,
+                 min_score: Optional[float] = None):
+        self.embedding_model = embedding_model
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self.top_k = top_k
+        self.max_indexes = max_indexes
+        self.max_chunks = max_chunks
+        self.min_score = min_score
+        self._embedder = None
+        self._indexes: "OrderedDict[Hashable, VectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            with self._lock:
+                if self._embedder is None:
+                    self._embedder = self._load_embedder()
+        return self._embedder
+
+    def warm_up(self):
+        """
+        Load the encoder ahead of the first upload.
+        """
+        return self.embedder
+
+    def _load_embedder(self):
+        if self.embedding_model:
+            try:
+                embedder = TransformerEmbedder(self.embedding_model)
+                logger.info(f"Loaded retrieval encoder {self.embedding_model}")
+                return embedder
+            except Exception as e:
+                logger.warning(f"Could not load retrieval encoder {self.embedding_model}, using hashed features: {e}")
+        return HashingEmbedder()
+
+    def add_documents(self, key: Hashable, documents: Sequence[Tuple[str, str]]):
+        """
+        Chunk, embed and index (source name, text) documents under key.
+        """
+        chunks = self._chunk(documents)
+        if not chunks:
+            return
+        vectors = self.embedder.embed([chunk.text for chunk in chunks])
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = VectorIndex(self.embedder.dim, self.max_chunks)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            index.add(chunks, vectors)
+
+    def search(self, key: Hashable, query: str, k: Optional[int] = None) -> List[Tuple[Chunk, float]]:
+        """
+        The k chunks indexed under key most similar to query, best first.
+        """
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+        if index is None:
+            return []
+        return self._search(index, query, k)
+
+    def rank(self, documents: Sequence[Tuple[str, str]], query: str,
+             k: Optional[int] = None) -> List[Tuple[Chunk, float]]:
+        """
+        Like search, over documents that are not kept in any index.
+        """
+        chunks = self._chunk(documents)
+        if not chunks:
+            return []
+        index = VectorIndex(self.embedder.dim, max_chunks=len(chunks))
+        index.add(chunks, self.embedder.embed([chunk.text for chunk in chunks]))
+        return self._search(index, query, k)
+
+    def drop(self, key: Hashable):
+        with self._lock:
+            self._indexes.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "indexes": len(self._indexes),
+                "chunks": sum(len(index) for index in self._indexes.values()),
+                "embedder": self._embedder.name if self._embedder else None,
+            }
+
+    def _chunk(self, documents: Sequence[Tuple[str, str]]) -> List[Chunk]:
+        return [
+            Chunk(source, text)
+            for source, document in documents
+            for text in chunk_text(document, self.chunk_words, self.overlap_words)
+        ]
+
+    def _search(self, index: VectorIndex, query: str, k: Optional[int]) -> List[Tuple[Chunk, float]]:
+        k = self.top_k if k is None else k
+        if not query.strip():
+            # Nothing to match against; start from the beginning of the files
+            return [(chunk, 0.0) for chunk in index.chunks[:k]]
+        hits = index.search(self.embedder.embed([query])[0], k)
+        # Scores are only comparable within one embedder, which supplies the default
+        min_score = self.embedder.min_score if self.min_score is None else self.min_score
+        return [(chunk, score) for chunk, score in hits if score >= min_score]
+
+
+retriever = Retriever(
+    embedding_model=getattr(settings, 'RETRIEVAL_EMBEDDING_MODEL', ''),
+    chunk_words=getattr(settings, 'RETRIEVAL_CHUNK_WORDS', 120),
+    overlap_words=getattr(settings, 'RETRIEVAL_CHUNK_OVERLAP', 20),
+    top_k=getattr(settings, 'RETRIEVAL_TOP_K', 4),
+    max_indexes=getattr(settings, 'RETRIEVAL_MAX_INDEXES', 256),
+    max_chunks=getattr(settings, 'RETRIEVAL_MAX_CHUNKS', 2000),
+    min_score=getattr(settings, 'RETRIEVAL_MIN_SCORE', None)
+)
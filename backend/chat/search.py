@@ -0,0 +1,137 @@
+"""
+Full-text search over chat history.
+
+On SQLite queries go to the chat_chat_fts FTS5 index created by migration
+0005, ranked with BM25 and returned with highlighted snippets. Other
+databases fall back to case-insensitive LIKE matching in timestamp order.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .models import Chat
+
+FTS_TABLE = 'chat_chat_fts'
+TERM_PATTERN = re.compile(r'\w+\*?', re.UNICODE)
+# Private-use markers survive escaping and are swapped for <mark> afterwards
+MARK_START, MARK_END = '\ue000', '\ue001'
+# A match in the message counts a little more than one in the response
+MESSAGE_WEIGHT, RESPONSE_WEIGHT = 2.0, 1.0
+
+_available: Optional[bool] = None
+
+
+def search_available() -> bool:
+    """
+    Whether the FTS5 index exists in the default database.
+    """
+    global _available
+    if _available is None:
+        _available = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _available
+
+
+def match_expression(text: str) -> str:
+    """
+    FTS5 query matching rows that contain every word of text. Each word is
+    quoted, so user input can never be parsed as FTS5 syntax; a trailing *
+    keeps its meaning as a prefix search.
+    """
+    terms = []
+    for term in TERM_PATTERN.findall(text):
+        prefix = term.endswith('*')
+        word = term.rstrip('*')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return ' '.join(terms)
+
+
+def filter_matching(queryset: QuerySet, text: str) -> QuerySet:
+    """
+    Narrow a Chat queryset to rows whose message or response matches text.
+    """
+    expression = match_expression(text)
+    if not expression:
+        return queryset.none()
+    if search_available():
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (expression,)
+        ))
+    words = [term.rstrip('*') for term in TERM_PATTERN.findall(text)]
+    for word in words:
+        queryset = queryset.filter(Q(message__icontains=word) | Q(response__icontains=word))
+    return queryset
+
+
+def search_chats(user_id: int, text: str, conversation_id: Optional[int] = None,
+                 limit: int = 20, offset: int = 0, snippet_tokens: int = 16) -> List[Dict[str, Any]]:
+    """
+    The user's chat turns matching text, best match first.
+
+    Returns:
+        Dicts with id, conversation_id, timestamp, rank (lower is better,
+        None without FTS) and HTML-escaped message/response snippets with
+        matches wrapped in <mark>
+    """
+    expression = match_expression(text)
+    if not expression:
+        return []
+    if not search_available():
+        return _search_like(user_id, text, conversation_id, limit, offset)
+
+    table = Chat._meta.db_table
+    sql = (
+        f"SELECT c.id, c.conversation_id, c.timestamp, "
+        f"bm25({FTS_TABLE}, %s, %s) AS rank, "
+        f"snippet({FTS_TABLE}, 0, %s, %s, '…', %s) AS message_snippet, "
+        f"snippet({FTS_TABLE}, 1, %s, %s, '…', %s) AS response_snippet "
+        f"FROM {FTS_TABLE} JOIN {table} c ON c.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s AND c.user_id = %s"
+    )
+    params = [
+        MESSAGE_WEIGHT, RESPONSE_WEIGHT,
+        MARK_START, MARK_END, snippet_tokens,
+        MARK_START, MARK_END, snippet_tokens,
+        expression, user_id,
+    ]
+    if conversation_id is not None:
+        sql += " AND c.conversation_id = %s"
+        params.append(conversation_id)
+    sql += " ORDER BY rank LIMIT %s OFFSET %s"
+    params += [limit, offset]
+
+    # message and response stay deferred; only the snippets are read
+    return [{
+        'id': chat.id,
+        'conversation_id': chat.conversation_id,
+        'timestamp': chat.timestamp,
+        'rank': chat.rank,
+        'message_snippet': highlight(chat.message_snippet),
+        'response_snippet': highlight(chat.response_snippet),
+    } for chat in Chat.objects.raw(sql, params)]
+
+
+def highlight(snippet: str) -> str:
+    return escape(snippet or '').replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def _search_like(user_id: int, text: str, conversation_id: Optional[int], limit: int,
+                 offset: int) -> List[Dict[str, Any]]:
+    queryset = filter_matching(Chat.objects.filter(user_id=user_id), text)
+    if conversation_id is not None:
+        queryset = queryset.filter(conversation_id=conversation_id)
+    rows = queryset.order_by('-timestamp', '-id').values(
+        'id', 'conversation_id', 'timestamp', 'message', 'response'
+    )[offset:offset + limit]
+    return [{
+        'id': row['id'],
+        'conversation_id': row['conversation_id'],
+        'timestamp': row['timestamp'],
+        'rank': None,
+        'message_snippet': escape(row['message'][:200]),
+        'response_snippet': escape(row['response'][:200]),
+    } for row in rows]
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Conversation, Chat
 
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -24,4 +24,77 @@ class RegisterSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = User.objects.create_user(**validated_data)
         UserProfile.objects.create(user=user)
-        return user
\ No newline at end of file
+        return user
+
+class ChatSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Chat
+        fields = ['id', 'message', 'response', 'timestamp']
+
+class ChatHistorySerializer(serializers.ModelSerializer):
+    """
+    List entry of the chat history: previews instead of the full texts.
+    """
+    message_preview = serializers.CharField(read_only=True)
+    response_preview = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Chat
+        fields = ['id', 'conversation_id', 'timestamp', 'message_preview', 'response_preview']
+
+class ConversationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = ['id', 'title', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+class ConversationDetailSerializer(ConversationSerializer):
+    chats = serializers.SerializerMethodField()
+
+    class Meta(ConversationSerializer.Meta):
+        fields = ConversationSerializer.Meta.fields + ['chats']
+
+    def get_chats(self, obj):
+        return ChatSerializer(obj.chats.order_by('timestamp'), many=True).data
+
+class ProfilingWindowSerializer(serializers.Serializer):
+    """
+    Options for a profiling window opened from the admin endpoint.
+    """
+    seconds = serializers.FloatField(required=False, min_value=1, max_value=3600)
+    requests = serializers.IntegerField(required=False, min_value=1)
+    sample_rate = serializers.FloatField(required=False, default=1.0, min_value=0.0, max_value=1.0)
+
+class GenerationParamsSerializer(serializers.Serializer):
+    """
+    Per-request generation options, checked against the caps of the user's
+    tier passed as context['caps'] (see chat.generation.generation_caps).
+    """
+    max_new_tokens = serializers.IntegerField(required=False, min_value=1)
+    temperature = serializers.FloatField(required=False, min_value=0.0, max_value=2.0)
+    top_p = serializers.FloatField(required=False, min_value=0.01, max_value=1.0)
+    do_sample = serializers.BooleanField(required=False, allow_null=True)
+    stop = serializers.ListField(
+        child=serializers.CharField(max_length=64, trim_whitespace=False), required=False, allow_empty=True
+    )
+
+    def validate_max_new_tokens(self, value):
+        limit = self.context['caps']['max_new_tokens']
+        if value > limit:
+            raise serializers.ValidationError(f"Ensure this value is less than or equal to {limit}.")
+        return value
+
+    def validate_stop(self, value):
+        limit = self.context['caps']['max_stop_sequences']
+        if len(value) > limit:
+            raise serializers.ValidationError(f"Ensure this field has no more than {limit} stop sequences.")
+        return value
+
+    def validate(self, attrs):
+        # A temperature of 0 asks for the single most likely continuation
+        if attrs.get('temperature') == 0:
+            if attrs.get('do_sample'):
+                raise serializers.ValidationError({'temperature': 'Sampling requires a temperature above 0.'})
+            attrs['do_sample'] = False
+            del attrs['temperature']
+        return {key: value for key, value in attrs.items() if value is not None}
@@ -0,0 +1,79 @@
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import torch
+from accelerate import init_empty_weights
+from transformers import AutoConfig, AutoModelForCausalLM
+
+logger = logging.getLogger(__name__)
+
+WEIGHTS_FILE = "weights.pt"
+
+
+def shared_weights_exist(directory: Path) -> bool:
+    return (Path(directory) / WEIGHTS_FILE).exists() and (Path(directory) / "config.json").exists()
+
+
+@contextmanager
+def _export_lock(directory: Path):
+    """
+    Inter-process lock so only one worker writes the shared copy.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / ".export.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_shared_weights(model, directory: Path):
+    """
+    Write the model config and state dict to directory for memory-mapped loading.
+    The weights file is written under a temporary name and renamed into place,
+    so concurrent readers never observe a partial file.
+    """
+    directory = Path(directory)
+    with _export_lock(directory):
+        if shared_weights_exist(directory):
+            return
+        logger.info(f"Exporting shared model weights to {directory}")
+        model.config.save_pretrained(directory)
+        state_dict = {name: tensor.contiguous() for name, tensor in model.state_dict().items()}
+        tmp_path = directory / f"{WEIGHTS_FILE}.{os.getpid()}.tmp"
+        torch.save(state_dict, tmp_path)
+        os.replace(tmp_path, directory / WEIGHTS_FILE)
+
+
+def load_shared_model(directory: Path, dtype: torch.dtype):
+    """
+    Build a model whose parameters are views into the memory-mapped weights file.
+
+    The file is mapped copy-on-write and never written to, so every worker
+    process loading the same file shares the same physical page-cache pages.
+    Only activations and the KV cache are private to each worker.
+    """
+    directory = Path(directory)
+    config = AutoConfig.from_pretrained(directory)
+
+    # Parameters start on the meta device; non-persistent buffers such as
+    # rotary frequencies are still materialized normally.
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+
+    state_dict = torch.load(directory / WEIGHTS_FILE, mmap=True, weights_only=True, map_location="cpu")
+    if any(tensor.dtype != dtype for tensor in state_dict.values() if tensor.is_floating_point()):
+        logger.warning("Shared weights dtype differs from the requested dtype; tensors will be copied per worker")
+        state_dict = {
+            name: tensor.to(dtype) if tensor.is_floating_point() else tensor
+            for name, tensor in state_dict.items()
+        }
+
+    model.load_state_dict(state_dict, assign=True)
+    model.tie_weights()
+    model.eval()
+    return model
@@ -0,0 +1,94 @@
+import logging
+import threading
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeStats:
+    """
+    Counters for assisted generation: how many drafted tokens the main model
+    accepted and how many tokens each verification forward pass produced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.generations = 0
+        self.generated_tokens = 0
+        self.seconds = 0.0
+        self.verify_passes = 0
+        self.proposed_tokens = 0
+        self.accepted_tokens = 0
+
+    def record_step(self, proposed: int, accepted: int):
+        with self._lock:
+            self.verify_passes += 1
+            self.proposed_tokens += proposed
+            self.accepted_tokens += accepted
+
+    def record_generation(self, tokens: int, seconds: float):
+        with self._lock:
+            self.generations += 1
+            self.generated_tokens += tokens
+            self.seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "generations": self.generations,
+                "proposed_tokens": self.proposed_tokens,
+                "accepted_tokens": self.accepted_tokens,
+                "acceptance_rate": self.accepted_tokens / self.proposed_tokens if self.proposed_tokens else 0.0,
+                # Plain decoding yields one token per main-model pass, so this
+                # is the speedup in main-model passes (draft cost excluded)
+                "tokens_per_pass": (self.accepted_tokens + self.verify_passes) / self.verify_passes
+                if self.verify_passes else 0.0,
+                "tokens_per_sec": self.generated_tokens / self.seconds if self.seconds else 0.0,
+            }
+
+
+class _CountingCandidateGenerator:
+    """
+    Wraps a transformers CandidateGenerator to record proposed and accepted draft tokens.
+    """
+
+    def __init__(self, generator, stats: SpeculativeStats):
+        self._generator = generator
+        self._stats = stats
+        self._proposed = 0
+
+    def get_candidates(self, input_ids):
+        candidate_ids, candidate_logits = self._generator.get_candidates(input_ids)
+        self._proposed = candidate_ids.shape[-1] - input_ids.shape[-1]
+        return candidate_ids, candidate_logits
+
+    def update_candidate_strategy(self, input_ids, scores, num_matches):
+        self._stats.record_step(self._proposed, int(num_matches))
+        return self._generator.update_candidate_strategy(input_ids, scores, num_matches)
+
+    def __getattr__(self, name):
+        return getattr(self._generator, name)
+
+
+def track_speculation(model, stats: SpeculativeStats) -> bool:
+    """
+    Make every assisted generate() call on model report into stats.
+
+    Hooks the private GenerationMixin._get_candidate_generator of the
+    pinned transformers release; if it is missing, generation is left
+    untouched and no acceptance counts are recorded.
+
+    Returns:
+        Whether the counters were installed
+    """
+    original = getattr(model, "_get_candidate_generator", None)
+    if not callable(original):
+        logger.warning("This transformers version has no candidate generator hook; "
+                       "speculative acceptance is not counted")
+        return False
+
+    def _get_candidate_generator(*args, **kwargs):
+        return _CountingCandidateGenerator(original(*args, **kwargs), stats)
+
+    model._get_candidate_generator = _get_candidate_generator
+    return True
@@ -0,0 +1,100 @@
+import threading
+from typing import List, Optional, Sequence
+
+import torch
+from transformers import StoppingCriteria
+
+from .generation import prompt_words, reply_is_final
+
+
+class CancelledCriteria(StoppingCriteria):
+    """
+    Stop generation once the caller sets the event, e.g. after a request timeout.
+    """
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class TimingCriteria(StoppingCriteria):
+    """
+    Never stops generation; reports every decoding step to a GenerationTimer.
+    """
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.timer.step(input_ids.shape[-1])
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+
+def stop_window(stop_sequences: Sequence[str]) -> int:
+    """
+    Number of trailing tokens to decode to find a stop sequence the latest
+    token may have completed: a stop string of n characters spans at most
+    n tokens, plus a couple for tokens that decode to partial characters.
+    """
+    return max((len(sequence) for sequence in stop_sequences), default=0) + 2
+
+
+class GeneratedTextCriteria(StoppingCriteria):
+    """
+    Base for criteria that look at the text generated after the prompt.
+
+    Without an explicit prompt_length it is inferred on the first call,
+    when exactly one token has been generated.
+    """
+
+    def __init__(self, tokenizer, prompt_length: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+
+    def decode_generated(self, input_ids: torch.LongTensor, window: Optional[int] = None) -> List[str]:
+        """
+        Decode each sequence's generated tokens, or only the last window of them.
+        """
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[-1] - 1
+        start = self.prompt_length
+        if window is not None:
+            start = max(start, input_ids.shape[-1] - window)
+        return self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=True)
+
+
+class StopSequenceCriteria(GeneratedTextCriteria):
+    """
+    Stop a sequence as soon as its generated text contains one of the stop
+    strings, decoding only the last stop_window() tokens at each step.
+    """
+
+    def __init__(self, tokenizer, stop_sequences: Sequence[str], prompt_length: Optional[int] = None):
+        super().__init__(tokenizer, prompt_length)
+        self.stop_sequences = [sequence for sequence in stop_sequences if sequence]
+        self.window = stop_window(self.stop_sequences)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = [
+            any(sequence in text for sequence in self.stop_sequences)
+            for text in self.decode_generated(input_ids, self.window)
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class FinalReplyCriteria(GeneratedTextCriteria):
+    """
+    Stop a sequence once post-processing would throw away everything
+    generated after it, e.g. past the last sentence a reply may keep
+    (see chat.generation.reply_is_final).
+    """
+
+    def __init__(self, tokenizer, prompt: str, prompt_length: Optional[int] = None):
+        super().__init__(tokenizer, prompt_length)
+        self.prompt_words = prompt_words(prompt)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = [reply_is_final(text, self.prompt_words) for text in self.decode_generated(input_ids)]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
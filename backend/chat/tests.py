@@ -1,3 +1,1097 @@
-from django.test import TestCase
+import base64
+import io
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import torch
+from django.conf import settings
+from django.db import connections
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from pymongo.errors import AutoReconnect
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from llm_project.database import DEFAULT_SQLITE_PRAGMAS, parse_database_url
+
+from .ai_service import AIModelService, ai_service
+from .benchmarking import EARLY_STOP_PROMPTS, build_tiny_model, build_tiny_service, early_stop_savings, run_benchmark
+from .serializers import GenerationParamsSerializer
+from .views import ChatStreamView, ChatView
+from .executor import InferenceExecutor
+from .inference_server import serve_connection
+from .ipc import (
+    END, HEADER, MAX_FRAME_BYTES, REQUEST, TOKEN, InferenceClient, InferenceServerError, decode_json, recv_frame,
+    send_frame
+)
+from .kv_cache import ConversationCache, PrefixCache
+from .metrics import MODEL_LOAD_SECONDS, Histogram, record_stage, request_timings
+from .models import Chat, Conversation
+from .pdf_ingest import PDFExtractionError, PDFIngestor
+from .persistence import ChatRecord, ChatWriter
+from .pagination import KeysetPagination
+from .profiling import InferenceProfiler
+from .speculative import SpeculativeStats, track_speculation
+from .retrieval import Chunk, HashingEmbedder, Retriever, VectorIndex, chunk_text
+from . import search, uploads
+
+
+class InferenceBenchmarkTests(SimpleTestCase):
+    """
+    Run the offline inference benchmark on the tiny model; full runs use
+    `manage.py bench_inference`.
+    """
+
+    def run_scenario(self, **overrides):
+        service = build_tiny_service(do_sample=False, response_cache=None, **overrides)
+        try:
+            return run_benchmark(service, concurrency=2, prompt_tokens=16, max_new_tokens=8, num_requests=4)
+        finally:
+            service.unload_model()
+
+    def assert_report(self, result):
+        self.assertEqual(result['requests'], 4)
+        self.assertGreater(result['generated_tokens'], 0)
+        self.assertGreater(result['tokens_per_sec'], 0)
+        self.assertLessEqual(result['ttft_p50'], result['latency_p50'])
+        self.assertLessEqual(result['latency_p50'], result['latency_p99'])
+
+    def test_direct_generation(self):
+        self.assert_report(self.run_scenario(continuous_batching=False))
+
+    def test_continuous_batching(self):
+        self.assert_report(self.run_scenario(continuous_batching=True))
+
+
+def make_kv(length):
+    """
+    One-layer DynamicCache whose keys and values number the positions.
+    """
+    from transformers import DynamicCache
+    tensor = torch.arange(length, dtype=torch.float32).view(1, 1, length, 1)
+    return DynamicCache.from_legacy_cache(((tensor, tensor.clone()),))
+
+
+class PrefixCacheTests(SimpleTestCase):
+    # Bytes held by make_kv(1)
+    TOKEN_BYTES = 8
+
+    def test_lookup_reuses_the_longest_shared_prefix(self):
+        cache = PrefixCache()
+        cache.put([1, 2, 3, 4], make_kv(4))
+
+        depth, kv = cache.lookup([1, 2, 3, 9, 9])
+        self.assertEqual(depth, 3)
+        self.assertEqual(kv.to_legacy_cache()[0][0].flatten().tolist(), [0, 1, 2])
+        # A full match still leaves the last token for the model
+        self.assertEqual(cache.lookup([1, 2, 3, 4])[0], 3)
+        self.assertEqual(cache.lookup([5, 6]), (0, None))
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_lookup_returns_a_private_copy(self):
+        cache = PrefixCache()
+        cache.put([1, 2, 3], make_kv(3))
+        _, kv = cache.lookup([1, 2, 3])
+        kv.to_legacy_cache()[0][0].fill_(-1)
+        _, again = cache.lookup([1, 2, 3])
+        self.assertEqual(again.to_legacy_cache()[0][0].flatten().tolist(), [0, 1])
+
+    def test_evicts_least_recently_used(self):
+        cache = PrefixCache(capacity=2)
+        cache.put([1, 1], make_kv(2))
+        cache.put([2, 2], make_kv(2))
+        cache.lookup([1, 1, 0])
+        cache.put([3, 3], make_kv(2))
+        self.assertEqual(cache.lookup([2, 2, 0]), (0, None))
+        self.assertEqual(cache.lookup([1, 1, 0])[0], 2)
+        self.assertEqual(cache.lookup([3, 3, 0])[0], 2)
+
+    def test_evicts_past_the_byte_budget(self):
+        cache = PrefixCache(max_bytes=10 * self.TOKEN_BYTES)
+        cache.put([1] * 4, make_kv(4))
+        cache.put([2] * 5, make_kv(5))
+        self.assertEqual(cache.stats()['bytes'], 9 * self.TOKEN_BYTES)
+        cache.put([3] * 4, make_kv(4))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup([1] * 5), (0, None))
+        # Too large to ever fit
+        cache.put([4] * 11, make_kv(11))
+        self.assertEqual(cache.lookup([4] * 12), (0, None))
+
+    def test_pinned_entries_are_never_evicted(self):
+        cache = PrefixCache(capacity=1, max_bytes=2 * self.TOKEN_BYTES)
+        cache.put([1, 2, 3], make_kv(3), pinned=True)
+        cache.put([4, 5], make_kv(2))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.lookup([1, 2, 3, 4])[0], 3)
+
+    def test_offer_admits_recurring_prompts(self):
+        cache = PrefixCache()
+        self.assertFalse(cache.offer([1, 2, 3]))
+        self.assertTrue(cache.offer([1, 2, 3]))
+        cache.put([1, 2, 3], make_kv(3))
+        self.assertFalse(cache.offer([1, 2, 3]))
+        self.assertFalse(cache.offer([4, 5]))
+
+
+class CPUPrecisionTests(SimpleTestCase):
+
+    def test_bfloat16_only_where_supported(self):
+        service = AIModelService()
+        service.cpu_precision = 'bfloat16'
+        with mock.patch.object(AIModelService, '_cpu_supports_bfloat16', return_value=True):
+            self.assertEqual(service._cpu_dtype(), torch.bfloat16)
+        with mock.patch.object(AIModelService, '_cpu_supports_bfloat16', return_value=False), \
+                self.assertLogs('chat.ai_service', 'WARNING'):
+            self.assertEqual(service._cpu_dtype(), torch.float32)
+        service.cpu_precision = 'float32'
+        self.assertEqual(service._cpu_dtype(), torch.float32)
+
+    def test_int8_quantizes_all_but_the_output_projection(self):
+        model, tokenizer = build_tiny_model()
+        input_ids = tokenizer('w1 w2 w3', return_tensors='pt').input_ids
+        with torch.no_grad():
+            expected = model(input_ids).logits
+            quantized = AIModelService._quantize_int8(model)
+            logits = quantized(input_ids).logits
+
+        self.assertIs(type(quantized.lm_head), torch.nn.Linear)
+        self.assertIsInstance(quantized.model.layers[0].self_attn.q_proj, torch.ao.nn.quantized.dynamic.Linear)
+        self.assertEqual(logits.shape, expected.shape)
+        self.assertTrue(torch.allclose(logits, expected, atol=0.1))
+
+    def test_int8_is_not_combined_with_shared_weights(self):
+        with self.settings(AI_MODEL_CPU_PRECISION='int8', AI_MODEL_LOAD_MODE='mmap'), \
+                self.assertLogs('chat.ai_service', 'WARNING'):
+            service = AIModelService()
+        self.assertEqual(service.cpu_precision, 'float32')
+        with self.settings(AI_MODEL_CPU_PRECISION='int8', AI_MODEL_LOAD_MODE='default'):
+            self.assertEqual(AIModelService().cpu_precision, 'int8')
+
+
+class SpeculativeDecodingTests(SimpleTestCase):
+
+    def test_prompt_lookup_counts_drafts_without_changing_output(self):
+        # The earlier turn inside the message makes the prompt's tail recur, so drafts are proposed
+        prompt = 'w1 w2</s>\n<|assistant|>\nw5 w6 w7</s>\n<|user|>\nw1 w2'
+        replies = {}
+        for mode in ('', 'prompt_lookup'):
+            service = build_tiny_service(
+                speculative_mode=mode, speculative_tokens=3, do_sample=False, response_cache=None, prefix_cache=None
+            )
+            try:
+                replies[mode] = service.generate_response(prompt, params={'max_new_tokens': 12})
+            finally:
+                service.unload_model()
+
+        self.assertEqual(replies['prompt_lookup'], replies[''])
+        stats = service.speculative_stats.stats()
+        self.assertEqual(stats['generations'], 1)
+        self.assertGreater(stats['proposed_tokens'], 0)
+        self.assertLessEqual(stats['accepted_tokens'], stats['proposed_tokens'])
+        self.assertGreaterEqual(stats['tokens_per_pass'], 1.0)
+
+    def test_missing_hook_leaves_generation_alone(self):
+        model = object()
+        with self.assertLogs('chat.speculative', 'WARNING'):
+            self.assertFalse(track_speculation(model, SpeculativeStats()))
+
+
+class SharedWeightsTests(SimpleTestCase):
+
+    def test_mapped_model_matches_the_exported_one(self):
+        from .shared_weights import export_shared_weights, load_shared_model, shared_weights_exist
+
+        model, tokenizer = build_tiny_model()
+        input_ids = tokenizer('w1 w2 w3', return_tensors='pt').input_ids
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertFalse(shared_weights_exist(Path(directory)))
+            export_shared_weights(model, Path(directory))
+            self.assertTrue(shared_weights_exist(Path(directory)))
+
+            mapped = load_shared_model(Path(directory), torch.float32)
+            with torch.no_grad():
+                self.assertTrue(torch.equal(mapped(input_ids).logits, model(input_ids).logits))
+            self.assertFalse(any(parameter.is_meta for parameter in mapped.parameters()))
+
+
+class ConversationCacheTests(SimpleTestCase):
+    """
+    Conversation turns resume from cached KV state only while it matches
+    the persisted history, and then see the same tokens a rebuild would.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.service = build_tiny_service(do_sample=False, response_cache=None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.unload_model()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.service.conversation_cache = ConversationCache()
+
+    def turn(self, message, history=None):
+        with mock.patch.object(self.service, '_generate_ids', wraps=self.service._generate_ids) as generate:
+            reply = self.service.generate_response(
+                message, conversation_id=1, history=history, params={'max_new_tokens': 8}
+            )
+        return reply, generate.call_args
+
+    def test_follow_up_resumes_from_the_saved_reply(self):
+        first, _ = self.turn('w1 w2 w3')
+        history = [('w1 w2 w3', first)]
+        _, call = self.turn('w4 w5', history)
+
+        self.assertIsNotNone(call.kwargs['cache'])
+        self.assertEqual(call.args[0], self.service._conversation_prompt_ids('w4 w5', history))
+        self.assertEqual(self.service.conversation_cache.stats()['hits'], 1)
+
+    def test_turns_served_elsewhere_rebuild_from_history(self):
+        first, _ = self.turn('w1 w2 w3')
+        # Another worker answered the second turn
+        history = [('w1 w2 w3', first), ('w6', 'w7.')]
+        _, call = self.turn('w4 w5', history)
+
+        self.assertIsNone(call.kwargs['cache'])
+        self.assertEqual(call.args[0], self.service._conversation_prompt_ids('w4 w5', history))
+        self.assertEqual(self.service.conversation_cache.stats()['stale'], 1)
+
+    def test_cancelled_turn_is_not_cached(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.service.generate_response('w1 w2 w3', conversation_id=1, cancel_event=cancel_event)
+        self.assertEqual(self.service.conversation_cache.stats()['entries'], 0)
+
+
+class FakeInferenceService:
+    """
+    Stands in for AIModelService behind serve_connection.
+    """
+    load_state = 'ready'
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.cancelled = threading.Event()
+        self.ended = []
+
+    def generate_response(self, prompt, cancel_event=None, **kwargs):
+        if cancel_event.wait(self.delay):
+            self.cancelled.set()
+        return prompt.upper()
+
+    def stream_response(self, prompt, **kwargs):
+        yield from prompt.split()
+
+    def end_conversation(self, conversation_id):
+        self.ended.append(conversation_id)
+
+
+class InferenceServerTests(SimpleTestCase):
+    """
+    Frames of the ipc protocol, the replica's connection loop and the
+    client's pooling, retry and timeout handling.
+    """
+
+    def serve(self, service):
+        """
+        Accept connections on a temporary socket and answer them like a replica.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'inference.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(8)
+
+        def accept():
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                threading.Thread(target=serve_connection, args=(service, conn), daemon=True).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+        self.addCleanup(listener.close)
+        self.addCleanup(listener.shutdown, socket.SHUT_RDWR)
+        return path
+
+    def test_frames_round_trip(self):
+        left, right = socket.socketpair()
+        with left, right:
+            send_frame(left, REQUEST, {'op': 'ping'})
+            send_frame(left, TOKEN, 'héllo')
+            send_frame(left, END, b'')
+            self.assertEqual(decode_json(recv_frame(right)[1]), {'op': 'ping'})
+            self.assertEqual(recv_frame(right), (TOKEN, 'héllo'.encode()))
+            self.assertEqual(recv_frame(right), (END, b''))
+            left.close()
+            self.assertIsNone(recv_frame(right))
+
+    def test_truncated_and_oversized_frames(self):
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(HEADER.pack(TOKEN, 10) + b'abc')
+            left.close()
+            with self.assertRaises(ConnectionError):
+                recv_frame(right)
+
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(HEADER.pack(TOKEN, MAX_FRAME_BYTES + 1))
+            with self.assertRaises(InferenceServerError):
+                recv_frame(right)
+
+    def test_client_requests(self):
+        service = FakeInferenceService()
+        client = InferenceClient(self.serve(service), timeout=5)
+        self.addCleanup(client.close)
+
+        self.assertEqual(client.ping()['load_state'], 'ready')
+        self.assertEqual(client.generate(prompt='hi there'), 'HI THERE')
+        self.assertEqual(list(client.stream(prompt='hi there')), ['hi', 'there'])
+        client.end_conversation(7)
+        self.assertEqual(service.ended, [7])
+        # Every exchange went over the one pooled connection
+        self.assertEqual(client._idle.qsize(), 1)
+
+        with self.assertLogs('chat.inference_server', 'ERROR'), self.assertRaises(InferenceServerError):
+            client._call({'op': 'unknown'})
+
+    def test_stale_pooled_connection_is_retried(self):
+        client = InferenceClient(self.serve(FakeInferenceService()), timeout=5)
+        self.addCleanup(client.close)
+        stale, peer = socket.socketpair()
+        peer.close()
+        client._idle.put(stale)
+
+        self.assertEqual(client.generate(prompt='again'), 'AGAIN')
+
+    def test_timeout_drops_the_connection_and_cancels(self):
+        service = FakeInferenceService(delay=5)
+        client = InferenceClient(self.serve(service), timeout=0.3)
+        self.addCleanup(client.close)
+
+        with self.assertRaises(socket.timeout):
+            client.generate(prompt='slow')
+        self.assertEqual(client._idle.qsize(), 0)
+        self.assertTrue(service.cancelled.wait(5))
+
+
+class DatabaseConfigTests(SimpleTestCase):
+
+    def test_url_schemes(self):
+        config = parse_database_url('postgresql+psycopg://llm@db.internal:6432/chat', conn_max_age=60)
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((config['HOST'], config['PORT'], config['NAME'], config['USER']),
+                         ('db.internal', '6432', 'chat', 'llm'))
+        self.assertEqual(config['CONN_MAX_AGE'], 60)
+        self.assertEqual(parse_database_url('mysql://root@localhost/chat')['ENGINE'], 'django.db.backends.mysql')
+        self.assertEqual(parse_database_url('sqlite:///data/db.sqlite3')['NAME'], 'data/db.sqlite3')
+        self.assertEqual(parse_database_url('sqlite:////var/lib/db.sqlite3')['NAME'], '/var/lib/db.sqlite3')
+        self.assertEqual(parse_database_url('sqlite://')['NAME'], ':memory:')
+        with self.assertRaises(ValueError):
+            parse_database_url('oracle://user@host/name')
+
+    def test_credentials_and_options(self):
+        config = parse_database_url('postgres://us%40er:p%3As%2Fw%23rd%25@db:5432/llm%20chat'
+                                    '?sslmode=require&connect_timeout=10')
+        self.assertEqual((config['USER'], config['PASSWORD'], config['NAME']), ('us@er', 'p:s/w#rd%', 'llm chat'))
+        self.assertEqual(config['OPTIONS'], {'sslmode': 'require', 'connect_timeout': '10'})
+        self.assertNotIn('OPTIONS', parse_database_url('postgres://db/llm'))
+
+    def test_pragmas_applied_on_connection_created(self):
+        alias = 'pragma_test'
+        with tempfile.TemporaryDirectory() as directory:
+            config = dict(connections['default'].settings_dict)
+            config.update({
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': str(Path(directory) / 'pragmas.sqlite3'),
+                'PRAGMAS': DEFAULT_SQLITE_PRAGMAS,
+            })
+            connections.settings[alias] = config
+            try:
+                with connections[alias].cursor() as cursor:
+                    values = {}
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store'):
+                        cursor.execute(f"PRAGMA {name}")
+                        values[name] = cursor.fetchone()[0]
+            finally:
+                connections[alias].close()
+                del connections[alias]
+                del connections.settings[alias]
+        # synchronous NORMAL is 1 and temp_store MEMORY is 2
+        self.assertEqual(values, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2})
+
+
+class FakeCollection:
+    """
+    Stands in for the MongoDB chats collection, failing the first `failures` inserts.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.documents = []
+
+    def insert_many(self, documents, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('MongoDB is down')
+        self.documents.extend(documents)
+
+
+class PersistenceTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.writer = ChatWriter(max_retries=3, retry_backoff=0, dead_letter_dir=self.directory.name)
+
+    def record(self, message='hi'):
+        return ChatRecord(self.user.id, message, 'hello', conversation_id=self.conversation.id)
+
+    def test_retry_writes_each_store_once(self):
+        collection = FakeCollection(failures=1)
+        with mock.patch('chat.mongo.get_chats_collection', return_value=collection):
+            self.writer._write_batch([self.record()])
+        self.assertEqual(Chat.objects.count(), 1)
+        self.assertEqual(len(collection.documents), 1)
+        self.assertEqual(self.writer.stats()['written'], 1)
+        self.assertEqual(self.writer.stats()['retries'], 1)
+
+    def test_dead_letter_and_replay(self):
+        with mock.patch('chat.mongo.get_chats_collection', return_value=FakeCollection(failures=3)):
+            self.writer._write_batch([self.record()])
+        self.assertEqual(self.writer.stats()['dead_lettered'], 1)
+        [path] = Path(self.directory.name).iterdir()
+
+        collection = FakeCollection()
+        with mock.patch('chat.mongo.get_chats_collection', return_value=collection):
+            self.assertEqual(self.writer.replay_dead_letters(path), (1, 0))
+        self.assertFalse(path.exists())
+        # The database row landed before MongoDB failed and is not written twice
+        self.assertEqual(Chat.objects.count(), 1)
+        self.assertEqual(collection.documents[0]['django_id'], Chat.objects.get().pk)
+
+    def test_full_queue_writes_inline_once(self):
+        record = self.record()
+        with mock.patch('chat.mongo.get_chats_collection', return_value=FakeCollection(failures=3)), \
+                mock.patch.object(self.writer, '_ensure_started'), \
+                mock.patch.object(self.writer._queue, 'put_nowait', side_effect=queue.Full):
+            self.writer.submit(record)
+        stats = self.writer.stats()
+        self.assertEqual((stats['inline_writes'], stats['retries'], stats['dead_lettered']), (1, 0, 1))
+        self.assertEqual(self.writer.pending_turns(self.conversation.id), [])
+
+    def test_history_includes_pending_turns_once(self):
+        saved = self.record('saved')
+        with mock.patch('chat.mongo.get_chats_collection', return_value=FakeCollection()):
+            self.writer.write([saved])
+        queued = self.record('queued')
+        # A committed turn can still be tracked as pending while the worker finishes its batch
+        self.writer._track(saved)
+        self.writer._track(queued)
+        with mock.patch('chat.views.chat_writer', self.writer):
+            history = ChatView().get_history(self.conversation)
+        self.assertEqual(history, [('saved', 'hello'), ('queued', 'hello')])
+
+
+def make_pdf(texts):
+    """
+    A PDF with one page per text, each a single line in Helvetica.
+    """
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'), NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for text in texts:
+        page = writer.add_blank_page(612, 792)
+        content = DecodedStreamObject()
+        content.set_data(f'BT /F1 10 Tf 20 770 Td ({text}) Tj ET'.encode())
+        page[NameObject('/Contents')] = writer._add_object(content)
+        page[NameObject('/Resources')] = DictionaryObject({NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})})
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class AsyncChatTests(TestCase):
+    """
+    The chat endpoint admits generations through the bounded inference
+    executor and cancels those running past AI_INFERENCE_TIMEOUT.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('chatter', password='pw')
+        self.executor = InferenceExecutor(max_workers=1, max_queue=0)
+        self.addCleanup(self.executor.shutdown)
+
+    def chat(self, generate=lambda *args, **kwargs: 'Hello there.'):
+        token = RefreshToken.for_user(self.user).access_token
+        with mock.patch('chat.views.inference_executor', self.executor), \
+                mock.patch.object(ai_service, 'generate_response', side_effect=generate), \
+                mock.patch('chat.views.chat_writer') as writer:
+            response = self.client.post(
+                '/api/chat/', {'message': 'hi'}, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {token}'
+            )
+        return response, writer
+
+    def test_replies_and_saves_the_turn(self):
+        response, writer = self.chat()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['response'], 'Hello there.')
+        self.assertEqual(writer.submit.call_args.args[0].response, 'Hello there.')
+
+    def test_saturated_executor_answers_503(self):
+        release = threading.Event()
+        self.executor.submit(release.wait)
+        try:
+            response, writer = self.chat()
+        finally:
+            release.set()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        writer.submit.assert_not_called()
+
+    def test_timeout_answers_504_and_cancels(self):
+        cancelled = threading.Event()
+
+        def hang(*args, cancel_event=None, **kwargs):
+            if cancel_event.wait(5):
+                cancelled.set()
+            return 'Too late.'
+
+        with self.settings(AI_INFERENCE_TIMEOUT=0.2):
+            response, writer = self.chat(hang)
+        self.assertEqual(response.status_code, 504)
+        self.assertTrue(cancelled.wait(5))
+        writer.submit.assert_not_called()
+
+
+class ChatStreamTests(TestCase):
+    """
+    Streamed chats run on the bounded inference executor.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('streamer', password='pw')
+        self.factory = APIRequestFactory()
+
+    def stream(self, executor, generate=lambda *args, **kwargs: iter(('Hello', ' there'))):
+        request = self.factory.post('/api/chat/stream/', {'message': 'hi'}, format='json')
+        force_authenticate(request, user=self.user)
+        with mock.patch('chat.views.inference_executor', executor), \
+                mock.patch.object(ai_service, 'stream_response', side_effect=generate), \
+                mock.patch('chat.views.chat_writer'):
+            response = ChatStreamView.as_view()(request)
+            body = b''.join(response) if response.streaming else b''
+        return response, body.decode()
+
+    def test_streams_tokens_then_done(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        try:
+            response, body = self.stream(executor)
+        finally:
+            executor.shutdown()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('event: token\ndata: {"text": "Hello"}', body)
+        self.assertIn('event: done', body)
+        self.assertEqual(executor.stats()['completed'], 1)
+
+    def test_saturated_executor_answers_503(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        release = threading.Event()
+        executor.submit(release.wait)
+        try:
+            response, _ = self.stream(executor)
+        finally:
+            release.set()
+            executor.shutdown()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_timeout_cancels_generation(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        cancelled = threading.Event()
+
+        def hang(*args, cancel_event=None, **kwargs):
+            yield 'Hel'
+            cancel_event.wait(5)
+            cancelled.set()
+
+        try:
+            with self.settings(AI_INFERENCE_TIMEOUT=0.2):
+                _, body = self.stream(executor, hang)
+        finally:
+            executor.shutdown()
+        self.assertIn('event: error', body)
+        self.assertNotIn('event: done', body)
+        self.assertTrue(cancelled.is_set())
+
+
+class PDFIngestTests(SimpleTestCase):
+
+    def write_pdf(self, texts):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'upload.pdf'
+        path.write_bytes(make_pdf(texts))
+        return str(path)
+
+    def test_pages_in_order_with_real_page_count(self):
+        ingestor = PDFIngestor(workers=2, pages_per_task=2, max_pages=5)
+        try:
+            pages, count = ingestor.extract(self.write_pdf([f'page {n}' for n in range(7)]))
+            self.assertEqual([page.strip() for page in pages], [f'page {n}' for n in range(5)])
+            self.assertEqual(count, 7)
+            self.assertEqual(ingestor.extract(self.write_pdf(['only'] * 5))[1], 5)
+        finally:
+            ingestor.shutdown()
+
+    def test_timeout_replaces_pool(self):
+        ingestor = PDFIngestor(workers=1, timeout=0.001)
+        pool = ingestor._get_pool()
+        try:
+            with self.assertRaises(PDFExtractionError):
+                ingestor.extract(self.write_pdf(['slow']))
+            self.assertIsNot(ingestor._get_pool(), pool)
+        finally:
+            ingestor.shutdown()
+
+    def test_disk_cache_is_bounded_by_size_and_age(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache_dir = Path(directory.name)
+        ingestor = PDFIngestor(cache_dir=directory.name, cache_max_bytes=450, cache_max_age=3600)
+        now = time.time()
+        for age, digest in ((4000, 'stale'), (30, 'old'), (20, 'used'), (10, 'new')):
+            ingestor._store(digest, (['x' * 100], 1))
+            os.utime(cache_dir / f'{digest}.json', (now - age, now - age))
+        # A disk hit counts as a use
+        ingestor._cache.clear()
+        self.assertIsNotNone(ingestor._cached('used'))
+
+        ingestor._store('newest', (['x' * 100], 1))
+        self.assertEqual(sorted(path.stem for path in cache_dir.glob('*.json')), ['new', 'newest', 'used'])
+
+
+class UploadTests(SimpleTestCase):
+
+    def test_read_text_caps_bytes_without_splitting_characters(self):
+        upload = SimpleUploadedFile('notes.txt', 'aé€b'.encode())
+        self.assertEqual(uploads.read_text(upload, 100, chunk_size=2), ('aé€b', False))
+        # The cap falls inside the three bytes of €
+        self.assertEqual(uploads.read_text(upload, 4, chunk_size=2), ('aé', True))
+        invalid = SimpleUploadedFile('bad.txt', b'ok\xff')
+        self.assertEqual(uploads.read_text(invalid, 100), ('ok\ufffd', False))
+
+    def test_fit_to_budget_keeps_head_and_tail(self):
+        text = ''.join(f'{n:04d}' for n in range(100))
+        self.assertEqual(uploads.fit_to_budget(text, 100), (text, False))
+        self.assertEqual(uploads.fit_to_budget(text, 0), ('', True))
+
+        fitted, cut = uploads.fit_to_budget(text, 40)
+        self.assertTrue(cut)
+        self.assertLessEqual(uploads.count_tokens(fitted), 40)
+        self.assertTrue(fitted.startswith('0000'))
+        self.assertTrue(fitted.endswith('0099'))
+        self.assertIn('characters omitted', fitted)
+
+    def test_allocate_budget_gives_small_texts_their_size(self):
+        self.assertEqual(uploads.allocate_budget([10, 500, 300], 400), [10, 195, 195])
+        self.assertEqual(uploads.allocate_budget([10, 20], 100), [10, 20])
+        self.assertEqual(uploads.allocate_budget([10, 20], -5), [0, 0])
+
+    def test_message_over_budget_leaves_only_headings(self):
+        files = [{'name': 'notes.txt', 'type': 'text/plain', 'size': 5,
+                  'file': SimpleUploadedFile('notes.txt', b'hello')}]
+        self.assertEqual(uploads.attachment_contents(files, token_budget=-10, max_bytes=100),
+                         ['Content of notes.txt' + uploads.SHORTENED])
+
+    def test_pdf_uploads_are_read_from_a_file(self):
+        data = make_pdf(['first', 'second'])
+        in_memory = SimpleUploadedFile('doc.pdf', data, content_type='application/pdf')
+        spooled = TemporaryUploadedFile('doc.pdf', 'application/pdf', len(data), None)
+        spooled.write(data)
+        spooled.seek(0)
+        self.addCleanup(spooled.close)
+
+        with mock.patch.object(PDFIngestor, 'extract', return_value=(['first', 'second'], 2)) as extract:
+            for upload in (in_memory, spooled):
+                self.assertEqual(uploads.pdf_text(upload, 100), ('[Page 1]\nfirst\n[Page 2]\nsecond', False))
+        self.assertEqual(extract.call_args_list[1].args[0], spooled.temporary_file_path())
+        # The in-memory upload was copied to a file that is gone again
+        self.assertFalse(os.path.exists(extract.call_args_list[0].args[0]))
+
+
+class RetrievalTests(SimpleTestCase):
+
+    def test_chunks_overlap_and_keep_layout(self):
+        text = ' '.join(f'w{n}' for n in range(10)).replace('w5 ', 'w5\n\n')
+        chunks = chunk_text(text, chunk_words=4, overlap_words=1)
+        self.assertEqual(chunks, ['w0 w1 w2 w3', 'w3 w4 w5\n\nw6', 'w6 w7 w8 w9'])
+        self.assertEqual(chunk_text('   '), [])
+
+    def test_index_ranks_by_cosine_and_forgets_oldest(self):
+        index = VectorIndex(dim=2, max_chunks=2)
+        index.add([Chunk('a', 'x'), Chunk('a', 'y')], np.array([[1, 0], [0, 1]]))
+        hits = index.search(np.array([0.6, 0.8], dtype=np.float32), k=5)
+        self.assertEqual([chunk.text for chunk, _ in hits], ['y', 'x'])
+
+        index.add([Chunk('b', 'z')], np.array([[1, 0]]))
+        self.assertEqual([chunk.text for chunk in index.chunks], ['y', 'z'])
+        self.assertEqual(index.search(np.array([1, 0], dtype=np.float32), k=0), [])
+
+    def test_retriever_searches_each_conversation_separately(self):
+        retriever = Retriever(embedding_model='', chunk_words=12, overlap_words=0, top_k=2, max_indexes=2)
+        self.assertIsInstance(retriever.embedder, HashingEmbedder)
+        retriever.add_documents('one', [
+            ('pets.txt', 'cats purr and chase mice around the old barn'),
+            ('space.txt', 'rockets burn fuel to reach orbit around the earth'),
+        ])
+        retriever.add_documents('two', [('food.txt', 'bread needs flour water salt and yeast')])
+
+        hits = retriever.search('one', 'how do rockets reach orbit')
+        self.assertEqual([chunk.source for chunk, _ in hits], ['space.txt'])
+        self.assertEqual(retriever.search('two', 'how do rockets reach orbit'), [])
+        # Without words to match, files are read from the start
+        self.assertEqual([chunk.source for chunk, _ in retriever.search('one', ' ')], ['pets.txt', 'space.txt'])
+
+        # 'two' is now the least recently used index
+        retriever.add_documents('three', [('x.txt', 'anything')])
+        self.assertEqual(retriever.search('two', 'bread flour'), [])
+        self.assertEqual(len(retriever.search('one', 'rockets')), 1)
+        retriever.drop('one')
+        self.assertEqual(retriever.stats()['indexes'], 1)
+
+    def test_rank_scores_unindexed_documents(self):
+        retriever = Retriever(embedding_model='', chunk_words=8, overlap_words=0)
+        hits = retriever.rank([('a.txt', 'bread needs flour'), ('b.txt', 'orbit needs fuel')], 'flour for bread')
+        self.assertEqual(hits[0][0].source, 'a.txt')
+        self.assertEqual(retriever.stats()['indexes'], 0)
+
+
+class HistoryPaginationTests(TestCase):
+    """
+    Keyset pages of the chat history, newest first.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pw')
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        base = timezone.now() - timedelta(hours=1)
+        # Three turns share each timestamp, so pages must break ties on id
+        self.chats = []
+        for n in range(9):
+            chat = Chat.objects.create(
+                user=self.user, conversation=self.conversation if n % 2 else None,
+                message=f'message {n}', response=f'response {n}'
+            )
+            Chat.objects.filter(pk=chat.pk).update(timestamp=base + timedelta(seconds=n // 3))
+            self.chats.append(chat.pk)
+
+    def pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        return ids
+
+    def test_cursor_round_trip_visits_every_turn_once(self):
+        pages = self.pages('/api/history/?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), self.chats[::-1])
+
+    def test_turns_written_meanwhile_do_not_shift_pages(self):
+        first = self.client.get('/api/history/?page_size=4').data
+        Chat.objects.create(user=self.user, message='new', response='new')
+        second = self.client.get(first['next']).data
+        self.assertEqual([row['id'] for row in second['results']], self.chats[4::-1][:4])
+
+    def test_conversation_filter(self):
+        ids = sum(self.pages(f'/api/history/?conversation={self.conversation.id}'), [])
+        self.assertEqual(ids, self.chats[1::2][::-1])
+        self.assertEqual(self.client.get('/api/history/?conversation=abc').status_code, 400)
+
+    def test_page_size_is_clamped(self):
+        with mock.patch.object(KeysetPagination, 'max_page_size', 3):
+            self.assertEqual(len(self.client.get('/api/history/?page_size=50').data['results']), 3)
+        self.assertEqual(len(self.client.get('/api/history/?page_size=0').data['results']), 1)
+        self.assertEqual(len(self.client.get('/api/history/?page_size=x').data['results']), 9)
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('garbage!', base64.urlsafe_b64encode(b'yesterday|1').decode(), 'bm9waXBl'):
+            self.assertEqual(self.client.get(f'/api/history/?cursor={cursor}').status_code, 404)
+
+    def test_other_users_turns_are_hidden(self):
+        other = User.objects.create_user('other', password='pw')
+        Chat.objects.create(user=other, message='secret', response='secret')
+        self.assertEqual(sum(self.pages('/api/history/'), []), self.chats[::-1])
+
+
+class SearchTests(TestCase):
+    """
+    Full-text search over the chat history, through FTS5 and the LIKE fallback.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('searcher', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tagged = Chat.objects.create(
+            user=self.user, conversation=self.conversation,
+            message='How do I render <b>bold</b> text and not italics?', response='Use the <b> tag for a bold response.'
+        )
+        self.plain = Chat.objects.create(
+            user=self.user, message='Tell me about bolder fonts', response='Heavier weights look bolder.'
+        )
+        self.hidden = Chat.objects.create(user=self.other, message='bold secret', response='bold secret')
+
+    def ids(self, results):
+        return sorted(row['id'] for row in results)
+
+    def test_match_expression_quotes_every_word(self):
+        self.assertEqual(search.match_expression('bold text'), '"bold" "text"')
+        self.assertEqual(search.match_expression('bol* "NEAR(a b)" OR -x'), '"bol"* "NEAR" "a" "b" "OR" "x"')
+        self.assertEqual(search.match_expression('col:name ^start'), '"col" "name" "start"')
+        self.assertEqual(search.match_expression('"* ( ) :'), '')
+
+    def test_fts_syntax_in_input_is_searched_literally(self):
+        self.assertTrue(search.search_available())
+        # Unquoted, these would be FTS5 syntax errors, operators or column filters
+        for text in ('bold"', '(bold', 'text AND', 'bold NOT text', 'response: bold'):
+            with self.subTest(text=text):
+                self.assertEqual(self.ids(search.search_chats(self.user.id, text)), [self.tagged.id])
+        self.assertEqual(search.search_chats(self.user.id, 'bold OR fonts'), [])
+
+    def test_prefix_search(self):
+        self.assertEqual(self.ids(search.search_chats(self.user.id, 'bold')), [self.tagged.id])
+        self.assertEqual(self.ids(search.search_chats(self.user.id, 'bold*')), [self.tagged.id, self.plain.id])
+
+    def test_snippets_escape_html_and_mark_matches(self):
+        result, = search.search_chats(self.user.id, 'render')
+        self.assertIn('<mark>render</mark>', result['message_snippet'])
+        self.assertIn('&lt;b&gt;bold&lt;/b&gt;', result['message_snippet'])
+        self.assertNotIn('<b>', result['message_snippet'] + result['response_snippet'])
+        self.assertEqual(search.highlight('<i>' + search.MARK_START + 'x' + search.MARK_END),
+                         '&lt;i&gt;<mark>x</mark>')
+
+    def test_results_are_scoped_to_the_user(self):
+        self.assertNotIn(self.hidden.id, self.ids(search.search_chats(self.user.id, 'bold')))
+        self.assertEqual(self.ids(search.search_chats(self.other.id, 'bold')), [self.hidden.id])
+        self.assertEqual(self.ids(search.search_chats(self.user.id, 'secret')), [])
+
+    def test_conversation_filter(self):
+        results = search.search_chats(self.user.id, 'bold*', conversation_id=self.conversation.id)
+        self.assertEqual(self.ids(results), [self.tagged.id])
+
+    def test_like_fallback(self):
+        with mock.patch('chat.search.search_available', return_value=False):
+            results = search.search_chats(self.user.id, 'BOLD text')
+            self.assertEqual(self.ids(results), [self.tagged.id])
+            self.assertIsNone(results[0]['rank'])
+            self.assertIn('&lt;b&gt;bold&lt;/b&gt;', results[0]['message_snippet'])
+            # Substring matching also finds the longer word, for this user only
+            self.assertEqual(self.ids(search.search_chats(self.user.id, 'bold')), [self.tagged.id, self.plain.id])
+            self.assertEqual(search.search_chats(self.user.id, 'secret'), [])
+            self.assertEqual(search.search_chats(self.user.id, '"*'), [])
+
+    def test_view_pages_and_validates(self):
+        response = self.client.get('/api/search/?q=bold*&limit=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+        rest = self.client.get(response.data['next']).data
+        self.assertIsNone(rest['next'])
+        seen = {response.data['results'][0]['id'], rest['results'][0]['id']}
+        self.assertEqual(seen, {self.tagged.id, self.plain.id})
+        self.assertEqual(self.client.get('/api/search/?q=%22*').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?q=bold&limit=x').status_code, 400)
+
+
+class GenerationParamsTests(SimpleTestCase):
+    caps = {'max_new_tokens': 64, 'max_stop_sequences': 2}
+
+    def validate(self, **data):
+        serializer = GenerationParamsSerializer(data=data, context={'caps': self.caps})
+        return serializer.validated_data if serializer.is_valid() else serializer.errors
+
+    def test_caps_and_greedy_temperature(self):
+        self.assertIn('max_new_tokens', self.validate(max_new_tokens=65))
+        self.assertIn('stop', self.validate(stop=['a', 'b', 'c']))
+        self.assertEqual(self.validate(max_new_tokens=64, temperature=0), {'max_new_tokens': 64, 'do_sample': False})
+
+    def test_stop_sequence_ends_decoding(self):
+        service = build_tiny_service(do_sample=False, response_cache=None)
+        try:
+            prompt_ids = service.tokenizer(service._enhance_prompt("w1 w2 w3")).input_ids
+            full = service._generate_ids(prompt_ids, params={'max_new_tokens': 12})
+            stop = service.tokenizer.decode(full[3:4])
+            stopped = service._generate_ids(prompt_ids, params={'max_new_tokens': 12, 'stop': [stop]})
+            text = service.tokenizer.decode(stopped)
+        finally:
+            service.unload_model()
+        self.assertLess(len(stopped), len(full))
+        self.assertEqual(stopped, full[:len(stopped)])
+        self.assertTrue(text.endswith(stop))
+
+    def test_early_stop_saves_steps_without_changing_responses(self):
+        # A small vocabulary makes sampled replies contain sentence ends
+        service = build_tiny_service(vocab_words=20, response_cache=None)
+        try:
+            report = early_stop_savings(service, EARLY_STOP_PROMPTS, max_new_tokens=64)
+        finally:
+            service.unload_model()
+        self.assertEqual(report['same_responses'], report['prompts'])
+        self.assertGreater(report['decode_steps_saved'], 0)
+
+    def test_reply_is_cut_at_the_next_user_turn(self):
+        service = AIModelService()
+        prompt = "Which city is the capital of France?"
+        reply = "Paris has been the capital for centuries. User: And of Italy? Assistant: Rome."
+        self.assertEqual(service._post_process_response(reply, prompt), "Paris has been the capital for centuries.")
+        self.assertEqual(service._post_process_response("Paris, mostly User: thanks", prompt), "Paris, mostly.")
+        self.assertEqual(service._post_process_response("User: Which one?", prompt), "")
+
+
+class ImportTimeTests(SimpleTestCase):
+    """
+    Loading the URLconf (and so every view) must not pull in the ML stack;
+    torch and transformers are imported on the first inference.
+    """
+    # Cumulative microseconds for `import chat.urls`; the eager imports cost seconds
+    BUDGET_US = 1_500_000
+    HEAVY_MODULES = ('torch', 'transformers')
+
+    def test_urls_import_without_ml_stack(self):
+        code = "import django; django.setup(); import chat.urls"
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'llm_project.settings'),
+                   AI_MODEL_WARMUP='False')
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=Path(settings.BASE_DIR), env=env, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        # Lines look like "import time:      self [us] |  cumulative | imported package"
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or '[us]' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = int(cumulative)
+
+        loaded = sorted(name for name in modules if name.split('.')[0] in self.HEAVY_MODULES)
+        self.assertEqual(loaded, [], f"chat.urls imports {', '.join(loaded[:5])}")
+        self.assertLess(modules['chat.urls'], self.BUDGET_US)
+
+    def test_scripts_do_not_start_background_work(self):
+        code = "import django, threading; django.setup(); print(','.join(t.name for t in threading.enumerate()))"
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'llm_project.settings'),
+                   AI_MODEL_WARMUP='True')
+        env.pop('SERVES_REQUESTS', None)
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=Path(settings.BASE_DIR), env=env, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        self.assertEqual(result.stdout.strip(), 'MainThread')
+
+
+class MetricsTests(SimpleTestCase):
+
+    def test_histogram_exposition(self):
+        histogram = Histogram('test_seconds', 'Test durations.', ['stage'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, stage='decode')
+        self.assertEqual(histogram.render(), [
+            '# HELP test_seconds Test durations.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{stage="decode",le="0.1"} 1',
+            'test_seconds_bucket{stage="decode",le="1"} 2',
+            'test_seconds_bucket{stage="decode",le="+Inf"} 3',
+            'test_seconds_sum{stage="decode"} 5.55',
+            'test_seconds_count{stage="decode"} 3',
+        ])
+
+    def test_server_timing_sums_repeated_stages(self):
+        with request_timings() as timings:
+            record_stage('tokenize', 0.001)
+            record_stage('decode', 0.25)
+            record_stage('tokenize', 0.002)
+        record_stage('tokenize', 1.0)
+        self.assertTrue(timings.server_timing().startswith('tokenize;dur=3.0, decode;dur=250.0, total;dur='))
+
+    def test_warm_up_records_the_model_load_time(self):
+        service = AIModelService()
+        service.inference_client = mock.Mock()
+
+        def load():
+            time.sleep(0.01)
+            return True
+
+        with mock.patch.object(MODEL_LOAD_SECONDS, 'set') as record, \
+                mock.patch.object(service, '_load_model', side_effect=load):
+            self.assertTrue(service.warm_up())
+        self.assertGreaterEqual(record.call_args.args[0], 0.01)
+
+    def test_scrape_with_continuous_batching(self):
+        service = build_tiny_service(continuous_batching=True, response_cache=None)
+        try:
+            with mock.patch('chat.ai_service.ai_service', service):
+                response = self.client.get('/metrics')
+        finally:
+            service.unload_model()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('chat_batching_queue_depth 0', response.content.decode())
+        self.assertIn('chat_model_loaded 1', response.content.decode())
+
+
+class ProfilingTests(SimpleTestCase):
+
+    def test_window_captures_requested_number_of_calls(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = InferenceProfiler(Path(directory), modes=('cprofile', 'stacks'), stack_interval=0.001)
+            with profiler.capture({'function': 'test'}):
+                pass
+            self.assertEqual(list(Path(directory).iterdir()), [])
+
+            profiler.enable(seconds=60, requests=1)
+            for _ in range(2):
+                with profiler.capture({'function': 'test'}):
+                    sum(range(10000))
+            captures = list(Path(directory).iterdir())
+            self.assertEqual(len(captures), 1)
+            self.assertEqual({path.name for path in captures[0].iterdir()},
+                             {'meta.json', 'cprofile.prof', 'stacks.folded'})
+            self.assertFalse(profiler.status()['enabled'])
@@ -0,0 +1,193 @@
+import codecs
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple, Dict, Any
+
+from .pdf_ingest import PDFExtractionError, pdf_ingestor
+
+logger = logging.getLogger(__name__)
+
+TEXT_TYPES = ('text/plain', 'application/json', 'text/markdown')
+
+# Rough ratio used when no tokenizer is loaded in this process
+CHARS_PER_TOKEN = 4
+SHORTENED = " (shortened to fit the model context):\n"
+
+
+def read_text(uploaded_file, max_bytes: int, chunk_size: int = 64 * 1024) -> Tuple[str, bool]:
+    """
+    Decode at most max_bytes of an uploaded file as UTF-8, chunk by chunk.
+
+    Uploads above FILE_UPLOAD_MAX_MEMORY_SIZE are already spooled to a
+    temporary file by Django, so only the bytes kept here are ever held in
+    memory. A multi-byte character cut by the byte cap is dropped, and
+    invalid sequences are replaced rather than failing the request.
+
+    Returns:
+        (decoded text, whether the file was cut short)
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    parts = []
+    remaining = max_bytes
+    truncated = False
+    for chunk in uploaded_file.chunks(chunk_size):
+        if len(chunk) > remaining:
+            chunk = chunk[:remaining]
+            truncated = True
+        parts.append(decoder.decode(chunk))
+        remaining -= len(chunk)
+        if truncated:
+            break
+    if not truncated:
+        parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts), truncated
+
+
+def count_tokens(text: str, tokenizer=None) -> int:
+    if tokenizer is None or not getattr(tokenizer, 'is_fast', False):
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(tokenizer(text, add_special_tokens=False).input_ids)
+
+
+def fit_to_budget(text: str, max_tokens: int, tokenizer=None) -> Tuple[str, bool]:
+    """
+    Shorten text to about max_tokens by keeping its beginning and end and
+    eliding the middle, which usually keeps headings and conclusions.
+
+    Returns:
+        (text that fits, whether anything was removed)
+    """
+    if max_tokens <= 0:
+        return '', bool(text)
+
+    if tokenizer is not None and getattr(tokenizer, 'is_fast', False):
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+    else:
+        # Without token offsets, cut at the character estimate
+        offsets = [(i, min(i + CHARS_PER_TOKEN, len(text))) for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+    if len(offsets) <= max_tokens:
+        return text, False
+
+    # Reserve room for the marker, sized for the longest possible omission
+    reserved = count_tokens(f"\n[... {len(text)} characters omitted ...]\n", tokenizer)
+    if max_tokens <= 2 * reserved:
+        return text[:offsets[max_tokens - 1][1]], True
+
+    head = (max_tokens - reserved) * 2 // 3
+    tail = max_tokens - reserved - head
+    head_end = offsets[head - 1][1]
+    tail_start = offsets[len(offsets) - tail][0]
+    marker = f"\n[... {tail_start - head_end} characters omitted ...]\n"
+    return text[:head_end] + marker + text[tail_start:], True
+
+
+def allocate_budget(sizes: List[int], budget: int) -> List[int]:
+    """
+    Split a token budget between texts of the given sizes: texts smaller
+    than an even share keep their full size and leave the rest to the others.
+    """
+    allocation = [0] * len(sizes)
+    remaining = budget
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while pending:
+        share = max(0, remaining) // len(pending)
+        index = pending.pop(0)
+        allocation[index] = min(sizes[index], share)
+        remaining -= allocation[index]
+    return allocation
+
+
+@contextmanager
+def upload_path(uploaded_file, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """
+    Path of a file holding the upload: the temporary file Django spooled a
+    large upload to, or else a new one the upload's chunks are copied into,
+    so PDFs never have to be held in memory whole.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        yield uploaded_file.temporary_file_path()
+        return
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as spooled:
+        for chunk in uploaded_file.chunks(chunk_size):
+            spooled.write(chunk)
+        spooled.flush()
+        yield spooled.name
+
+
+def pdf_text(uploaded_file, page_token_budget: int, tokenizer=None) -> Tuple[str, bool]:
+    """
+    Extracted text of a PDF upload with every page shortened to at most
+    page_token_budget tokens, so one dense page cannot crowd out the rest.
+
+    Returns:
+        (text with a marker before each page, whether anything was removed)
+    """
+    with upload_path(uploaded_file) as path:
+        pages, page_count = pdf_ingestor.extract(path)
+    parts = []
+    shortened = len(pages) < page_count
+    for number, page in enumerate(pages, start=1):
+        page, cut = fit_to_budget(page.strip(), page_token_budget, tokenizer)
+        shortened = shortened or cut
+        if page:
+            parts.append(f"[Page {number}]\n{page}")
+    return '\n'.join(parts), shortened
+
+
+def attachment_texts(uploaded_files: List[Dict[str, Any]], max_bytes: int, tokenizer=None,
+                     page_token_budget: int = 512) -> Tuple[List[Optional[str]], Dict[int, Tuple[str, bool]]]:
+    """
+    Read every upload: text files as streams capped at max_bytes each, PDFs
+    page by page. Other files, and files that cannot be read, get a short
+    description instead.
+
+    Returns:
+        (description per upload or None where text was read,
+         {upload index: (text, whether it was cut short)})
+    """
+    sections: List[Optional[str]] = [None] * len(uploaded_files)
+    texts = {}
+    for index, uploaded_file in enumerate(uploaded_files):
+        try:
+            if uploaded_file['type'] in TEXT_TYPES:
+                texts[index] = read_text(uploaded_file['file'], max_bytes)
+            elif uploaded_file['type'] == 'application/pdf':
+                try:
+                    texts[index] = pdf_text(uploaded_file['file'], page_token_budget, tokenizer)
+                except PDFExtractionError as e:
+                    logger.warning(f"Could not extract text from {uploaded_file['name']}: {e}")
+                    sections[index] = (f"PDF file uploaded: {uploaded_file['name']} "
+                                       f"({uploaded_file['size']} bytes, text could not be extracted)")
+            else:
+                sections[index] = (f"File uploaded: {uploaded_file['name']} "
+                                   f"({uploaded_file['type']}, {uploaded_file['size']} bytes)")
+        except Exception as e:
+            sections[index] = f"Error reading {uploaded_file['name']}: {str(e)}"
+    return sections, texts
+
+
+def attachment_contents(uploaded_files: List[Dict[str, Any]], token_budget: int,
+                        max_bytes: int, tokenizer=None, page_token_budget: int = 512) -> List[str]:
+    """
+    Prompt sections describing each upload, with the texts of all uploads
+    shortened together to fit token_budget.
+    """
+    sections, texts = attachment_texts(uploaded_files, max_bytes, tokenizer, page_token_budget)
+
+    if texts:
+        indices = list(texts)
+        # Leave room for each "Content of ..." heading, in its longer form
+        headings = {i: f"Content of {uploaded_files[i]['name']}:\n" for i in indices}
+        available = token_budget - sum(count_tokens(headings[i].replace(":\n", SHORTENED), tokenizer) for i in indices)
+        sizes = [count_tokens(texts[i][0], tokenizer) for i in indices]
+        for index, allowance in zip(indices, allocate_budget(sizes, available)):
+            text, cut_by_bytes = texts[index]
+            text, cut_by_tokens = fit_to_budget(text, allowance, tokenizer)
+            heading = headings[index]
+            if cut_by_bytes or cut_by_tokens:
+                heading = heading.replace(":\n", SHORTENED)
+            sections[index] = heading + text
+
+    return [section for section in sections if section is not None]
@@ -7,5 +7,13 @@ urlpatterns = [
     path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('profile/', views.ProfileView.as_view(), name='profile'),
-    path('chat/', views.ChatView.as_view(), name='chat'),
+    path('chat/', views.AsyncChatView.as_view(), name='chat'),
+    path('chat/stream/', views.ChatStreamView.as_view(), name='chat_stream'),
+    path('history/', views.ChatHistoryView.as_view(), name='chat_history'),
+    path('history/<int:pk>/', views.ChatHistoryDetailView.as_view(), name='chat_history_detail'),
+    path('search/', views.ChatSearchView.as_view(), name='chat_search'),
+    path('conversations/', views.ConversationListView.as_view(), name='conversation_list'),
+    path('conversations/<int:pk>/', views.ConversationDetailView.as_view(), name='conversation_detail'),
+    path('health/ready/', views.ReadinessView.as_view(), name='readiness'),
+    path('profiling/', views.ProfilingView.as_view(), name='profiling'),
 ]
\ No newline at end of file
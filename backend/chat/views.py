@@ -1,14 +1,44 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from django.db.models.functions import Substr
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
 from rest_framework import generics, status
+from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.exceptions import APIException, NotAuthenticated, ValidationError
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
-from .serializers import UserSerializer, RegisterSerializer, UserProfileSerializer
-from .models import UserProfile, Chat
+from .serializers import (
+    UserSerializer, RegisterSerializer, UserProfileSerializer, ChatSerializer,
+    ChatHistorySerializer, ConversationSerializer, ConversationDetailSerializer, ProfilingWindowSerializer,
+    GenerationParamsSerializer
+)
+from .models import UserProfile, Conversation, Chat
 from .ai_service import ai_service
-from pymongo import MongoClient
-import os
+from . import metrics, mongo, search, uploads
+from .pagination import KeysetPagination
+from .persistence import ChatRecord, chat_writer
+from .profiling import inference_profiler
+from .retrieval import retriever
+from .executor import ExecutorSaturated, inference_executor
+from .generation import generation_caps
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
@@ -35,23 +65,225 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user.userprofile
 
+class ReadinessView(generics.GenericAPIView):
+    """
+    Reports whether this worker has a warm model, for load balancer health checks.
+    MongoDB reachability is reported alongside but does not take the worker out
+    of rotation, since every worker shares the same database.
+    """
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def get(self, request):
+        ready = ai_service.is_ready
+        return Response(
+            {'status': ai_service.load_state, 'mongodb': 'ok' if mongo.ping() else 'unavailable'},
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+class MetricsView(View):
+    """
+    Prometheus metrics of this worker process in the text exposition format.
+    Turned off with METRICS_ENABLED=False; keep it off the public internet.
+    """
+
+    def get(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise Http404
+        return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+class ProfilingView(generics.GenericAPIView):
+    """
+    Staff-only switch for profiling generations in this worker: GET reports
+    the state, POST opens a window (`seconds`, `requests`, `sample_rate`)
+    and DELETE closes it. Each worker process profiles independently.
+    """
+    permission_classes = (IsAdminUser,)
+    serializer_class = ProfilingWindowSerializer
+
+    def get(self, request):
+        return Response(inference_profiler.status())
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        inference_profiler.enable(**serializer.validated_data)
+        return Response(inference_profiler.status())
+
+    def delete(self, request):
+        inference_profiler.disable()
+        return Response(inference_profiler.status())
+
+class ConversationListView(generics.ListCreateAPIView):
+    serializer_class = ConversationSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Conversation.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+class ConversationDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = ConversationDetailSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Conversation.objects.filter(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        # Write queued turns first so they are deleted with the conversation
+        chat_writer.flush(timeout=10)
+        ai_service.end_conversation(instance.id)
+        retriever.drop((instance.user_id, instance.id))
+        instance.delete()
+
+class ChatHistoryView(generics.ListAPIView):
+    """
+    The user's chat turns, newest first, optionally limited to one
+    conversation with `?conversation=<id>`. Pages are keyset-paginated and
+    carry previews; fetch a turn from the detail endpoint for its full text.
+    """
+    serializer_class = ChatHistorySerializer
+    pagination_class = KeysetPagination
+    preview_chars = 200
+
+    def get_queryset(self):
+        queryset = Chat.objects.filter(user=self.request.user)
+        conversation_id = self.request.query_params.get('conversation')
+        if conversation_id:
+            try:
+                queryset = queryset.filter(conversation_id=int(conversation_id))
+            except ValueError:
+                raise ValidationError({'conversation': 'A valid integer is required.'})
+        # Leave the message and response blobs in the table; only their starts are sent
+        return queryset.only('id', 'conversation_id', 'timestamp').annotate(
+            message_preview=Substr('message', 1, self.preview_chars),
+            response_preview=Substr('response', 1, self.preview_chars)
+        )
+
+class ChatHistoryDetailView(generics.RetrieveAPIView):
+    serializer_class = ChatSerializer
+
+    def get_queryset(self):
+        return Chat.objects.filter(user=self.request.user)
+
+class ChatSearchView(generics.GenericAPIView):
+    """
+    Full-text search over the user's chat history: `?q=` words (all must
+    match, `word*` for prefixes), optionally `&conversation=<id>`, paged
+    with `limit` and `offset`. Results are ranked best first and carry
+    HTML-escaped snippets with the matches wrapped in <mark>.
+    """
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request):
+        text = request.query_params.get('q', '')
+        if not search.match_expression(text):
+            raise ValidationError({'q': 'Enter at least one word to search for.'})
+        try:
+            limit = min(max(1, int(request.query_params.get('limit', self.default_limit))), self.max_limit)
+            offset = max(0, int(request.query_params.get('offset', 0)))
+            conversation_id = request.query_params.get('conversation')
+            conversation_id = int(conversation_id) if conversation_id else None
+        except ValueError:
+            raise ValidationError({'detail': 'limit, offset and conversation must be integers.'})
+
+        # One extra row tells whether another page follows
+        results = search.search_chats(request.user.id, text, conversation_id, limit + 1, offset)
+        next_url = None
+        if len(results) > limit:
+            next_url = replace_query_param(request.build_absolute_uri(), 'offset', offset + limit)
+        return Response({'next': next_url, 'results': results[:limit]})
+
 class ChatView(generics.GenericAPIView):
     permission_classes = (IsAuthenticated,)
 
-    def get_mongo_client(self):
-        # Connect to MongoDB Atlas using environment variables
-        mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
-        db_name = os.getenv('DATABASE_NAME', 'llm_chat_db')
-        client = MongoClient(mongo_uri)
-        return client[db_name]
+    # Most recent turns loaded to rebuild a conversation that is not cached
+    history_turns = 50
 
     def post(self, request):
+        conversation = self.get_conversation(request)
+        params = self.get_generation_params(request)
+        full_message, uploaded_files = self.build_message(request, conversation, params)
+
+        # Generate AI response using the trained model
+        response = ai_service.generate_response(
+            full_message,
+            conversation_id=conversation.id if conversation else None,
+            history=self.get_history(conversation),
+            params=params
+        )
+
+        # Parse response for artifacts (code blocks, etc.)
+        artifacts = ai_service.parse_artifacts(response)
+
+        attachments = self.save_chat(request, full_message, response, artifacts, uploaded_files, conversation)
+
+        return Response({
+            'response': response,
+            'artifacts': artifacts,
+            'attachments': attachments,
+            'conversation_id': conversation.id if conversation else None
+        })
+
+    def get_conversation(self, request):
+        """
+        The user's conversation named by `conversation_id`, or None for a standalone message.
+        """
+        conversation_id = request.data.get('conversation_id')
+        if not conversation_id:
+            return None
+        try:
+            conversation_id = int(conversation_id)
+        except (TypeError, ValueError):
+            raise ValidationError({'conversation_id': 'A valid integer is required.'})
+        return get_object_or_404(Conversation, pk=conversation_id, user=request.user)
+
+    def get_generation_params(self, request):
+        """
+        The request's generation options (max_new_tokens, temperature, top_p,
+        do_sample, stop), validated against the limits of the user's tier.
+        """
+        serializer = GenerationParamsSerializer(
+            data=request.data, context={'caps': generation_caps(request.user)}
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def get_history(self, conversation):
+        """
+        Earlier (message, response) turns of the conversation, oldest first.
+        """
+        if conversation is None:
+            return None
+        # Read queued turns first: one committed in between then shows up in both and is deduplicated
+        pending = chat_writer.pending_turns(conversation.id)
+        rows = conversation.chats.order_by('-timestamp').values_list('id', 'message', 'response')[:self.history_turns]
+        saved_ids = {row[0] for row in rows}
+        turns = [(message, response) for _, message, response in reversed(rows)]
+        turns += [(r.message, r.response) for r in pending if r.django_id not in saved_ids]
+        return turns[-self.history_turns:]
+
+    def build_message(self, request, conversation=None, params=None):
+        """
+        Combine the posted message with the contents of any uploaded files.
+
+        With retrieval enabled the files are indexed for the conversation and
+        only the excerpts most relevant to the message are included, drawing
+        on files uploaded earlier in the conversation as well. Files get the
+        context left after the response length requested in params.
+        """
         message = request.data.get('message', '')
         uploaded_files = []
 
         # Handle file uploads
+        max_file_bytes = getattr(settings, 'CHAT_UPLOAD_MAX_FILE_BYTES', 0)
         for key, value in request.FILES.items():
             if key.startswith('file_'):
+                if max_file_bytes and value.size > max_file_bytes:
+                    raise ValidationError({key: f"{value.name} is larger than the {max_file_bytes} byte upload limit."})
                 uploaded_files.append({
                     'name': value.name,
                     'type': value.content_type,
@@ -59,61 +291,304 @@ class ChatView(generics.GenericAPIView):
                     'file': value
                 })
 
-        # Process uploaded files and extract content if needed
-        file_contents = []
-        for uploaded_file in uploaded_files:
-            try:
-                # Read file content for text-based files
-                if uploaded_file['type'] in ['text/plain', 'application/json', 'text/markdown']:
-                    content = uploaded_file['file'].read().decode('utf-8')
-                    file_contents.append(f"Content of {uploaded_file['name']}:\n{content}")
-                elif uploaded_file['type'] == 'application/pdf':
-                    # For PDF files, we could extract text using PyPDF2
-                    file_contents.append(f"PDF file uploaded: {uploaded_file['name']} ({uploaded_file['size']} bytes)")
-                else:
-                    file_contents.append(f"File uploaded: {uploaded_file['name']} ({uploaded_file['type']}, {uploaded_file['size']} bytes)")
-            except Exception as e:
-                file_contents.append(f"Error reading {uploaded_file['name']}: {str(e)}")
+        token_budget = ai_service.prompt_token_budget(params) - uploads.count_tokens(message, ai_service.tokenizer)
+        max_read_bytes = getattr(settings, 'CHAT_UPLOAD_MAX_READ_BYTES', 1024 * 1024)
+        page_token_budget = getattr(settings, 'PDF_PAGE_TOKEN_BUDGET', 512)
+        if getattr(settings, 'RETRIEVAL_ENABLED', True):
+            file_contents = self.retrieve_excerpts(
+                request, conversation, message, uploaded_files, token_budget, max_read_bytes, page_token_budget
+            )
+        else:
+            # Stream text and PDF uploads into the prompt, shortened to what the model context can hold
+            with metrics.stage('parse_files'):
+                file_contents = uploads.attachment_contents(
+                    uploaded_files,
+                    token_budget=token_budget,
+                    max_bytes=max_read_bytes,
+                    tokenizer=ai_service.tokenizer,
+                    page_token_budget=page_token_budget
+                )
 
         # Combine message with file contents
         full_message = message
         if file_contents:
             full_message += "\n\nAttached files:\n" + "\n".join(file_contents)
 
-        # Generate AI response using the trained model
-        response = ai_service.generate_response(full_message)
+        return full_message, uploaded_files
 
-        # Parse response for artifacts (code blocks, etc.)
-        artifacts = ai_service.parse_artifacts(response)
+    def retrieve_excerpts(self, request, conversation, message, uploaded_files, token_budget,
+                          max_read_bytes, page_token_budget):
+        """
+        Prompt sections for the uploads: a line per file, then the indexed
+        chunks most relevant to the message, best first, within token_budget.
+        """
+        with metrics.stage('parse_files'):
+            sections, texts = uploads.attachment_texts(
+                uploaded_files, max_read_bytes, ai_service.tokenizer, page_token_budget
+            )
+        for index in texts:
+            sections[index] = f"Indexed file: {uploaded_files[index]['name']} ({uploaded_files[index]['size']} bytes)"
+        documents = [(uploaded_files[index]['name'], text) for index, (text, _) in texts.items()]
 
-        # Save to Django database for admin interface
-        chat_obj = Chat.objects.create(
-            user=request.user,
-            message=full_message,
-            response=response
-        )
+        with metrics.stage('retrieval'):
+            if conversation is not None:
+                key = (request.user.id, conversation.id)
+                retriever.add_documents(key, documents)
+                hits = retriever.search(key, message)
+            else:
+                hits = retriever.rank(documents, message)
+            if not hits and documents:
+                # Nothing scored as relevant, but files sent with this message must be seen
+                hits = retriever.rank(documents, '')
+
+        sections = [section for section in sections if section is not None]
+        heading = "Relevant excerpts:"
+        budget = token_budget - uploads.count_tokens("\n".join(sections + [heading]), ai_service.tokenizer)
+        excerpts = []
+        for chunk, _ in hits:
+            excerpt = f"[{chunk.source}] {chunk.text}"
+            cost = uploads.count_tokens(excerpt, ai_service.tokenizer) + 1
+            if cost > budget:
+                break
+            excerpts.append(excerpt)
+            budget -= cost
+        if excerpts:
+            sections += [heading] + excerpts
+        return sections
 
-        # Save to MongoDB with file information
+    def save_chat(self, request, full_message, response, artifacts, uploaded_files, conversation=None):
+        """
+        Hand a finished exchange to the write-behind writer for the Django
+        database and MongoDB. Returns the attachment metadata stored alongside it.
+        """
         attachments = [{
             'name': f['name'],
             'type': f['type'],
             'size': f['size']
         } for f in uploaded_files]
 
-        db = self.get_mongo_client()
-        chat_collection = db['chats']
-        chat_collection.insert_one({
-            'user_id': request.user.id,
-            'message': full_message,
+        chat_writer.submit(ChatRecord(
+            user_id=request.user.id,
+            conversation_id=conversation.id if conversation else None,
+            message=full_message,
+            response=response,
+            artifacts=artifacts,
+            attachments=attachments,
+        ))
+
+        return attachments
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatView(View):
+    """
+    Async variant of ChatView serving the chat endpoint.
+
+    Generation runs on the bounded inference executor rather than on a
+    request thread, so under ASGI auth, profile and token endpoints keep
+    their threads while chats are in progress. When the executor is
+    saturated the request is rejected with 503 and Retry-After, and a
+    generation exceeding AI_INFERENCE_TIMEOUT is cancelled with 504.
+    """
+    chat_view_class = ChatView
+
+    async def post(self, request):
+        try:
+            drf_request, conversation, full_message, uploaded_files, history, params = \
+                await sync_to_async(self.prepare)(request)
+        except APIException as e:
+            return self.error_response(e)
+        except Http404:
+            return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        cancel_event = threading.Event()
+        try:
+            future = inference_executor.submit(
+                ai_service.generate_response,
+                full_message,
+                conversation_id=conversation.id if conversation else None,
+                history=history,
+                cancel_event=cancel_event,
+                params=params
+            )
+        except ExecutorSaturated as e:
+            return JsonResponse(
+                {'detail': 'The chat service is busy. Please try again shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+
+        try:
+            response = await asyncio.wait_for(
+                asyncio.wrap_future(future), getattr(settings, 'AI_INFERENCE_TIMEOUT', 120)
+            )
+        except asyncio.TimeoutError:
+            cancel_event.set()
+            return JsonResponse(
+                {'detail': 'Generating the response took too long. Please try again.'},
+                status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
+        except asyncio.CancelledError:
+            # Client went away; stop the generation it was waiting for
+            cancel_event.set()
+            raise
+
+        artifacts = ai_service.parse_artifacts(response)
+        attachments = await sync_to_async(self.chat_view.save_chat)(
+            drf_request, full_message, response, artifacts, uploaded_files, conversation
+        )
+
+        return JsonResponse({
             'response': response,
             'artifacts': artifacts,
             'attachments': attachments,
-            'timestamp': chat_obj.timestamp,
-            'django_id': chat_obj.id
+            'conversation_id': conversation.id if conversation else None
         })
 
-        return Response({
+    @property
+    def chat_view(self):
+        return self.chat_view_class()
+
+    def prepare(self, request):
+        """
+        Authenticate and parse the request and load the conversation, using
+        the same JWT authentication and helpers as ChatView.
+        """
+        drf_request = Request(
+            request,
+            parsers=[JSONParser(), FormParser(), MultiPartParser()],
+            authenticators=[JWTAuthentication()]
+        )
+        if not drf_request.user or not drf_request.user.is_authenticated:
+            raise NotAuthenticated()
+
+        chat_view = self.chat_view
+        conversation = chat_view.get_conversation(drf_request)
+        params = chat_view.get_generation_params(drf_request)
+        full_message, uploaded_files = chat_view.build_message(drf_request, conversation, params)
+        history = chat_view.get_history(conversation)
+        return drf_request, conversation, full_message, uploaded_files, history, params
+
+    @staticmethod
+    def error_response(exc):
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = JsonResponse(data, status=exc.status_code, safe=False)
+        if isinstance(exc, NotAuthenticated) or exc.status_code == status.HTTP_401_UNAUTHORIZED:
+            response['WWW-Authenticate'] = JWTAuthentication().authenticate_header(None)
+        return response
+
+
+class ChatStreamView(ChatView):
+    """
+    Server-sent events variant of ChatView.
+
+    Emits a `token` event for every decoded text fragment and a final `done`
+    event carrying the post-processed response, artifacts and attachments.
+    The exchange is persisted once generation has finished.
+
+    Generation runs on the bounded inference executor like AsyncChatView:
+    a saturated executor answers 503 with Retry-After, and a stream still
+    running after AI_INFERENCE_TIMEOUT is cancelled with an `error` event.
+    """
+    busy_detail = 'The chat service is busy. Please try again shortly.'
+    timeout_detail = 'Generating the response took too long. Please try again.'
+
+    def post(self, request):
+        conversation = self.get_conversation(request)
+        params = self.get_generation_params(request)
+        full_message, uploaded_files = self.build_message(request, conversation, params)
+
+        chunks = queue.Queue()
+        cancel_event = threading.Event()
+        try:
+            inference_executor.submit(
+                self.produce_chunks, chunks, cancel_event, full_message,
+                conversation_id=conversation.id if conversation else None,
+                history=self.get_history(conversation),
+                params=params
+            )
+        except ExecutorSaturated as e:
+            return Response(
+                {'detail': self.busy_detail},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+        events = self.stream_events(request, full_message, uploaded_files, chunks, cancel_event, conversation, params)
+
+        # Under ASGI a sync iterator would be buffered whole, so hand it over as an async one
+        if isinstance(request._request, ASGIRequest):
+            events = self.iterate_async(events)
+
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def produce_chunks(chunks, cancel_event, prompt, **kwargs):
+        """
+        Run on an inference worker: put each decoded fragment on chunks,
+        then None, or the exception that ended generation.
+        """
+        try:
+            # Abandoned while waiting in the queue
+            if cancel_event.is_set():
+                return
+            for text in ai_service.stream_response(prompt, cancel_event=cancel_event, **kwargs):
+                chunks.put(text)
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            chunks.put(e)
+        finally:
+            chunks.put(None)
+
+    def stream_events(self, request, full_message, uploaded_files, chunks, cancel_event, conversation=None, params=None):
+        params = params or {}
+        pieces = []
+        deadline = time.monotonic() + getattr(settings, 'AI_INFERENCE_TIMEOUT', 120)
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    yield self.format_event('error', {'detail': self.timeout_detail})
+                    return
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    yield self.format_event('error', {'detail': 'Failed to generate a response.'})
+                    return
+                pieces.append(item)
+                yield self.format_event('token', {'text': item})
+        finally:
+            # Stop generating on timeout, error or a client that went away; a no-op once finished
+            cancel_event.set()
+
+        response = ai_service.finalize_response(''.join(pieces), full_message, stop=params.get('stop'))
+        artifacts = ai_service.parse_artifacts(response)
+
+        try:
+            attachments = self.save_chat(request, full_message, response, artifacts, uploaded_files, conversation)
+        except Exception as e:
+            yield self.format_event('error', {'detail': f"Failed to save chat: {e}"})
+            return
+
+        yield self.format_event('done', {
             'response': response,
             'artifacts': artifacts,
-            'attachments': attachments
+            'attachments': attachments,
+            'conversation_id': conversation.id if conversation else None
         })
+
+    @staticmethod
+    def format_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    @staticmethod
+    async def iterate_async(iterator):
+        sentinel = object()
+        while True:
+            item = await sync_to_async(next)(iterator, sentinel)
+            if item is sentinel:
+                break
+            yield item
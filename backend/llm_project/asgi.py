@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'llm_project.settings')
+os.environ.setdefault('SERVES_REQUESTS', 'True')
 
 application = get_asgi_application()
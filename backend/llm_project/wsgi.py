@@ -12,5 +12,6 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'llm_project.settings')
+os.environ.setdefault('SERVES_REQUESTS', 'True')
 
 application = get_wsgi_application()
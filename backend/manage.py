@@ -7,6 +7,10 @@ import sys
 def main():
     """Run administrative tasks."""
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'llm_project.settings')
+    if len(sys.argv) > 1 and sys.argv[1] == 'runserver':
+        # With the autoreloader only the child process serves requests
+        if os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv:
+            os.environ.setdefault('SERVES_REQUESTS', 'True')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: